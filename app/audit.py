@@ -0,0 +1,290 @@
+import asyncio
+from contextlib import suppress
+from datetime import datetime
+import json
+import logging
+import os
+from pathlib import Path
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import database
+from app.config import Settings
+from app.models import LinkAudit, StoredFile, utcnow
+from app.storage import run_io
+
+
+logger = logging.getLogger(__name__)
+
+audit_buffer: "AuditBuffer | None" = None
+
+
+def _pid_running(pid: int) -> bool:
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		return True
+	return True
+
+
+def _spool_owner(segment: Path) -> int | None:
+	"""Returns the pid of the process that owns a spool segment.
+
+	Live segments (``audit-<pid>-<seq>.jsonl``) belong to their writer; claimed
+	ones (``audit-<pid>-<seq>.replay-<pid>``) to the process replaying them.
+	"""
+	try:
+		if segment.suffix.startswith(".replay-"):
+			return int(segment.suffix.removeprefix(".replay-"))
+		return int(segment.name.split("-")[1])
+	except (IndexError, ValueError):
+		return None
+
+
+async def _insert_live_audits(db: AsyncSession, rows: list[dict]) -> int:
+	"""Inserts the rows whose file is still live and returns how many were skipped.
+
+	Audits for files that have been deleted are dropped: the purge worker
+	removes a file's audits before its row, and a late insert would otherwise
+	either fail the foreign key or leave an orphan behind.
+	"""
+	live = set(
+		await db.scalars(
+			select(StoredFile.id).where(
+				StoredFile.id.in_(list({row["file_id"] for row in rows})), StoredFile.deleted_at.is_(None)
+			)
+		)
+	)
+	kept = [row for row in rows if row["file_id"] in live]
+	if kept:
+		await db.execute(insert(LinkAudit), kept)
+	return len(rows) - len(kept)
+
+
+async def _insert_audits_one_by_one(db: AsyncSession, rows: list[dict]) -> int:
+	"""Inserts rows one savepoint at a time, dropping the ones the database rejects."""
+	skipped = 0
+	for row in rows:
+		try:
+			async with db.begin_nested():
+				skipped += await _insert_live_audits(db, [row])
+		except IntegrityError:
+			logger.warning("Dropping link audit the database rejected: %r", row, exc_info=True)
+			skipped += 1
+	return skipped
+
+
+class AuditBuffer:
+	"""Buffers LinkAudit rows in memory and bulk-inserts them in batches.
+
+	Every record is appended to a local spool segment before it is buffered, so
+	records that never reached the database are replayed on the next start.
+	A segment is deleted only after all of its records have been inserted.
+	When a batch is rejected it is retried row by row and the rows the database
+	refuses are dropped, so one bad row never holds back the rest.
+	"""
+
+	def __init__(
+		self,
+		spool_dir: Path,
+		max_batch_size: int,
+		flush_interval_seconds: float,
+		fsync: bool = False,
+	):
+		self._spool_dir = spool_dir
+		self._max_batch_size = max_batch_size
+		self._flush_interval_seconds = flush_interval_seconds
+		self._fsync = fsync
+		self._pending: list[dict] = []
+		self._segment_file = None
+		self._segment_path: Path | None = None
+		self._segment_seq = 0
+		self._sealed_segments: list[Path] = []
+		self._flush_lock = asyncio.Lock()
+		self._spool_lock = asyncio.Lock()
+		self._flush_needed = asyncio.Event()
+		self._flusher: asyncio.Task | None = None
+		self.records_flushed = 0
+		self.batches_flushed = 0
+		self.records_dropped = 0
+
+	async def start(self) -> None:
+		await run_io(lambda: self._spool_dir.mkdir(parents=True, exist_ok=True))
+		await self._replay_spool()
+		self._flusher = asyncio.create_task(self._run())
+
+	async def stop(self) -> None:
+		flusher, self._flusher = self._flusher, None
+		if flusher is not None:
+			flusher.cancel()
+			with suppress(asyncio.CancelledError):
+				await flusher
+		# Anything that fails to land here is still spooled and replayed on start.
+		with suppress(Exception):
+			await self.flush()
+		if self._segment_file is not None:
+			self._segment_file.close()
+			self._segment_file = None
+
+	async def record(self, rows: list[dict]) -> None:
+		lines = "".join(json.dumps({**row, "created_at": row["created_at"].isoformat()}) + "\n" for row in rows)
+		# Appends are serialized so rows are buffered in the order they were
+		# spooled and a flush never seals a segment mid-write.
+		async with self._spool_lock:
+			await run_io(self._append, lines)
+			self._pending.extend(rows)
+		if len(self._pending) >= self._max_batch_size:
+			self._flush_needed.set()
+
+	async def flush(self) -> None:
+		async with self._flush_lock:
+			async with self._spool_lock:
+				if not self._pending:
+					return
+				rows, self._pending = self._pending, []
+				if self._segment_path is not None:
+					await run_io(self._segment_file.close)
+					self._segment_file = None
+					self._sealed_segments.append(self._segment_path)
+					self._segment_path = None
+			try:
+				dropped = await self._insert(rows)
+			except Exception:
+				self._pending = rows + self._pending
+				raise
+			sealed, self._sealed_segments = self._sealed_segments, []
+			for segment in sealed:
+				await run_io(segment.unlink, True)
+			self.records_flushed += len(rows) - dropped
+			self.records_dropped += dropped
+			self.batches_flushed += 1
+
+	def _append(self, line: str) -> None:
+		if self._segment_file is None:
+			self._segment_seq += 1
+			self._segment_path = self._spool_dir / f"audit-{os.getpid()}-{self._segment_seq}.jsonl"
+			self._segment_file = self._segment_path.open("a", encoding="utf-8")
+		self._segment_file.write(line)
+		self._segment_file.flush()
+		if self._fsync:
+			os.fsync(self._segment_file.fileno())
+
+	async def _insert(self, rows: list[dict]) -> int:
+		"""Inserts ``rows`` and returns how many were dropped.
+
+		A rejected batch is retried row by row; errors that are not about the
+		rows themselves (the database being unreachable) are raised.
+		"""
+		async with database.AsyncSessionLocal() as session:
+			try:
+				return await database.run_write(session, lambda db: _insert_live_audits(db, rows))
+			except DBAPIError:
+				await session.rollback()
+				logger.warning("Inserting %d link audits failed; retrying one by one", len(rows), exc_info=True)
+			return await database.run_write(session, lambda db: _insert_audits_one_by_one(db, rows))
+
+	async def _replay_spool(self) -> None:
+		for segment in sorted(self._spool_dir.glob("audit-*")):
+			pid = _spool_owner(segment)
+			if pid is None:
+				continue
+			# Segments of live sibling workers are still being written to.
+			if pid != os.getpid() and _pid_running(pid):
+				continue
+			claimed = segment.with_suffix(f".replay-{os.getpid()}")
+			try:
+				await run_io(os.rename, segment, claimed)
+			except FileNotFoundError:
+				continue
+
+			text = await run_io(claimed.read_text, "utf-8")
+			rows = []
+			for line in text.splitlines():
+				try:
+					record = json.loads(line)
+				except json.JSONDecodeError:
+					# A torn final line from a crash mid-append.
+					continue
+				record["created_at"] = datetime.fromisoformat(record["created_at"])
+				# Spooled before links had ids.
+				record.setdefault("link_id", None)
+				rows.append(record)
+			if rows:
+				try:
+					dropped = await self._insert(rows)
+				except Exception:
+					# Startup must not depend on the database taking old audits;
+					# hand them to the flush loop, which deletes the segment once
+					# they land.
+					logger.warning("Replaying %s failed; retrying in the background", claimed, exc_info=True)
+					async with self._spool_lock:
+						self._pending = rows + self._pending
+						self._sealed_segments.append(claimed)
+					continue
+				self.records_flushed += len(rows) - dropped
+				self.records_dropped += dropped
+			await run_io(claimed.unlink, True)
+
+	async def _run(self) -> None:
+		while True:
+			with suppress(asyncio.TimeoutError):
+				await asyncio.wait_for(self._flush_needed.wait(), timeout=self._flush_interval_seconds)
+			self._flush_needed.clear()
+			try:
+				await self.flush()
+			except Exception:
+				# Rows stay buffered and spooled; the next tick retries.
+				await asyncio.sleep(self._flush_interval_seconds)
+
+
+def init_audit_buffer(settings: Settings) -> None:
+	global audit_buffer
+	audit_buffer = None
+	if settings.audit_buffer_enabled:
+		audit_buffer = AuditBuffer(
+			spool_dir=settings.audit_spool_dir,
+			max_batch_size=settings.audit_flush_batch_size,
+			flush_interval_seconds=settings.audit_flush_interval_ms / 1000,
+			fsync=settings.audit_spool_fsync,
+		)
+
+
+async def record_link_audits(db: AsyncSession, entries: list[tuple[int, int, int, str]]) -> None:
+	"""Records signed-link generations as ``(file_id, requester_user_id, ttl_seconds, link_id)``.
+
+	Rows are buffered when the audit buffer is on, otherwise bulk-inserted in
+	one statement.
+	"""
+	created_at = utcnow()
+	rows = [
+		{
+			"file_id": file_id,
+			"requester_user_id": requester_user_id,
+			"ttl_seconds": ttl_seconds,
+			"link_id": link_id,
+			"created_at": created_at,
+		}
+		for file_id, requester_user_id, ttl_seconds, link_id in entries
+	]
+	if not rows:
+		return
+	if audit_buffer is not None:
+		await audit_buffer.record(rows)
+		return
+
+	await database.run_write(db, lambda session: _insert_live_audits(session, rows))
+
+
+async def record_link_audit(
+	db: AsyncSession, file_id: int, requester_user_id: int, ttl_seconds: int, link_id: str
+) -> None:
+	await record_link_audits(db, [(file_id, requester_user_id, ttl_seconds, link_id)])
+
+
+async def flush_link_audits() -> None:
+	if audit_buffer is not None:
+		await audit_buffer.flush()
@@ -0,0 +1,295 @@
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+from datetime import datetime
+import time
+from typing import Any
+
+from app.config import Settings
+
+
+class TTLCache:
+	"""Bounded LRU cache whose entries also expire at a per-entry deadline.
+
+	Not thread-safe; it is only touched from the event loop.
+	"""
+
+	def __init__(
+		self,
+		max_entries: int,
+		ttl_seconds: float,
+		on_evict: Callable[[Hashable, Any], None] | None = None,
+		clock: Callable[[], float] = time.monotonic,
+	):
+		self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+		self._max_entries = max_entries
+		self._ttl_seconds = ttl_seconds
+		self._on_evict = on_evict
+		self._clock = clock
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def __len__(self) -> int:
+		return len(self._entries)
+
+	def get(self, key: Hashable) -> Any | None:
+		entry = self._entries.get(key)
+		if entry is None:
+			self.misses += 1
+			return None
+		deadline, value = entry
+		if deadline <= self._clock():
+			self._remove(key)
+			self.misses += 1
+			return None
+		self._entries.move_to_end(key)
+		self.hits += 1
+		return value
+
+	def set(self, key: Hashable, value: Any, ttl_seconds: float | None = None) -> bool:
+		ttl = self._ttl_seconds if ttl_seconds is None else min(ttl_seconds, self._ttl_seconds)
+		if ttl <= 0:
+			return False
+		if key in self._entries:
+			self._remove(key)
+		self._entries[key] = (self._clock() + ttl, value)
+		self._entries.move_to_end(key)
+		while len(self._entries) > self._max_entries:
+			oldest = next(iter(self._entries))
+			self._remove(oldest)
+			self.evictions += 1
+		return True
+
+	def pop(self, key: Hashable) -> None:
+		if key in self._entries:
+			self._remove(key)
+
+	def clear(self) -> None:
+		for key in list(self._entries):
+			self._remove(key)
+
+	def stats(self) -> dict:
+		return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+	def _remove(self, key: Hashable) -> None:
+		_, value = self._entries.pop(key)
+		if self._on_evict is not None:
+			self._on_evict(key, value)
+
+
+@dataclass(frozen=True)
+class FileMeta:
+	"""Session-independent snapshot of the StoredFile columns downloads need."""
+
+	id: int
+	owner_user_id: int
+	original_filename: str
+	content_type: str
+	size_bytes: int
+	upload_path: str
+	created_at: datetime
+	content_encoding: str | None = None
+	stored_size_bytes: int | None = None
+
+
+class DownloadCache:
+	"""Verified token payloads and file metadata for the public download path.
+
+	Token entries never outlive the token's ``exp``. Entries are indexed by
+	file so ``invalidate_file`` drops both the metadata and every cached token
+	that points at it.
+	"""
+
+	def __init__(self, max_tokens: int, max_files: int, ttl_seconds: float):
+		self._tokens_by_file: dict[int, set[str]] = {}
+		self.tokens = TTLCache(max_tokens, ttl_seconds, on_evict=self._forget_token)
+		self.files = TTLCache(max_files, ttl_seconds)
+
+	def get_token_payload(self, token: str) -> dict | None:
+		return self.tokens.get(token)
+
+	def put_token_payload(self, token: str, payload: dict) -> None:
+		expires_in = payload["exp"] - time.time()
+		if self.tokens.set(token, payload, ttl_seconds=expires_in):
+			self._tokens_by_file.setdefault(payload["file_id"], set()).add(token)
+
+	def get_file(self, file_id: int) -> FileMeta | None:
+		return self.files.get(file_id)
+
+	def put_file(self, meta: FileMeta) -> None:
+		self.files.set(meta.id, meta)
+
+	def invalidate_file(self, file_id: int) -> None:
+		self.files.pop(file_id)
+		for token in list(self._tokens_by_file.get(file_id, ())):
+			self.tokens.pop(token)
+
+	def stats(self) -> dict:
+		return {"tokens": self.tokens.stats(), "files": self.files.stats()}
+
+	def _forget_token(self, token: str, payload: dict) -> None:
+		tokens = self._tokens_by_file.get(payload["file_id"])
+		if tokens is not None:
+			tokens.discard(token)
+			if not tokens:
+				del self._tokens_by_file[payload["file_id"]]
+
+
+class ByteCache:
+	"""Contents of small, hot files, bounded by a total byte budget.
+
+	Entries are indexed by file id but only match the ``version`` they were
+	stored with (the row's creation time), so a sibling worker that never saw a
+	file deleted cannot serve its bytes for a later row reusing the id; they
+	also expire after ``ttl_seconds``. Files larger than ``max_file_bytes`` are
+	never admitted. ``lru`` evicts the least recently served entry; ``lfu``
+	evicts the least frequently served one, breaking ties by recency. Both are
+	O(1). Not thread-safe; it is only touched from the event loop.
+	"""
+
+	def __init__(
+		self,
+		max_bytes: int,
+		max_file_bytes: int,
+		policy: str = "lru",
+		ttl_seconds: float = 60.0,
+		clock: Callable[[], float] = time.monotonic,
+	):
+		if policy not in {"lru", "lfu"}:
+			raise ValueError("policy must be 'lru' or 'lfu'")
+		# file id -> (version, deadline, bytes), in recency order.
+		self._entries: OrderedDict[int, tuple[Hashable, float, bytes]] = OrderedDict()
+		self._frequencies: dict[int, int] = {}
+		# Frequency -> file ids served that often, in recency order (lfu only).
+		self._by_frequency: dict[int, OrderedDict[int, None]] = {}
+		self._min_frequency = 0
+		self.max_bytes = max_bytes
+		self.max_file_bytes = min(max_file_bytes, max_bytes)
+		self.policy = policy
+		self.ttl_seconds = ttl_seconds
+		self._clock = clock
+		self.size_bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.bytes_served = 0
+
+	def __len__(self) -> int:
+		return len(self._entries)
+
+	def admits(self, size_bytes: int) -> bool:
+		return size_bytes <= self.max_file_bytes
+
+	def _current(self, file_id: int, version: Hashable) -> bytes | None:
+		entry = self._entries.get(file_id)
+		if entry is None:
+			return None
+		entry_version, deadline, data = entry
+		if entry_version != version or deadline <= self._clock():
+			self._remove(file_id)
+			return None
+		return data
+
+	def contains(self, file_id: int, version: Hashable) -> bool:
+		return self._current(file_id, version) is not None
+
+	def get(self, file_id: int, version: Hashable) -> bytes | None:
+		data = self._current(file_id, version)
+		if data is None:
+			self.misses += 1
+			return None
+		self._entries.move_to_end(file_id)
+		self._touch(file_id)
+		self.hits += 1
+		self.bytes_served += len(data)
+		return data
+
+	def put(self, file_id: int, version: Hashable, data: bytes) -> bool:
+		if not self.admits(len(data)):
+			return False
+		self.pop(file_id)
+		while self.size_bytes + len(data) > self.max_bytes:
+			self._remove(self._victim())
+			self.evictions += 1
+		self._entries[file_id] = (version, self._clock() + self.ttl_seconds, data)
+		self._frequencies[file_id] = 1
+		self._by_frequency.setdefault(1, OrderedDict())[file_id] = None
+		self._min_frequency = 1
+		self.size_bytes += len(data)
+		return True
+
+	def pop(self, file_id: int) -> None:
+		if file_id in self._entries:
+			self._remove(file_id)
+
+	def stats(self) -> dict:
+		lookups = self.hits + self.misses
+		return {
+			"entries": len(self._entries),
+			"size_bytes": self.size_bytes,
+			"max_bytes": self.max_bytes,
+			"policy": self.policy,
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_ratio": self.hits / lookups if lookups else 0.0,
+			"bytes_served": self.bytes_served,
+			"evictions": self.evictions,
+		}
+
+	def _touch(self, file_id: int) -> None:
+		frequency = self._frequencies[file_id]
+		self._unlink(file_id, frequency)
+		self._frequencies[file_id] = frequency + 1
+		self._by_frequency.setdefault(frequency + 1, OrderedDict())[file_id] = None
+		if self._min_frequency == frequency and frequency not in self._by_frequency:
+			self._min_frequency = frequency + 1
+
+	def _unlink(self, file_id: int, frequency: int) -> None:
+		bucket = self._by_frequency[frequency]
+		del bucket[file_id]
+		if not bucket:
+			del self._by_frequency[frequency]
+
+	def _victim(self) -> int:
+		if self.policy == "lru":
+			return next(iter(self._entries))
+		if self._min_frequency not in self._by_frequency:
+			# Only after removing the last entry at the minimum; there are few distinct frequencies.
+			self._min_frequency = min(self._by_frequency)
+		return next(iter(self._by_frequency[self._min_frequency]))
+
+	def _remove(self, file_id: int) -> None:
+		_, _, data = self._entries.pop(file_id)
+		self.size_bytes -= len(data)
+		self._unlink(file_id, self._frequencies.pop(file_id))
+
+
+download_cache: DownloadCache | None = None
+byte_cache: ByteCache | None = None
+
+
+def init_download_cache(settings: Settings) -> None:
+	global byte_cache, download_cache
+	download_cache = None
+	byte_cache = None
+	if settings.download_cache_enabled:
+		download_cache = DownloadCache(
+			max_tokens=settings.download_cache_max_tokens,
+			max_files=settings.download_cache_max_files,
+			ttl_seconds=settings.download_cache_ttl_seconds,
+		)
+	if settings.download_byte_cache_bytes > 0:
+		byte_cache = ByteCache(
+			max_bytes=settings.download_byte_cache_bytes,
+			max_file_bytes=settings.download_byte_cache_max_file_bytes,
+			policy=settings.download_byte_cache_policy,
+			ttl_seconds=settings.download_cache_ttl_seconds,
+		)
+
+
+def invalidate_file(file_id: int) -> None:
+	if download_cache is not None:
+		download_cache.invalidate_file(file_id)
+	if byte_cache is not None:
+		byte_cache.pop(file_id)
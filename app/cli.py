@@ -0,0 +1,111 @@
+"""Maintenance commands that run next to a live deployment.
+
+Run from the repository root with the same environment as the API:
+
+	python -m app.cli migrate
+	python -m app.cli migrate-layout --batch-size 500 --pause-ms 100
+	python -m app.cli reconcile --dry-run
+	python -m app.cli reconcile-usage
+"""
+
+import argparse
+from dataclasses import asdict
+import json
+
+from app import database, migrations
+from app.config import get_settings
+from app.layout import migrate_layout
+from app.reconcile import reconcile_storage
+from app.usage import rebuild_usage
+
+
+def _migrate(args: argparse.Namespace) -> dict:
+	return asdict(migrations.migrate(database.engine, dry_run=args.dry_run))
+
+
+def _migrate_layout(args: argparse.Namespace) -> dict:
+	settings = get_settings()
+	with database.SessionLocal() as db:
+		report = migrate_layout(
+			db,
+			settings.upload_dir,
+			settings.upload_fanout_depth,
+			batch_size=args.batch_size,
+			pause_seconds=args.pause_ms / 1000,
+			grace_seconds=args.grace_seconds,
+		)
+	return asdict(report)
+
+
+def _reconcile(args: argparse.Namespace) -> dict:
+	settings = get_settings()
+	with database.SessionLocal() as db:
+		report = reconcile_storage(
+			db,
+			settings.upload_dir,
+			grace_seconds=args.grace_seconds,
+			tmp_grace_seconds=max(args.grace_seconds, settings.upload_session_ttl_seconds),
+			batch_size=args.batch_size,
+			max_files_per_second=args.max_files_per_second,
+			fix_missing=args.fix_missing,
+			dry_run=args.dry_run,
+		)
+		result = asdict(report)
+		# Tombstoning bypasses the per-request usage bookkeeping.
+		if report.files_tombstoned:
+			result["usage"] = asdict(rebuild_usage(db, batch_size=args.batch_size))
+	return result
+
+
+def _reconcile_usage(args: argparse.Namespace) -> dict:
+	with database.SessionLocal() as db:
+		return asdict(rebuild_usage(db, batch_size=args.batch_size, dry_run=args.dry_run))
+
+
+def main(argv: list[str] | None = None) -> None:
+	parser = argparse.ArgumentParser(prog="python -m app.cli", description=__doc__.splitlines()[0])
+	commands = parser.add_subparsers(dest="command", required=True)
+
+	migrate = commands.add_parser("migrate", help="apply pending schema migrations (safe while the API runs)")
+	migrate.add_argument("--dry-run", action="store_true", help="list pending migrations without applying them")
+	migrate.set_defaults(handler=_migrate)
+
+	layout = commands.add_parser(
+		"migrate-layout", help="move stored files into the UPLOAD_FANOUT_DEPTH directory layout"
+	)
+	layout.add_argument("--batch-size", type=int, default=500, help="files per transaction")
+	layout.add_argument("--pause-ms", type=int, default=100, help="sleep between batches")
+	layout.add_argument(
+		"--grace-seconds",
+		type=float,
+		default=120.0,
+		help="keep old paths this long after their batch commits (must exceed DOWNLOAD_CACHE_TTL_SECONDS)",
+	)
+	layout.set_defaults(handler=_migrate_layout)
+
+	reconcile = commands.add_parser(
+		"reconcile", help="remove orphaned files under UPLOAD_DIR and repair rows whose bytes are missing"
+	)
+	reconcile.add_argument("--batch-size", type=int, default=500, help="files or rows per query")
+	reconcile.add_argument("--max-files-per-second", type=float, default=1000.0, help="pace of both walks (0: unthrottled)")
+	reconcile.add_argument(
+		"--grace-seconds", type=float, default=3600.0, help="leave unreferenced files younger than this alone"
+	)
+	reconcile.add_argument(
+		"--fix-missing", action="store_true", help="tombstone files whose bytes cannot be found anywhere"
+	)
+	reconcile.add_argument("--dry-run", action="store_true", help="report without changing anything")
+	reconcile.set_defaults(handler=_reconcile)
+
+	usage = commands.add_parser("reconcile-usage", help="rebuild the per-user usage counters from stored_files")
+	usage.add_argument("--batch-size", type=int, default=500, help="users per transaction")
+	usage.add_argument("--dry-run", action="store_true", help="report drifted users without fixing them")
+	usage.set_defaults(handler=_reconcile_usage)
+
+	args = parser.parse_args(argv)
+	database.init_database(get_settings())
+	print(json.dumps(args.handler(args), indent=2))
+
+
+if __name__ == "__main__":
+	main()
@@ -10,7 +10,61 @@ class Settings:
 	upload_dir: Path
 	signing_secret: str
 	signing_algorithm: str
+	signing_keys: dict[int, str]
+	signing_key_id: int
+	token_format: str
 	max_ttl_seconds: int
+	revocation_refresh_seconds: int
+	upload_session_ttl_seconds: int
+	upload_chunk_size_bytes: int
+	upload_write_buffer_bytes: int
+	upload_io_threads: int
+	upload_fanout_depth: int
+	user_quota_bytes: int
+	storage_compression: str
+	storage_compression_level: int
+	storage_compression_min_savings_percent: int
+	storage_compressible_types: tuple[str, ...]
+	storage_backend: str
+	s3_bucket: str
+	s3_endpoint_url: str | None
+	s3_region: str | None
+	s3_access_key_id: str | None
+	s3_secret_access_key: str | None
+	s3_key_prefix: str
+	s3_presign_ttl_seconds: int
+	s3_multipart_chunk_bytes: int
+	db_pool_size: int
+	db_max_overflow: int
+	db_pool_timeout_seconds: int
+	db_pool_recycle_seconds: int
+	db_pool_pre_ping: bool
+	db_statement_timeout_ms: int
+	db_migrate_on_startup: bool
+	sqlite_wal: bool
+	sqlite_synchronous: str
+	sqlite_mmap_size_bytes: int
+	sqlite_busy_timeout_ms: int
+	sqlite_serialized_writes: bool
+	sqlite_write_batch_size: int
+	sqlite_write_batch_delay_ms: int
+	audit_buffer_enabled: bool
+	audit_flush_batch_size: int
+	audit_flush_interval_ms: int
+	audit_spool_dir: Path
+	audit_spool_fsync: bool
+	purge_interval_seconds: int
+	purge_batch_size: int
+	download_offload: str
+	download_offload_prefix: str
+	metrics_enabled: bool
+	download_cache_enabled: bool
+	download_cache_max_tokens: int
+	download_cache_max_files: int
+	download_cache_ttl_seconds: int
+	download_byte_cache_bytes: int
+	download_byte_cache_max_file_bytes: int
+	download_byte_cache_policy: str
 
 
 def _parse_positive_int_env(name: str, default: int) -> int:
@@ -26,6 +80,47 @@ def _parse_positive_int_env(name: str, default: int) -> int:
 	return value
 
 
+def _parse_signing_keys(raw_value: str) -> dict[int, str]:
+	keys: dict[int, str] = {}
+	for entry in raw_value.split(","):
+		if not entry.strip():
+			continue
+		key_id, separator, secret = entry.strip().partition(":")
+		try:
+			parsed_id = int(key_id)
+		except ValueError as exc:
+			raise ValueError("SIGNING_KEYS entries must look like <key id>:<secret>") from exc
+		if not separator or not secret or not 0 <= parsed_id <= 255:
+			raise ValueError("SIGNING_KEYS entries must look like <key id 0-255>:<secret>")
+		keys[parsed_id] = secret
+	return keys
+
+
+def _parse_non_negative_int_env(name: str, default: int) -> int:
+	raw_value = os.getenv(name)
+	if raw_value is None or raw_value.strip() == "":
+		return default
+	try:
+		value = int(raw_value)
+	except ValueError as exc:
+		raise ValueError(f"{name} must be an integer") from exc
+	if value < 0:
+		raise ValueError(f"{name} must be 0 or greater")
+	return value
+
+
+def _parse_bool_env(name: str, default: bool) -> bool:
+	raw_value = os.getenv(name)
+	if raw_value is None or raw_value.strip() == "":
+		return default
+	normalized = raw_value.strip().lower()
+	if normalized in {"1", "true", "yes", "on"}:
+		return True
+	if normalized in {"0", "false", "no", "off"}:
+		return False
+	raise ValueError(f"{name} must be a boolean")
+
+
 def get_settings() -> Settings:
 	app_name = os.getenv("APP_NAME", "Private File Service")
 	database_url = os.getenv("DATABASE_URL", "sqlite:///./data/app.db")
@@ -34,7 +129,92 @@ def get_settings() -> Settings:
 	if not signing_secret:
 		raise ValueError("SIGNING_SECRET cannot be empty")
 	signing_algorithm = os.getenv("SIGNING_ALGORITHM", "HS256")
+	signing_keys = _parse_signing_keys(os.getenv("SIGNING_KEYS", "")) or {0: signing_secret}
+	signing_key_id = _parse_non_negative_int_env("SIGNING_KEY_ID", max(signing_keys))
+	if signing_key_id not in signing_keys:
+		raise ValueError("SIGNING_KEY_ID must be one of the ids in SIGNING_KEYS")
+	token_format = os.getenv("TOKEN_FORMAT", "compact").strip().lower() or "compact"
+	if token_format not in {"compact", "jwt"}:
+		raise ValueError("TOKEN_FORMAT must be 'compact' or 'jwt'")
 	max_ttl_seconds = _parse_positive_int_env("MAX_TTL_SECONDS", 86400)
+	revocation_refresh_seconds = _parse_positive_int_env("REVOCATION_REFRESH_SECONDS", 5)
+	upload_session_ttl_seconds = _parse_positive_int_env("UPLOAD_SESSION_TTL_SECONDS", 86400)
+	upload_chunk_size_bytes = _parse_positive_int_env("UPLOAD_CHUNK_SIZE_BYTES", 1024 * 1024)
+	upload_write_buffer_bytes = _parse_positive_int_env("UPLOAD_WRITE_BUFFER_BYTES", 4 * 1024 * 1024)
+	upload_io_threads = _parse_positive_int_env("UPLOAD_IO_THREADS", 8)
+	upload_fanout_depth = _parse_non_negative_int_env("UPLOAD_FANOUT_DEPTH", 2)
+	if upload_fanout_depth > 4:
+		raise ValueError("UPLOAD_FANOUT_DEPTH must be between 0 and 4")
+	user_quota_bytes = _parse_non_negative_int_env("USER_QUOTA_BYTES", 0)
+	storage_compression = os.getenv("STORAGE_COMPRESSION", "none").strip().lower() or "none"
+	if storage_compression not in {"none", "gzip"}:
+		raise ValueError("STORAGE_COMPRESSION must be 'none' or 'gzip'")
+	storage_compression_level = _parse_positive_int_env("STORAGE_COMPRESSION_LEVEL", 6)
+	if storage_compression_level > 9:
+		raise ValueError("STORAGE_COMPRESSION_LEVEL must be between 1 and 9")
+	storage_compression_min_savings_percent = _parse_non_negative_int_env("STORAGE_COMPRESSION_MIN_SAVINGS_PERCENT", 10)
+	if storage_compression_min_savings_percent > 99:
+		raise ValueError("STORAGE_COMPRESSION_MIN_SAVINGS_PERCENT must be between 0 and 99")
+	storage_compressible_types = tuple(
+		entry.strip().lower()
+		for entry in os.getenv(
+			"STORAGE_COMPRESSIBLE_TYPES",
+			"text/*,application/json,application/xml,application/javascript,application/x-ndjson,image/svg+xml",
+		).split(",")
+		if entry.strip()
+	)
+	storage_backend = os.getenv("STORAGE_BACKEND", "local").strip().lower() or "local"
+	if storage_backend not in {"local", "s3"}:
+		raise ValueError("STORAGE_BACKEND must be 'local' or 's3'")
+	s3_bucket = os.getenv("S3_BUCKET", "").strip()
+	if storage_backend == "s3" and not s3_bucket:
+		raise ValueError("S3_BUCKET is required when STORAGE_BACKEND=s3")
+	s3_endpoint_url = os.getenv("S3_ENDPOINT_URL", "").strip() or None
+	s3_region = os.getenv("S3_REGION", "").strip() or None
+	s3_access_key_id = os.getenv("S3_ACCESS_KEY_ID", "").strip() or None
+	s3_secret_access_key = os.getenv("S3_SECRET_ACCESS_KEY", "").strip() or None
+	s3_key_prefix = os.getenv("S3_KEY_PREFIX", "blobs").strip("/")
+	s3_presign_ttl_seconds = _parse_positive_int_env("S3_PRESIGN_TTL_SECONDS", 60)
+	s3_multipart_chunk_bytes = _parse_positive_int_env("S3_MULTIPART_CHUNK_BYTES", 8 * 1024 * 1024)
+	if s3_multipart_chunk_bytes < 5 * 1024 * 1024:
+		raise ValueError("S3_MULTIPART_CHUNK_BYTES must be at least 5 MiB")
+	db_pool_size = _parse_positive_int_env("DB_POOL_SIZE", 5)
+	db_max_overflow = _parse_non_negative_int_env("DB_MAX_OVERFLOW", 10)
+	db_pool_timeout_seconds = _parse_positive_int_env("DB_POOL_TIMEOUT_SECONDS", 30)
+	db_pool_recycle_seconds = _parse_non_negative_int_env("DB_POOL_RECYCLE_SECONDS", 1800)
+	db_pool_pre_ping = _parse_bool_env("DB_POOL_PRE_PING", True)
+	db_statement_timeout_ms = _parse_non_negative_int_env("DB_STATEMENT_TIMEOUT_MS", 0)
+	db_migrate_on_startup = _parse_bool_env("DB_MIGRATE_ON_STARTUP", True)
+	sqlite_wal = _parse_bool_env("SQLITE_WAL", True)
+	sqlite_synchronous = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").strip().upper() or "NORMAL"
+	if sqlite_synchronous not in {"OFF", "NORMAL", "FULL", "EXTRA"}:
+		raise ValueError("SQLITE_SYNCHRONOUS must be one of OFF, NORMAL, FULL, EXTRA")
+	sqlite_mmap_size_bytes = _parse_non_negative_int_env("SQLITE_MMAP_SIZE_BYTES", 256 * 1024 * 1024)
+	sqlite_busy_timeout_ms = _parse_non_negative_int_env("SQLITE_BUSY_TIMEOUT_MS", 5000)
+	sqlite_serialized_writes = _parse_bool_env("SQLITE_SERIALIZED_WRITES", True)
+	sqlite_write_batch_size = _parse_positive_int_env("SQLITE_WRITE_BATCH_SIZE", 64)
+	sqlite_write_batch_delay_ms = _parse_non_negative_int_env("SQLITE_WRITE_BATCH_DELAY_MS", 0)
+	audit_buffer_enabled = _parse_bool_env("AUDIT_BUFFER_ENABLED", False)
+	audit_flush_batch_size = _parse_positive_int_env("AUDIT_FLUSH_BATCH_SIZE", 500)
+	audit_flush_interval_ms = _parse_positive_int_env("AUDIT_FLUSH_INTERVAL_MS", 200)
+	audit_spool_dir = Path(os.getenv("AUDIT_SPOOL_DIR", "data/audit-spool"))
+	audit_spool_fsync = _parse_bool_env("AUDIT_SPOOL_FSYNC", False)
+	purge_interval_seconds = _parse_positive_int_env("PURGE_INTERVAL_SECONDS", 30)
+	purge_batch_size = _parse_positive_int_env("PURGE_BATCH_SIZE", 100)
+	download_offload = os.getenv("DOWNLOAD_OFFLOAD", "none").strip().lower() or "none"
+	if download_offload not in {"none", "x-accel-redirect", "x-sendfile"}:
+		raise ValueError("DOWNLOAD_OFFLOAD must be one of none, x-accel-redirect, x-sendfile")
+	download_offload_prefix = "/" + os.getenv("DOWNLOAD_OFFLOAD_PREFIX", "/_protected/").strip("/") + "/"
+	metrics_enabled = _parse_bool_env("METRICS_ENABLED", True)
+	download_cache_enabled = _parse_bool_env("DOWNLOAD_CACHE_ENABLED", True)
+	download_cache_max_tokens = _parse_positive_int_env("DOWNLOAD_CACHE_MAX_TOKENS", 10000)
+	download_cache_max_files = _parse_positive_int_env("DOWNLOAD_CACHE_MAX_FILES", 10000)
+	download_cache_ttl_seconds = _parse_positive_int_env("DOWNLOAD_CACHE_TTL_SECONDS", 60)
+	download_byte_cache_bytes = _parse_non_negative_int_env("DOWNLOAD_BYTE_CACHE_BYTES", 0)
+	download_byte_cache_max_file_bytes = _parse_positive_int_env("DOWNLOAD_BYTE_CACHE_MAX_FILE_BYTES", 1024 * 1024)
+	download_byte_cache_policy = os.getenv("DOWNLOAD_BYTE_CACHE_POLICY", "lru").strip().lower() or "lru"
+	if download_byte_cache_policy not in {"lru", "lfu"}:
+		raise ValueError("DOWNLOAD_BYTE_CACHE_POLICY must be 'lru' or 'lfu'")
 
 	return Settings(
 		app_name=app_name,
@@ -42,5 +222,59 @@ def get_settings() -> Settings:
 		upload_dir=upload_dir,
 		signing_secret=signing_secret,
 		signing_algorithm=signing_algorithm,
+		signing_keys=signing_keys,
+		signing_key_id=signing_key_id,
+		token_format=token_format,
 		max_ttl_seconds=max_ttl_seconds,
+		revocation_refresh_seconds=revocation_refresh_seconds,
+		upload_session_ttl_seconds=upload_session_ttl_seconds,
+		upload_chunk_size_bytes=upload_chunk_size_bytes,
+		upload_write_buffer_bytes=upload_write_buffer_bytes,
+		upload_io_threads=upload_io_threads,
+		upload_fanout_depth=upload_fanout_depth,
+		user_quota_bytes=user_quota_bytes,
+		storage_compression=storage_compression,
+		storage_compression_level=storage_compression_level,
+		storage_compression_min_savings_percent=storage_compression_min_savings_percent,
+		storage_compressible_types=storage_compressible_types,
+		storage_backend=storage_backend,
+		s3_bucket=s3_bucket,
+		s3_endpoint_url=s3_endpoint_url,
+		s3_region=s3_region,
+		s3_access_key_id=s3_access_key_id,
+		s3_secret_access_key=s3_secret_access_key,
+		s3_key_prefix=s3_key_prefix,
+		s3_presign_ttl_seconds=s3_presign_ttl_seconds,
+		s3_multipart_chunk_bytes=s3_multipart_chunk_bytes,
+		db_pool_size=db_pool_size,
+		db_max_overflow=db_max_overflow,
+		db_pool_timeout_seconds=db_pool_timeout_seconds,
+		db_pool_recycle_seconds=db_pool_recycle_seconds,
+		db_pool_pre_ping=db_pool_pre_ping,
+		db_statement_timeout_ms=db_statement_timeout_ms,
+		db_migrate_on_startup=db_migrate_on_startup,
+		sqlite_wal=sqlite_wal,
+		sqlite_synchronous=sqlite_synchronous,
+		sqlite_mmap_size_bytes=sqlite_mmap_size_bytes,
+		sqlite_busy_timeout_ms=sqlite_busy_timeout_ms,
+		sqlite_serialized_writes=sqlite_serialized_writes,
+		sqlite_write_batch_size=sqlite_write_batch_size,
+		sqlite_write_batch_delay_ms=sqlite_write_batch_delay_ms,
+		audit_buffer_enabled=audit_buffer_enabled,
+		audit_flush_batch_size=audit_flush_batch_size,
+		audit_flush_interval_ms=audit_flush_interval_ms,
+		audit_spool_dir=audit_spool_dir,
+		audit_spool_fsync=audit_spool_fsync,
+		purge_interval_seconds=purge_interval_seconds,
+		purge_batch_size=purge_batch_size,
+		download_offload=download_offload,
+		download_offload_prefix=download_offload_prefix,
+		metrics_enabled=metrics_enabled,
+		download_cache_enabled=download_cache_enabled,
+		download_cache_max_tokens=download_cache_max_tokens,
+		download_cache_max_files=download_cache_max_files,
+		download_cache_ttl_seconds=download_cache_ttl_seconds,
+		download_byte_cache_bytes=download_byte_cache_bytes,
+		download_byte_cache_max_file_bytes=download_byte_cache_max_file_bytes,
+		download_byte_cache_policy=download_byte_cache_policy,
 	)
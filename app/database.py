@@ -1,17 +1,184 @@
-from sqlalchemy import create_engine
+import asyncio
+from contextlib import AsyncExitStack
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+from app import metrics
+from app.config import Settings
+from app.writer import WriteQueue
+
 
 Base = declarative_base()
 engine = None
 SessionLocal = None
+async_engine = None
+AsyncSessionLocal = None
+write_queue: WriteQueue | None = None
+
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def to_async_url(database_url: str) -> str:
+	url = make_url(database_url.replace("postgres://", "postgresql://", 1))
+	backend = url.get_backend_name()
+	if backend not in ASYNC_DRIVERS:
+		raise ValueError(f"No async driver configured for database backend '{backend}'")
+	return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+def _is_memory_sqlite(database_url: str) -> bool:
+	url = make_url(database_url)
+	return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def _engine_options(settings: Settings, is_async: bool) -> dict:
+	database_url = settings.database_url
+	options: dict = {"pool_pre_ping": settings.db_pool_pre_ping}
+	if not _is_memory_sqlite(database_url):
+		options.update(
+			pool_size=settings.db_pool_size,
+			max_overflow=settings.db_max_overflow,
+			pool_timeout=settings.db_pool_timeout_seconds,
+			pool_recycle=settings.db_pool_recycle_seconds or -1,
+		)
+
+	if database_url.startswith("sqlite"):
+		options["connect_args"] = {"check_same_thread": False}
+	elif settings.db_statement_timeout_ms:
+		timeout = str(settings.db_statement_timeout_ms)
+		if is_async:
+			options["connect_args"] = {"server_settings": {"statement_timeout": timeout}}
+		else:
+			options["connect_args"] = {"options": f"-c statement_timeout={timeout}"}
+	return options
+
+
+def _configure_sqlite(sync_engine: Engine, settings: Settings) -> None:
+	pragmas = [f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}"]
+	if settings.sqlite_wal:
+		pragmas += [
+			"PRAGMA journal_mode=WAL",
+			f"PRAGMA synchronous={settings.sqlite_synchronous}",
+			f"PRAGMA mmap_size={settings.sqlite_mmap_size_bytes}",
+			"PRAGMA temp_store=MEMORY",
+		]
+
+	@event.listens_for(sync_engine, "connect")
+	def on_connect(dbapi_connection, _connection_record) -> None:
+		# Take transaction control away from the sqlite3 module so SQLAlchemy's
+		# BEGIN/SAVEPOINT handling (used by the write queue) behaves correctly.
+		dbapi_connection.isolation_level = None
+		cursor = dbapi_connection.cursor()
+		for pragma in pragmas:
+			cursor.execute(pragma)
+		cursor.close()
+
+	@event.listens_for(sync_engine, "begin")
+	def on_begin(connection) -> None:
+		# IMMEDIATE takes the write lock up front (waiting out busy_timeout) instead of on the first write.
+		if connection.get_execution_options().get("sqlite_immediate"):
+			connection.exec_driver_sql("BEGIN IMMEDIATE")
+		else:
+			connection.exec_driver_sql("BEGIN")
+
+
+def _instrument_engine(sync_engine: Engine, label: str) -> None:
+	queries = metrics.DB_QUERIES.labels(label)
+	durations = metrics.DB_QUERY_SECONDS.labels(label)
+	errors = metrics.DB_QUERY_ERRORS.labels(label)
+
+	@event.listens_for(sync_engine, "before_cursor_execute")
+	def before_cursor_execute(connection, _cursor, _statement, _parameters, _context, _executemany) -> None:
+		connection.info.setdefault("query_started", []).append(time.perf_counter())
+
+	@event.listens_for(sync_engine, "after_cursor_execute")
+	def after_cursor_execute(connection, _cursor, _statement, _parameters, _context, _executemany) -> None:
+		queries.inc()
+		durations.observe(time.perf_counter() - connection.info["query_started"].pop())
 
+	@event.listens_for(sync_engine, "handle_error")
+	def handle_error(exception_context) -> None:
+		errors.inc()
+		connection = exception_context.connection
+		if connection is not None and connection.info.get("query_started"):
+			connection.info["query_started"].pop()
 
-def init_database(database_url: str) -> None:
-	global engine, SessionLocal
-	connect_args = {"check_same_thread": False} if database_url.startswith("sqlite") else {}
-	engine = create_engine(database_url, connect_args=connect_args)
+	metrics.watch_pool(label, sync_engine.pool)
+
+
+def init_database(settings: Settings) -> None:
+	"""Builds the sync and async engines for ``settings.database_url``.
+
+	Request handlers use the async engine; the sync engine backs schema
+	creation, background maintenance and tests.
+	"""
+	global engine, SessionLocal, async_engine, AsyncSessionLocal, write_queue
+	engine = create_engine(settings.database_url, **_engine_options(settings, is_async=False))
 	SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+	async_engine = create_async_engine(to_async_url(settings.database_url), **_engine_options(settings, is_async=True))
+	AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False, class_=AsyncSession)
+
+	if settings.metrics_enabled:
+		_instrument_engine(engine, "sync")
+		_instrument_engine(async_engine.sync_engine, "async")
+
+	write_queue = None
+	if make_url(settings.database_url).get_backend_name() == "sqlite":
+		_configure_sqlite(engine, settings)
+		_configure_sqlite(async_engine.sync_engine, settings)
+		if settings.sqlite_serialized_writes:
+			# Batched ops read before they write; taking the write lock at BEGIN
+			# waits out busy_timeout instead of failing the lock upgrade.
+			writer_sessions = async_sessionmaker(
+				async_engine.execution_options(sqlite_immediate=True),
+				autoflush=False,
+				expire_on_commit=False,
+				class_=AsyncSession,
+			)
+			write_queue = WriteQueue(
+				writer_sessions,
+				max_batch_size=settings.sqlite_write_batch_size,
+				max_delay_seconds=settings.sqlite_write_batch_delay_ms / 1000,
+			)
+
+
+async def run_write(db: AsyncSession, op):
+	"""Runs ``op(session)`` as a committed write and returns its result.
+
+	With the SQLite write queue enabled the op is group-committed by the single
+	writer task on its own session; otherwise it runs on ``db`` and commits it.
+	Objects returned by the op stay usable after commit.
+	"""
+	if write_queue is not None:
+		return await write_queue.submit(op)
+	result = await op(db)
+	await db.commit()
+	return result
+
+
+async def warm_pool(settings: Settings) -> None:
+	"""Opens the async pool's steady-state connections, and one sync connection, ahead of traffic."""
+	size = 1 if _is_memory_sqlite(settings.database_url) else settings.db_pool_size
+	async with AsyncExitStack() as stack:
+		connections = await asyncio.gather(*(stack.enter_async_context(async_engine.connect()) for _ in range(size)))
+		for connection in connections:
+			await connection.exec_driver_sql("SELECT 1")
+	with engine.connect() as connection:
+		connection.exec_driver_sql("SELECT 1")
+
+
+async def ping() -> bool:
+	try:
+		async with async_engine.connect() as connection:
+			await connection.exec_driver_sql("SELECT 1")
+	except (SQLAlchemyError, OSError, TimeoutError):
+		return False
+	return True
 
 
 def get_db():
@@ -22,3 +189,10 @@ def get_db():
 		yield session
 	finally:
 		session.close()
+
+
+async def get_async_db():
+	if AsyncSessionLocal is None:
+		raise RuntimeError("Database is not initialized")
+	async with AsyncSessionLocal() as session:
+		yield session
@@ -0,0 +1,79 @@
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from pydantic_core import to_json
+from sqlalchemy import Select
+
+from app import database
+from app.pagination import before_cursor, set_next_cursor, through_key
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Rows fetched from the cursor, encoded and sent per chunk.
+STREAM_BATCH_ROWS = 200
+
+
+def wants_ndjson(request: Request) -> bool:
+	return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def _encode_rows(query: Select, ndjson: bool):
+	"""Yields ``query``'s rows as a JSON array (or NDJSON), one batch at a time.
+
+	Columns are labelled with the response model's field names, in field
+	order, so each row becomes the same object the model would serialize to.
+	pydantic-core encodes it, so datetimes and strings come out exactly as
+	FastAPI renders ``response_model``. The query runs on its own session,
+	since the request's session may be closed before the body has been sent.
+	"""
+	async with database.AsyncSessionLocal() as session:
+		result = await session.stream(query.execution_options(yield_per=STREAM_BATCH_ROWS))
+		fields = list(result.keys())
+		if not ndjson:
+			yield b"["
+		separator = b""
+		async for rows in result.partitions():
+			items = [dict(zip(fields, row)) for row in rows]
+			if ndjson:
+				yield b"".join(to_json(item) + b"\n" for item in items)
+			else:
+				# Encoded as one list, minus its brackets, so the batch is a single call.
+				yield separator + to_json(items)[1:-1]
+				separator = b","
+		if not ndjson:
+			yield b"]"
+
+
+async def stream_page(
+	db, request: Request, query: Select, created_at_column, id_column, limit: int, cursor: str | None
+) -> StreamingResponse:
+	"""Streams one keyset page of ``query`` newest first, with the usual next-page headers.
+
+	The headers go out before the body, so the page boundary is found first
+	with a key-only probe on ``db``; the streamed query then stops at that row
+	rather than after ``limit`` rows, keeping the cursor exact even if rows
+	are added in between.
+	"""
+	keyset = before_cursor(created_at_column, id_column, cursor)
+	if keyset is not None:
+		query = query.where(keyset)
+	order = (created_at_column.desc(), id_column.desc())
+	boundary = (
+		await db.execute(
+			query.with_only_columns(created_at_column, id_column).order_by(*order).offset(limit - 1).limit(2)
+		)
+	).all()
+	# The request session is only closed after the body has been sent; give its
+	# connection back now so the stream's own session is the only one held.
+	await db.close()
+	if len(boundary) > 1:
+		query = query.where(through_key(created_at_column, id_column, *boundary[0]))
+	else:
+		query = query.limit(limit)
+
+	ndjson = wants_ndjson(request)
+	response = StreamingResponse(
+		_encode_rows(query.order_by(*order), ndjson), media_type=NDJSON_MEDIA_TYPE if ndjson else "application/json"
+	)
+	if len(boundary) > 1:
+		set_next_cursor(request, response, *boundary[0])
+	return response
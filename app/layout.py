@@ -0,0 +1,145 @@
+from collections import deque
+from dataclasses import dataclass, field
+import os
+from pathlib import Path
+import shutil
+import time
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app.models import Blob, StoredFile
+from app.storage import fanout_path
+
+
+@dataclass
+class LayoutMigrationReport:
+	moved: int = 0
+	already_in_place: int = 0
+	missing: int = 0
+	raced: int = 0
+	batches: int = 0
+	missing_paths: list[str] = field(default_factory=list)
+
+
+def _link_into_place(source: Path, target: Path) -> None:
+	target.parent.mkdir(parents=True, exist_ok=True)
+	if target.exists():
+		return
+	try:
+		os.link(source, target)
+	except OSError:
+		# Different filesystem or no hard-link support: copy, then publish atomically.
+		partial = target.with_name(f"{target.name}.partial")
+		shutil.copy2(source, partial)
+		os.replace(partial, target)
+
+
+def migrate_layout(
+	db: Session,
+	upload_dir: Path,
+	depth: int,
+	batch_size: int = 500,
+	pause_seconds: float = 0.1,
+	grace_seconds: float = 120.0,
+	sleep=time.sleep,
+	clock=time.monotonic,
+) -> LayoutMigrationReport:
+	"""Moves stored files into the ``depth``-level fan-out layout while the app keeps serving.
+
+	Each file is hard-linked at its new path before the rows pointing at it are
+	updated, so the recorded path exists at every moment. The old link is only
+	removed ``grace_seconds`` after the batch commits, which outlasts download
+	metadata cached by running workers. Row updates are compare-and-set on the
+	old path: a blob deleted or re-pointed concurrently keeps its new link
+	removed instead of orphaned.
+	"""
+	report = LayoutMigrationReport()
+	pending_unlinks: deque[tuple[float, Path]] = deque()
+
+	def unlink_due(now: float) -> None:
+		while pending_unlinks and pending_unlinks[0][0] <= now:
+			pending_unlinks.popleft()[1].unlink(missing_ok=True)
+
+	def migrate_batch(rows: list[tuple[int, str]], is_blob: bool) -> None:
+		moved: list[tuple[int, Path, Path]] = []
+		for row_id, recorded in rows:
+			source = Path(recorded)
+			target = fanout_path(upload_dir, source.name, depth)
+			if source == target:
+				report.already_in_place += 1
+				continue
+			if not source.exists() and not target.exists():
+				report.missing += 1
+				report.missing_paths.append(recorded)
+				continue
+			if source.exists():
+				_link_into_place(source, target)
+			moved.append((row_id, source, target))
+
+		committed: list[Path] = []
+		raced: list[Path] = []
+		for row_id, source, target in moved:
+			if is_blob:
+				updated = db.execute(
+					update(Blob)
+					.where(Blob.id == row_id, Blob.storage_path == str(source))
+					.values(storage_path=str(target))
+				).rowcount
+				db.execute(
+					update(StoredFile)
+					.where(StoredFile.blob_id == row_id, StoredFile.upload_path == str(source))
+					.values(upload_path=str(target))
+				)
+			else:
+				updated = db.execute(
+					update(StoredFile)
+					.where(StoredFile.id == row_id, StoredFile.upload_path == str(source))
+					.values(upload_path=str(target))
+				).rowcount
+			if updated:
+				report.moved += 1
+				committed.append(source)
+			else:
+				report.raced += 1
+				raced.append(target)
+		db.commit()
+
+		for target in raced:
+			# Deleted (or re-pointed) while we were linking; drop the link unless something uses it.
+			referenced = db.scalar(select(Blob.id).where(Blob.storage_path == str(target))) or db.scalar(
+				select(StoredFile.id).where(StoredFile.upload_path == str(target))
+			)
+			if referenced is None:
+				target.unlink(missing_ok=True)
+		deadline = clock() + grace_seconds
+		pending_unlinks.extend((deadline, source) for source in committed)
+		report.batches += 1
+
+	# Only local files have a directory layout; object storage locators are left alone.
+	queries = (
+		(select(Blob.id, Blob.storage_path).where(Blob.storage_path.not_like("%://%")), Blob.id, True),
+		(
+			select(StoredFile.id, StoredFile.upload_path).where(
+				StoredFile.blob_id.is_(None), StoredFile.upload_path.not_like("%://%")
+			),
+			StoredFile.id,
+			False,
+		),
+	)
+	for query, id_column, is_blob in queries:
+		last_id = 0
+		while True:
+			rows = db.execute(query.where(id_column > last_id).order_by(id_column).limit(batch_size)).all()
+			if not rows:
+				break
+			last_id = rows[-1][0]
+			migrate_batch([(row_id, path) for row_id, path in rows], is_blob)
+			unlink_due(clock())
+			if len(rows) == batch_size and pause_seconds > 0:
+				sleep(pause_seconds)
+
+	if pending_unlinks:
+		sleep(max(0.0, pending_unlinks[-1][0] - clock()))
+		unlink_due(float("inf"))
+	return report
@@ -1,27 +1,76 @@
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 
-from app import database
+from app import audit, cache, database, metrics, migrations, purge, revocation, search, startup, storage
 from app.config import get_settings
 from app.routes.download import router as download_router
 from app.routes.files import router as files_router
+from app.routes.uploads import expire_upload_sessions
+from app.routes.uploads import router as uploads_router
+
+
+UPLOAD_SESSION_SWEEP_SECONDS = 300
 
 
 def create_app() -> FastAPI:
+	tracker = startup.StartupTracker()
+	tracker.mark_imported()
 	settings = get_settings()
 	settings.upload_dir.mkdir(parents=True, exist_ok=True)
-	database.init_database(settings.database_url)
+	database.init_database(settings)
+	audit.init_audit_buffer(settings)
+	cache.init_download_cache(settings)
+	storage.init_storage_backend(settings)
+	purge.init_purge_worker(settings)
+	revocation.init_revocation_index(settings)
+
+	async def sweep_upload_sessions_periodically() -> None:
+		while True:
+			await asyncio.sleep(UPLOAD_SESSION_SWEEP_SECONDS)
+			async with database.AsyncSessionLocal() as db:
+				await expire_upload_sessions(db, settings.upload_dir)
 
 	@asynccontextmanager
 	async def lifespan(_: FastAPI):
 		if database.engine is None:
-			database.init_database(settings.database_url)
-		database.Base.metadata.create_all(bind=database.engine)
+			database.init_database(settings)
+		with tracker.phase("migrate"):
+			migrations.ensure_schema(database.engine, settings.db_migrate_on_startup)
+		search.init_search_index(database.engine)
+		storage.init_io_limiter(settings.upload_io_threads)
+		if database.write_queue is not None:
+			database.write_queue.start()
+		if audit.audit_buffer is not None:
+			await audit.audit_buffer.start()
+		await revocation.revocation_index.start()
+		purge.purge_worker.start()
+		sweeper = asyncio.create_task(sweep_upload_sessions_periodically())
+		with tracker.phase("warm_up"):
+			await startup.warm_up(app, settings)
+		tracker.mark_ready()
 		yield
+		tracker.mark_draining()
+		sweeper.cancel()
+		with suppress(asyncio.CancelledError):
+			await sweeper
+		await purge.purge_worker.stop()
+		await revocation.revocation_index.stop()
+		if audit.audit_buffer is not None:
+			await audit.audit_buffer.stop()
+		if database.write_queue is not None:
+			await database.write_queue.stop()
+		await database.async_engine.dispose()
 
 	app = FastAPI(title=settings.app_name, lifespan=lifespan)
+	app.state.settings = settings
+	app.state.startup = tracker
+	app.add_middleware(startup.FirstRequestMiddleware, tracker=tracker)
+	if settings.metrics_enabled:
+		app.add_middleware(metrics.MetricsMiddleware)
 
+	app.include_router(uploads_router)
 	app.include_router(files_router)
 	app.include_router(download_router)
 
@@ -29,7 +78,41 @@ def create_app() -> FastAPI:
 	def health() -> dict:
 		return {"status": "ok"}
 
+	@app.get("/ready")
+	async def ready(response: Response) -> dict:
+		# Unlike /health, 503 until this worker has migrated and warmed up, while
+		# draining on shutdown, and whenever the database cannot be reached.
+		body = tracker.stats()
+		if body["status"] == "ready" and not await database.ping():
+			body["status"] = "unavailable"
+		if body["status"] != "ready":
+			response.status_code = 503
+		return body
+
+	@app.get("/cache/stats")
+	def cache_stats() -> dict:
+		return {
+			"download": cache.download_cache.stats() if cache.download_cache is not None else None,
+			"bytes": cache.byte_cache.stats() if cache.byte_cache is not None else None,
+			"revocations": revocation.revocation_index.stats() if revocation.revocation_index is not None else None,
+		}
+
+	if settings.metrics_enabled:
+
+		@app.get("/metrics", include_in_schema=False)
+		def metrics_endpoint() -> Response:
+			return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+	tracker.mark_created()
 	return app
 
 
-app = create_app()
+def __getattr__(name: str) -> FastAPI:
+	# `uvicorn app.main:app` looks the app up with getattr, so importing this
+	# module (tests, the CLI, tooling) no longer reads the environment, creates
+	# directories or connects anywhere; the app is built on first access.
+	global app
+	if name != "app":
+		raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+	app = create_app()
+	return app
@@ -0,0 +1,291 @@
+"""Process-local Prometheus metrics with no third-party dependency.
+
+Metrics are module-level singletons updated on the hot path, so they stay
+cheap: a dict lookup per labelled child and a lock around each update.
+Every worker process exposes its own values; scrape each worker (or run one
+per container) and aggregate in Prometheus.
+"""
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections.abc import Callable, Iterable
+from contextlib import contextmanager
+import threading
+import time
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+TOKEN_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005)
+
+
+def _escape(value: str) -> str:
+	return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+	pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+	if extra:
+		pairs.append(extra)
+	return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+	if value == float("inf"):
+		return "+Inf"
+	return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+	kind = ""
+
+	def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+		self.name = name
+		self.documentation = documentation
+		self.labelnames = labelnames
+		self._children: dict[tuple[str, ...], object] = {}
+		self._lock = threading.Lock()
+		REGISTRY.append(self)
+
+	def labels(self, *values):
+		key = tuple(str(value) for value in values)
+		child = self._children.get(key)
+		if child is None:
+			with self._lock:
+				child = self._children.setdefault(key, self._new_child())
+		return child
+
+	@abstractmethod
+	def _new_child(self):
+		"""Returns the value holder for one combination of label values."""
+
+	@abstractmethod
+	def _samples(self) -> Iterable[str]:
+		"""Yields the exposition lines of every child."""
+
+	def render(self) -> str:
+		header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+		return header + "".join(f"{line}\n" for line in self._samples())
+
+
+class _Value:
+	__slots__ = ("value", "_lock")
+
+	def __init__(self):
+		self.value = 0.0
+		self._lock = threading.Lock()
+
+	def inc(self, amount: float = 1.0) -> None:
+		with self._lock:
+			self.value += amount
+
+	def dec(self, amount: float = 1.0) -> None:
+		with self._lock:
+			self.value -= amount
+
+	def set(self, value: float) -> None:
+		self.value = value
+
+
+class Counter(_Metric):
+	kind = "counter"
+
+	def _new_child(self) -> _Value:
+		return _Value()
+
+	def _samples(self) -> Iterable[str]:
+		for key, child in list(self._children.items()):
+			yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+
+
+class Gauge(Counter):
+	kind = "gauge"
+
+
+class CallbackGauge(_Metric):
+	"""Gauge whose samples are read at scrape time (e.g. connection pool state)."""
+
+	kind = "gauge"
+
+	def __init__(
+		self,
+		name: str,
+		documentation: str,
+		labelnames: tuple[str, ...],
+		collect: Callable[[], Iterable[tuple[tuple[str, ...], float]]],
+	):
+		super().__init__(name, documentation, labelnames)
+		self._collect = collect
+
+	def _new_child(self):
+		raise TypeError(f"{self.name} is read at scrape time and has no children to update")
+
+	def _samples(self) -> Iterable[str]:
+		for key, value in self._collect():
+			yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class _HistogramValue:
+	__slots__ = ("buckets", "counts", "sum", "_lock")
+
+	def __init__(self, buckets: tuple[float, ...]):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.sum = 0.0
+		self._lock = threading.Lock()
+
+	def observe(self, value: float) -> None:
+		index = bisect_left(self.buckets, value)
+		with self._lock:
+			self.counts[index] += 1
+			self.sum += value
+
+
+class Histogram(_Metric):
+	kind = "histogram"
+
+	def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+		self.buckets = tuple(buckets)
+		super().__init__(name, documentation, labelnames)
+
+	def _new_child(self) -> _HistogramValue:
+		return _HistogramValue(self.buckets)
+
+	def _samples(self) -> Iterable[str]:
+		for key, child in list(self._children.items()):
+			with child._lock:
+				counts, total = list(child.counts), child.sum
+			cumulative = 0
+			for bound, count in zip((*self.buckets, float("inf")), counts):
+				cumulative += count
+				labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+				yield f"{self.name}_bucket{labels} {cumulative}"
+			labels = _format_labels(self.labelnames, key)
+			yield f"{self.name}_sum{labels} {_format_value(total)}"
+			yield f"{self.name}_count{labels} {cumulative}"
+
+
+REGISTRY: list[_Metric] = []
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+HTTP_REQUEST_SECONDS = Histogram(
+	"http_request_duration_seconds", "Time from request start to the last response byte.", ("method", "route")
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being served.").labels()
+HTTP_REQUEST_BYTES = Counter("http_request_body_bytes_total", "Request body bytes received (uploads).", ("route",))
+HTTP_RESPONSE_BYTES = Counter("http_response_body_bytes_total", "Response body bytes sent (downloads).", ("route",))
+
+DB_QUERIES = Counter("db_queries_total", "SQL statements executed.", ("engine",))
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "SQL statement execution time.", ("engine",), DB_BUCKETS)
+DB_QUERY_ERRORS = Counter("db_query_errors_total", "SQL statements that raised.", ("engine",))
+
+TOKEN_SECONDS = Histogram(
+	"download_token_duration_seconds", "Download token encode/decode time.", ("operation", "format"), TOKEN_BUCKETS
+)
+
+STARTUP_SECONDS = Gauge(
+	"app_startup_seconds", "Seconds from process start to each startup milestone of this worker.", ("milestone",)
+)
+
+# Set in the ASGI scope of the requests a worker sends itself while warming up; they are not recorded.
+WARM_UP_SCOPE_KEY = "app.warm_up"
+
+_pools: dict[str, object] = {}
+
+
+def watch_pool(engine_label: str, pool) -> None:
+	"""Reports ``pool`` under ``engine_label``; a later call for the same label replaces it."""
+	_pools[engine_label] = pool
+
+
+def _pool_samples(read: Callable[[object], float]):
+	def collect():
+		for label, pool in list(_pools.items()):
+			# Single-connection pools (in-memory SQLite) have no size accounting.
+			if hasattr(pool, "checkedout"):
+				yield (label,), read(pool)
+
+	return collect
+
+
+CallbackGauge(
+	"db_pool_checked_out", "Connections currently checked out.", ("engine",), _pool_samples(lambda pool: pool.checkedout())
+)
+CallbackGauge("db_pool_size", "Configured pool size.", ("engine",), _pool_samples(lambda pool: pool.size()))
+CallbackGauge(
+	"db_pool_overflow", "Connections open beyond the pool size.", ("engine",), _pool_samples(lambda pool: max(pool.overflow(), 0))
+)
+CallbackGauge(
+	"db_pool_capacity",
+	"Most connections the pool will open (size + max_overflow).",
+	("engine",),
+	_pool_samples(lambda pool: pool.size() + max(getattr(pool, "_max_overflow", 0), 0)),
+)
+
+
+@contextmanager
+def timed(histogram: Histogram, *labels):
+	"""``with timed(TOKEN_SECONDS, "decode", "jwt"):`` observes the block's duration."""
+	started = time.perf_counter()
+	try:
+		yield
+	finally:
+		histogram.labels(*labels).observe(time.perf_counter() - started)
+
+
+def render() -> str:
+	return "".join(metric.render() for metric in REGISTRY)
+
+
+class MetricsMiddleware:
+	"""Pure ASGI middleware: per-route latency, status, in-flight and body bytes.
+
+	Routes are labelled by their template (``/download/{token}``), never the raw
+	path, so label cardinality stays bounded. Streaming bodies are counted as
+	they are sent, and the duration covers the last byte.
+	"""
+
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send) -> None:
+		if scope["type"] != "http" or scope.get(WARM_UP_SCOPE_KEY):
+			await self.app(scope, receive, send)
+			return
+
+		started = time.perf_counter()
+		request_bytes = 0
+		response_bytes = 0
+		status_code = 500
+
+		async def counting_receive():
+			nonlocal request_bytes
+			message = await receive()
+			if message["type"] == "http.request":
+				request_bytes += len(message.get("body", b""))
+			return message
+
+		async def counting_send(message) -> None:
+			nonlocal response_bytes, status_code
+			if message["type"] == "http.response.start":
+				status_code = message["status"]
+			elif message["type"] == "http.response.body":
+				response_bytes += len(message.get("body", b""))
+			await send(message)
+
+		HTTP_IN_FLIGHT.inc()
+		try:
+			await self.app(scope, counting_receive, counting_send)
+		finally:
+			HTTP_IN_FLIGHT.dec()
+			route = scope.get("route")
+			route_label = getattr(route, "path", None) or "unmatched"
+			method = scope["method"]
+			HTTP_REQUEST_SECONDS.labels(method, route_label).observe(time.perf_counter() - started)
+			HTTP_REQUESTS.labels(method, route_label, status_code).inc()
+			if request_bytes:
+				HTTP_REQUEST_BYTES.labels(route_label).inc(request_bytes)
+			if response_bytes:
+				HTTP_RESPONSE_BYTES.labels(route_label).inc(response_bytes)
@@ -0,0 +1,369 @@
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import logging
+import time
+
+from sqlalchemy import (
+	BigInteger,
+	Column,
+	DateTime,
+	ForeignKey,
+	Index,
+	Integer,
+	MetaData,
+	String,
+	Table,
+	delete,
+	func,
+	insert,
+	inspect,
+	select,
+	text,
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.schema import CreateColumn
+
+from app import models, search
+
+
+# Arbitrary, but fixed: every worker and `python -m app.cli migrate` must agree on it.
+POSTGRES_LOCK_KEY = 0x66696C65
+LOCK_TIMEOUT_SECONDS = 300
+
+logger = logging.getLogger(__name__)
+
+schema_migrations = Table(
+	"schema_migrations",
+	MetaData(),
+	Column("version", Integer, primary_key=True, autoincrement=False),
+	Column("name", String(255), nullable=False),
+	Column("applied_at", DateTime(timezone=True), nullable=False, default=models.utcnow),
+)
+
+# The schema as version 1 released it, spelled out rather than taken from
+# app.models: a released version must build the same tables whatever the
+# models look like later. Later changes are migrations of their own.
+_V1 = MetaData()
+
+Table(
+	"blobs",
+	_V1,
+	Column("id", Integer, primary_key=True, index=True),
+	Column("sha256", String(64), nullable=False, unique=True, index=True),
+	Column("size_bytes", Integer, nullable=False),
+	Column("storage_path", String(1024), nullable=False),
+	Column("content_encoding", String(16), nullable=True),
+	Column("stored_size_bytes", Integer, nullable=True),
+	Column("ref_count", Integer, nullable=False),
+	Column("created_at", DateTime(timezone=True), nullable=False),
+)
+Table(
+	"stored_files",
+	_V1,
+	Column("id", Integer, primary_key=True, index=True),
+	Column("owner_user_id", Integer, index=True, nullable=False),
+	Column("original_filename", String(255), nullable=False),
+	Column("stored_filename", String(255), nullable=False, unique=True),
+	Column("content_type", String(255), nullable=False),
+	Column("size_bytes", Integer, nullable=False),
+	Column("upload_path", String(1024), nullable=False),
+	Column("content_encoding", String(16), nullable=True),
+	Column("stored_size_bytes", Integer, nullable=True),
+	Column("blob_id", Integer, ForeignKey("blobs.id"), nullable=True, index=True),
+	Column("created_at", DateTime(timezone=True), nullable=False),
+	Column("deleted_at", DateTime(timezone=True), nullable=True, index=True),
+	Index("ix_stored_files_owner_created_id", "owner_user_id", "created_at", "id"),
+)
+Table(
+	"link_audits",
+	_V1,
+	Column("id", Integer, primary_key=True, index=True),
+	Column("file_id", Integer, ForeignKey("stored_files.id"), nullable=False, index=True),
+	Column("requester_user_id", Integer, nullable=False, index=True),
+	Column("ttl_seconds", Integer, nullable=False),
+	Column("link_id", String(20), nullable=True, index=True),
+	Column("created_at", DateTime(timezone=True), nullable=False),
+	Index("ix_link_audits_file_created_id", "file_id", "created_at", "id"),
+)
+Table(
+	"link_revocations",
+	_V1,
+	Column("id", Integer, primary_key=True, index=True),
+	Column("owner_user_id", Integer, nullable=False, index=True),
+	Column("link_id", String(20), nullable=True),
+	Column("file_id", Integer, nullable=True),
+	Column("issued_before", DateTime(timezone=True), nullable=True),
+	Column("expires_at", DateTime(timezone=True), nullable=False, index=True),
+	Column("created_at", DateTime(timezone=True), nullable=False, index=True),
+)
+Table(
+	"user_usage",
+	_V1,
+	Column("user_id", Integer, primary_key=True, autoincrement=False),
+	Column("bytes_used", BigInteger, nullable=False),
+	Column("file_count", Integer, nullable=False),
+	Column("last_upload_at", DateTime(timezone=True), nullable=True),
+)
+Table(
+	"upload_sessions",
+	_V1,
+	Column("id", String(32), primary_key=True),
+	Column("owner_user_id", Integer, index=True, nullable=False),
+	Column("original_filename", String(255), nullable=False),
+	Column("content_type", String(255), nullable=False),
+	Column("part_size", Integer, nullable=False),
+	Column("created_at", DateTime(timezone=True), nullable=False),
+	Column("expires_at", DateTime(timezone=True), nullable=False, index=True),
+)
+Table(
+	"upload_parts",
+	_V1,
+	Column("upload_id", String(32), ForeignKey("upload_sessions.id"), primary_key=True),
+	Column("part_number", Integer, primary_key=True),
+	Column("size_bytes", Integer, nullable=False),
+	Column("created_at", DateTime(timezone=True), nullable=False),
+)
+
+# Columns added to tables after their first release. Databases set up by
+# create_all before migrations existed may lack any of them; fresh ones get
+# them from version 1 already.
+_LATE_COLUMNS = {
+	"stored_files": ("content_encoding", "stored_size_bytes", "blob_id", "deleted_at"),
+	"link_audits": ("link_id",),
+}
+
+
+def _create_tables(connection: Connection) -> None:
+	_V1.create_all(connection)
+
+
+def _add_late_columns(connection: Connection) -> None:
+	inspector = inspect(connection)
+	quote = connection.dialect.identifier_preparer.quote
+	for table_name, column_names in _LATE_COLUMNS.items():
+		table = _V1.tables[table_name]
+		existing = {column["name"] for column in inspector.get_columns(table_name)}
+		for name in column_names:
+			if name not in existing:
+				# Nullable, so adding them never rewrites or blocks on existing rows.
+				column = CreateColumn(table.c[name]).compile(dialect=connection.dialect)
+				connection.execute(text(f"ALTER TABLE {quote(table_name)} ADD COLUMN {column}"))
+		for index in table.indexes:
+			index.create(connection, checkfirst=True)
+
+
+# The index as version 3 built it, before it was scoped to the owner; version 8 replaces it.
+_V3_SQLITE_SEARCH_DDL = (
+	"CREATE VIRTUAL TABLE IF NOT EXISTS stored_files_fts USING fts5("
+	"original_filename, content_type, content='stored_files', content_rowid='id', tokenize='trigram')",
+	"""CREATE TRIGGER IF NOT EXISTS stored_files_fts_insert AFTER INSERT ON stored_files BEGIN
+		INSERT INTO stored_files_fts(rowid, original_filename, content_type)
+		VALUES (new.id, new.original_filename, new.content_type);
+	END""",
+	"""CREATE TRIGGER IF NOT EXISTS stored_files_fts_delete AFTER DELETE ON stored_files BEGIN
+		INSERT INTO stored_files_fts(stored_files_fts, rowid, original_filename, content_type)
+		VALUES ('delete', old.id, old.original_filename, old.content_type);
+	END""",
+	"""CREATE TRIGGER IF NOT EXISTS stored_files_fts_update
+	AFTER UPDATE OF original_filename, content_type ON stored_files BEGIN
+		INSERT INTO stored_files_fts(stored_files_fts, rowid, original_filename, content_type)
+		VALUES ('delete', old.id, old.original_filename, old.content_type);
+		INSERT INTO stored_files_fts(rowid, original_filename, content_type)
+		VALUES (new.id, new.original_filename, new.content_type);
+	END""",
+	"INSERT INTO stored_files_fts(stored_files_fts) VALUES ('rebuild')",
+)
+_V3_POSTGRES_SEARCH_DDL = (
+	"CREATE EXTENSION IF NOT EXISTS pg_trgm",
+	"CREATE INDEX IF NOT EXISTS ix_stored_files_search_trgm ON stored_files "
+	"USING gin (original_filename gin_trgm_ops, content_type gin_trgm_ops)",
+)
+
+
+def _create_search_index(connection: Connection) -> None:
+	statements = {"sqlite": _V3_SQLITE_SEARCH_DDL, "postgresql": _V3_POSTGRES_SEARCH_DDL}
+	try:
+		# Optional: without FTS5's trigram tokenizer or pg_trgm, search scans.
+		with connection.begin_nested():
+			for statement in statements.get(connection.dialect.name, ()):
+				connection.execute(text(statement))
+	except DBAPIError:
+		logger.warning("Could not build the filename search index; search will scan", exc_info=True)
+
+
+def _create_owner_search_index(connection: Connection) -> None:
+	search.create_search_index(connection)
+
+
+def _backfill_usage(connection: Connection) -> None:
+	# Totals for files uploaded before user_usage existed, summed with Core
+	# against the tables as they stood at this step.
+	stored_files, user_usage = _V1.tables["stored_files"], _V1.tables["user_usage"]
+	totals = (
+		select(
+			stored_files.c.owner_user_id,
+			func.sum(stored_files.c.size_bytes),
+			func.count(),
+			func.max(stored_files.c.created_at),
+		)
+		.where(stored_files.c.deleted_at.is_(None))
+		.group_by(stored_files.c.owner_user_id)
+	)
+	connection.execute(delete(user_usage))
+	connection.execute(
+		insert(user_usage).from_select(["user_id", "bytes_used", "file_count", "last_upload_at"], totals)
+	)
+
+
+def _widen_size_columns(connection: Connection) -> None:
+	# Rewrites both tables on Postgres; SQLite's INTEGER already holds 64 bits.
+	if connection.dialect.name != "postgresql":
+		return
+	for table_name in ("blobs", "stored_files"):
+		connection.execute(
+			text(
+				f"ALTER TABLE {table_name} ALTER COLUMN size_bytes TYPE BIGINT, "
+				"ALTER COLUMN stored_size_bytes TYPE BIGINT"
+			)
+		)
+
+
+def _add_upload_completing_at(connection: Connection) -> None:
+	column = Column("completing_at", DateTime(timezone=True), nullable=True)
+	ddl = CreateColumn(column).compile(dialect=connection.dialect)
+	connection.execute(text(f"ALTER TABLE upload_sessions ADD COLUMN {ddl}"))
+
+
+def _create_bundle_files(connection: Connection) -> None:
+	table = Table(
+		"bundle_files",
+		MetaData(),
+		Column("link_id", String(20), primary_key=True),
+		Column("position", Integer, primary_key=True, autoincrement=False),
+		Column("file_id", Integer, nullable=False),
+		Column("expires_at", DateTime(timezone=True), nullable=False, index=True),
+	)
+	table.create(connection)
+
+
+def _create_requester_audit_index(connection: Connection) -> None:
+	connection.execute(
+		text(
+			"CREATE INDEX IF NOT EXISTS ix_link_audits_requester_created_id "
+			"ON link_audits (requester_user_id, created_at, id)"
+		)
+	)
+
+
+# Append only: a version, once released, never changes meaning. Each step runs
+# in the same transaction as the row recording it.
+MIGRATIONS: tuple[tuple[int, str, Callable[[Connection], None]], ...] = (
+	(1, "create tables", _create_tables),
+	(2, "add columns to tables created before migrations", _add_late_columns),
+	(3, "filename search index", _create_search_index),
+	(4, "backfill user usage totals", _backfill_usage),
+	(5, "64-bit file sizes", _widen_size_columns),
+	(6, "upload session completion marker", _add_upload_completing_at),
+	(7, "server-side bundle membership", _create_bundle_files),
+	(8, "owner-scoped filename search index", _create_owner_search_index),
+	(9, "link audits by requester in keyset order", _create_requester_audit_index),
+)
+HEAD = MIGRATIONS[-1][0]
+
+
+@dataclass
+class MigrationReport:
+	from_version: int
+	to_version: int
+	applied: list[str] = field(default_factory=list)
+	pending: list[str] = field(default_factory=list)
+
+
+def _applied_versions(connection: Connection) -> set[int]:
+	if not inspect(connection).has_table(schema_migrations.name):
+		return set()
+	return set(connection.scalars(select(schema_migrations.c.version)))
+
+
+def current_version(engine: Engine) -> int:
+	with engine.connect() as connection:
+		return max(_applied_versions(connection), default=0)
+
+
+@contextmanager
+def _locked(engine: Engine) -> Iterator[Connection]:
+	"""A transaction holding the migration lock, so only one process migrates at a time.
+
+	Postgres takes a transaction-scoped advisory lock; SQLite takes the
+	database write lock with BEGIN IMMEDIATE. Either way the lock is released
+	when the transaction ends, and waiters then find the work already done.
+	"""
+	if engine.dialect.name == "postgresql":
+		with engine.begin() as connection:
+			connection.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT_SECONDS}s'"))
+			connection.execute(select(func.pg_advisory_xact_lock(POSTGRES_LOCK_KEY)))
+			yield connection
+		return
+	if engine.dialect.name != "sqlite":
+		with engine.begin() as connection:
+			yield connection
+		return
+
+	deadline = time.monotonic() + LOCK_TIMEOUT_SECONDS
+	while True:
+		connection = engine.connect().execution_options(sqlite_immediate=True)
+		try:
+			transaction = connection.begin()
+		except OperationalError:
+			# Another process is migrating (or writing) for longer than busy_timeout.
+			connection.close()
+			if time.monotonic() > deadline:
+				raise
+			time.sleep(0.1)
+			continue
+		break
+	with connection, transaction:
+		yield connection
+
+
+def migrate(engine: Engine, dry_run: bool = False) -> MigrationReport:
+	"""Brings the schema to ``HEAD``; a no-op costing one query when it is already there.
+
+	Safe to run from every worker at once: the first to take the lock applies
+	the pending steps, the rest wait for it and then find nothing to do.
+	"""
+	version = current_version(engine)
+	report = MigrationReport(from_version=version, to_version=version)
+	if version >= HEAD:
+		return report
+	if dry_run:
+		report.pending = [f"{number}: {name}" for number, name, _ in MIGRATIONS if number > version]
+		return report
+
+	with _locked(engine) as connection:
+		schema_migrations.create(connection, checkfirst=True)
+		applied = _applied_versions(connection)
+		for number, name, step in MIGRATIONS:
+			if number in applied:
+				continue
+			started = time.perf_counter()
+			step(connection)
+			connection.execute(schema_migrations.insert().values(version=number, name=name))
+			logger.info("Applied migration %d (%s) in %.2fs", number, name, time.perf_counter() - started)
+			report.applied.append(f"{number}: {name}")
+		report.to_version = max(applied | {number for number, _, _ in MIGRATIONS})
+	return report
+
+
+def ensure_schema(engine: Engine, migrate_on_startup: bool) -> MigrationReport:
+	"""Startup check: migrates when allowed, otherwise refuses to serve an older schema."""
+	if migrate_on_startup:
+		return migrate(engine)
+	version = current_version(engine)
+	if version < HEAD:
+		raise RuntimeError(
+			f"Database schema is at version {version}, this build needs {HEAD}; run `python -m app.cli migrate`"
+		)
+	return MigrationReport(from_version=version, to_version=version)
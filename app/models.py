@@ -1,15 +1,40 @@
 from datetime import datetime, timezone
 
-from sqlalchemy import DateTime, ForeignKey, Integer, String
+from sqlalchemy import BigInteger, DateTime, ForeignKey, Index, Integer, String
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.database import Base
 
 
+# File sizes can pass 2 GiB. SQLite's INTEGER is 64-bit already (and BIGINT would only rename it).
+ByteCount = BigInteger().with_variant(Integer, "sqlite")
+
+
 def utcnow() -> datetime:
 	return datetime.now(timezone.utc)
 
 
+def as_utc(value: datetime) -> datetime:
+	# SQLite drops tzinfo on round-trip; stored timestamps are always UTC.
+	if value.tzinfo is None:
+		return value.replace(tzinfo=timezone.utc)
+	return value.astimezone(timezone.utc)
+
+
+class Blob(Base):
+	__tablename__ = "blobs"
+
+	id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+	sha256: Mapped[str] = mapped_column(String(64), nullable=False, unique=True, index=True)
+	size_bytes: Mapped[int] = mapped_column(ByteCount, nullable=False)
+	storage_path: Mapped[str] = mapped_column(String(1024), nullable=False)
+	# Codec of the bytes at rest (``gzip``) or NULL when they are stored as uploaded.
+	content_encoding: Mapped[str | None] = mapped_column(String(16), nullable=True)
+	stored_size_bytes: Mapped[int | None] = mapped_column(ByteCount, nullable=True)
+	ref_count: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
+	created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, nullable=False)
+
+
 class StoredFile(Base):
 	__tablename__ = "stored_files"
 
@@ -18,12 +43,20 @@ class StoredFile(Base):
 	original_filename: Mapped[str] = mapped_column(String(255), nullable=False)
 	stored_filename: Mapped[str] = mapped_column(String(255), nullable=False, unique=True)
 	content_type: Mapped[str] = mapped_column(String(255), nullable=False)
-	size_bytes: Mapped[int] = mapped_column(Integer, nullable=False)
+	size_bytes: Mapped[int] = mapped_column(ByteCount, nullable=False)
 	upload_path: Mapped[str] = mapped_column(String(1024), nullable=False)
+	# Copied from the blob like upload_path, so downloads never join.
+	content_encoding: Mapped[str | None] = mapped_column(String(16), nullable=True)
+	stored_size_bytes: Mapped[int | None] = mapped_column(ByteCount, nullable=True)
+	blob_id: Mapped[int | None] = mapped_column(ForeignKey("blobs.id"), nullable=True, index=True)
 	created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, nullable=False)
+	# Set by DELETE /files/{file_id}; the purge worker removes the row, its audits and its bytes later.
+	deleted_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True, index=True)
 
 	link_audits: Mapped[list["LinkAudit"]] = relationship(back_populates="file")
 
+	__table_args__ = (Index("ix_stored_files_owner_created_id", "owner_user_id", "created_at", "id"),)
+
 
 class LinkAudit(Base):
 	__tablename__ = "link_audits"
@@ -32,6 +65,92 @@ class LinkAudit(Base):
 	file_id: Mapped[int] = mapped_column(ForeignKey("stored_files.id"), nullable=False, index=True)
 	requester_user_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
 	ttl_seconds: Mapped[int] = mapped_column(Integer, nullable=False)
+	# Id carried by the signed token; a bundle link shares one id across its files.
+	link_id: Mapped[str | None] = mapped_column(String(20), nullable=True, index=True)
 	created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, nullable=False)
 
 	file: Mapped[StoredFile] = relationship(back_populates="link_audits")
+
+	__table_args__ = (
+		Index("ix_link_audits_file_created_id", "file_id", "created_at", "id"),
+		# Serves the owner's audit listing in keyset order; only owners mint links.
+		Index("ix_link_audits_requester_created_id", "requester_user_id", "created_at", "id"),
+	)
+
+
+class LinkRevocation(Base):
+	"""One revoked link (``link_id``) or a "not before" watermark for a file or a whole user.
+
+	Watermarks revoke every link whose id encodes an issue time at or before
+	``issued_before``. Rows are pruned once ``expires_at`` has passed, since no
+	token they cover can still verify.
+	"""
+
+	__tablename__ = "link_revocations"
+
+	id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+	owner_user_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+	link_id: Mapped[str | None] = mapped_column(String(20), nullable=True)
+	file_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+	issued_before: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+	expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+	created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, nullable=False, index=True)
+
+
+class BundleFile(Base):
+	"""One file of a bundle link, whose token only carries the ``link_id``.
+
+	Keeps tokens short however many files a bundle has. Rows are pruned with
+	revocations once ``expires_at`` has passed.
+	"""
+
+	__tablename__ = "bundle_files"
+
+	link_id: Mapped[str] = mapped_column(String(20), primary_key=True)
+	position: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+	file_id: Mapped[int] = mapped_column(Integer, nullable=False)
+	expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class UserUsage(Base):
+	"""Running totals of each user's live files, kept in step with ``stored_files``.
+
+	Uploads add to it and deletes subtract from it in the same transaction as
+	the file row change; ``python -m app.cli reconcile-usage`` rebuilds it.
+	"""
+
+	__tablename__ = "user_usage"
+
+	user_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+	bytes_used: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+	file_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+	last_upload_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class UploadSession(Base):
+	__tablename__ = "upload_sessions"
+
+	id: Mapped[str] = mapped_column(String(32), primary_key=True)
+	owner_user_id: Mapped[int] = mapped_column(Integer, index=True, nullable=False)
+	original_filename: Mapped[str] = mapped_column(String(255), nullable=False)
+	content_type: Mapped[str] = mapped_column(String(255), nullable=False)
+	part_size: Mapped[int] = mapped_column(Integer, nullable=False)
+	created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, nullable=False)
+	expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+	# Set while POST .../complete hashes the session file; part uploads are refused meanwhile.
+	completing_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+	parts: Mapped[list["UploadPart"]] = relationship(
+		back_populates="session", cascade="all, delete-orphan", order_by="UploadPart.part_number"
+	)
+
+
+class UploadPart(Base):
+	__tablename__ = "upload_parts"
+
+	upload_id: Mapped[str] = mapped_column(ForeignKey("upload_sessions.id"), primary_key=True)
+	part_number: Mapped[int] = mapped_column(Integer, primary_key=True)
+	size_bytes: Mapped[int] = mapped_column(Integer, nullable=False)
+	created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, nullable=False)
+
+	session: Mapped[UploadSession] = relationship(back_populates="parts")
@@ -0,0 +1,42 @@
+import base64
+from datetime import datetime
+
+from fastapi import HTTPException, Request, Response, status
+from sqlalchemy import and_, or_
+
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+	raw = f"{created_at.isoformat()}|{row_id}".encode()
+	return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+	try:
+		raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+		created_at, row_id = raw.split("|", 1)
+		return datetime.fromisoformat(created_at), int(row_id)
+	except ValueError as exc:
+		raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from exc
+
+
+def before_cursor(created_at_column, id_column, cursor: str | None):
+	"""Keyset predicate for rows after ``cursor`` in (created_at DESC, id DESC) order."""
+	if cursor is None:
+		return None
+	created_at, row_id = decode_cursor(cursor)
+	return or_(created_at_column < created_at, and_(created_at_column == created_at, id_column < row_id))
+
+
+def through_key(created_at_column, id_column, created_at: datetime, row_id: int):
+	"""Keyset predicate for rows up to and including ``(created_at, row_id)`` in the same order."""
+	return or_(created_at_column > created_at, and_(created_at_column == created_at, id_column >= row_id))
+
+
+def set_next_cursor(request: Request, response: Response, created_at: datetime, row_id: int) -> None:
+	next_cursor = encode_cursor(created_at, row_id)
+	response.headers["X-Next-Cursor"] = next_cursor
+	response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
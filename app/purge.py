@@ -0,0 +1,131 @@
+import asyncio
+from contextlib import suppress
+import logging
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import database
+from app.config import Settings
+from app.models import LinkAudit, StoredFile
+from app.storage import backend_for, release_blob, run_io
+
+
+AUDIT_DELETE_CHUNK_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+purge_worker: "PurgeWorker | None" = None
+
+
+async def _delete_audit_chunk(db: AsyncSession, file_ids: list[int]) -> int:
+	chunk = select(LinkAudit.id).where(LinkAudit.file_id.in_(file_ids)).limit(AUDIT_DELETE_CHUNK_SIZE)
+	result = await db.execute(
+		delete(LinkAudit).where(LinkAudit.id.in_(chunk)).execution_options(synchronize_session=False)
+	)
+	return result.rowcount
+
+
+async def _purge_rows(db: AsyncSession, file_ids: list[int]) -> list[str]:
+	"""Deletes tombstoned rows and returns the locators whose bytes are now unreferenced."""
+	rows = (
+		await db.execute(
+			select(StoredFile.id, StoredFile.blob_id, StoredFile.upload_path).where(
+				StoredFile.id.in_(file_ids), StoredFile.deleted_at.is_not(None)
+			)
+		)
+	).all()
+	locators = []
+	for row in rows:
+		# Another worker may be purging the same batch; only the one whose delete
+		# hits the row releases the blob reference.
+		result = await db.execute(
+			delete(StoredFile).where(StoredFile.id == row.id).execution_options(synchronize_session=False)
+		)
+		if not result.rowcount:
+			continue
+		locator = row.upload_path if row.blob_id is None else await release_blob(db, row.blob_id)
+		if locator is not None:
+			locators.append(locator)
+	return locators
+
+
+class PurgeWorker:
+	"""Finishes tombstoned deletes in the background.
+
+	Each pass takes up to ``batch_size`` tombstoned files, removes their link
+	audits in bounded chunks, then the rows (releasing blob references) in one
+	write, and only after that commit deletes the unreferenced bytes on the
+	I/O pool. A pass that finds a full batch is followed immediately by the
+	next; otherwise the worker sleeps for ``interval_seconds``.
+	"""
+
+	def __init__(self, batch_size: int, interval_seconds: float):
+		self._batch_size = batch_size
+		self._interval_seconds = interval_seconds
+		self._worker: asyncio.Task | None = None
+		self.files_purged = 0
+		self.audits_purged = 0
+		self.blobs_deleted = 0
+		self.errors = 0
+
+	def start(self) -> None:
+		if self._worker is None:
+			self._worker = asyncio.create_task(self._run())
+
+	async def stop(self) -> None:
+		worker, self._worker = self._worker, None
+		if worker is not None:
+			worker.cancel()
+			with suppress(asyncio.CancelledError):
+				await worker
+
+	async def run_once(self) -> int:
+		# Audits still buffered in any worker for these files are dropped when
+		# they are inserted, so no flush is needed here.
+		async with database.AsyncSessionLocal() as db:
+			file_ids = list(
+				await db.scalars(
+					select(StoredFile.id)
+					.where(StoredFile.deleted_at.is_not(None))
+					.order_by(StoredFile.deleted_at, StoredFile.id)
+					.limit(self._batch_size)
+				)
+			)
+			await db.close()
+			if not file_ids:
+				return 0
+
+			while removed := await database.run_write(db, lambda session: _delete_audit_chunk(session, file_ids)):
+				self.audits_purged += removed
+			locators = await database.run_write(db, lambda session: _purge_rows(session, file_ids))
+
+		for locator in locators:
+			await run_io(backend_for(locator).delete, locator)
+		self.files_purged += len(file_ids)
+		self.blobs_deleted += len(locators)
+		return len(file_ids)
+
+	def stats(self) -> dict:
+		return {
+			"files_purged": self.files_purged,
+			"audits_purged": self.audits_purged,
+			"blobs_deleted": self.blobs_deleted,
+			"errors": self.errors,
+		}
+
+	async def _run(self) -> None:
+		while True:
+			try:
+				purged = await self.run_once()
+			except Exception:
+				self.errors += 1
+				logger.exception("Purging deleted files failed")
+				purged = 0
+			if purged < self._batch_size:
+				await asyncio.sleep(self._interval_seconds)
+
+
+def init_purge_worker(settings: Settings) -> None:
+	global purge_worker
+	purge_worker = PurgeWorker(settings.purge_batch_size, settings.purge_interval_seconds)
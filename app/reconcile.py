@@ -0,0 +1,177 @@
+from dataclasses import dataclass, field
+import os
+from pathlib import Path
+import time
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app.models import Blob, StoredFile, utcnow
+from app.storage import TMP_DIR_NAME, blob_sha256, locate_file
+
+
+@dataclass
+class ReconcileReport:
+	files_scanned: int = 0
+	orphan_files: int = 0
+	orphan_bytes: int = 0
+	stale_tmp_files: int = 0
+	rows_checked: int = 0
+	rows_relocated: int = 0
+	rows_missing: int = 0
+	files_tombstoned: int = 0
+	orphan_paths: list[str] = field(default_factory=list)
+	missing_paths: list[str] = field(default_factory=list)
+
+
+class _Throttle:
+	"""Sleeps between batches so a pass stays under ``max_files_per_second``."""
+
+	def __init__(self, max_files_per_second: float, sleep, clock):
+		self._interval = 1 / max_files_per_second if max_files_per_second > 0 else 0.0
+		self._sleep = sleep
+		self._clock = clock
+		self._started = clock()
+		self._count = 0
+
+	def pace(self, files: int) -> None:
+		self._count += files
+		ahead = self._started + self._count * self._interval - self._clock()
+		if ahead > 0:
+			self._sleep(ahead)
+
+
+def _iter_upload_dir(upload_dir: Path):
+	"""Yields every file under ``upload_dir`` lazily, one directory at a time."""
+	pending = [upload_dir]
+	while pending:
+		directory = pending.pop()
+		with os.scandir(directory) as entries:
+			for entry in entries:
+				if entry.is_dir(follow_symlinks=False):
+					if entry.name != TMP_DIR_NAME:
+						pending.append(Path(entry.path))
+				elif entry.is_file(follow_symlinks=False):
+					yield Path(entry.path)
+
+
+def _batched(iterable, size: int):
+	batch = []
+	for item in iterable:
+		batch.append(item)
+		if len(batch) == size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+
+def reconcile_storage(
+	db: Session,
+	upload_dir: Path,
+	grace_seconds: float = 3600.0,
+	tmp_grace_seconds: float = 86400.0,
+	batch_size: int = 500,
+	max_files_per_second: float = 1000.0,
+	fix_missing: bool = False,
+	dry_run: bool = False,
+	sleep=time.sleep,
+	clock=time.monotonic,
+	now=time.time,
+) -> ReconcileReport:
+	"""Finds and repairs disagreements between ``UPLOAD_DIR`` and the database.
+
+	* Files on disk that no blob or legacy row names, older than
+	  ``grace_seconds`` (so uploads between rename and commit are left alone),
+	  are removed; so are temp files older than ``tmp_grace_seconds``.
+	* Rows whose bytes are missing are re-pointed when the file exists under
+	  another fan-out layout. Otherwise they are reported, and with
+	  ``fix_missing`` their files are tombstoned for the purge worker.
+
+	Both walks go in batches of ``batch_size`` with one query per batch and are
+	paced to ``max_files_per_second`` so a pass never competes with live I/O.
+	"""
+	report = ReconcileReport()
+	throttle = _Throttle(max_files_per_second, sleep, clock)
+
+	def remove(path: Path) -> None:
+		if not dry_run:
+			path.unlink(missing_ok=True)
+
+	tmp_path = upload_dir / TMP_DIR_NAME
+	if tmp_path.is_dir():
+		with os.scandir(tmp_path) as entries:
+			for entry in entries:
+				if entry.is_file(follow_symlinks=False) and now() - entry.stat().st_mtime > tmp_grace_seconds:
+					report.stale_tmp_files += 1
+					remove(Path(entry.path))
+
+	for batch in _batched(_iter_upload_dir(upload_dir), batch_size):
+		# Matched by name rather than full path, so a changed UPLOAD_DIR spelling
+		# (relative vs absolute) can never make live files look orphaned.
+		names = [path.name for path in batch]
+		digests = {blob_sha256(name) for name in names} - {None}
+		# A digest has at most one blob row; files for it under any other name are leftovers.
+		known = {Path(path).name for path in db.scalars(select(Blob.storage_path).where(Blob.sha256.in_(digests)))}
+		known.update(db.scalars(select(StoredFile.stored_filename).where(StoredFile.stored_filename.in_(names))))
+		for path in batch:
+			report.files_scanned += 1
+			if path.name in known:
+				continue
+			try:
+				stat_result = path.stat()
+			except FileNotFoundError:
+				continue
+			if now() - stat_result.st_mtime <= grace_seconds:
+				continue
+			report.orphan_files += 1
+			report.orphan_bytes += stat_result.st_size
+			report.orphan_paths.append(str(path))
+			remove(path)
+		throttle.pace(len(batch))
+
+	def check_rows(query, id_column, is_blob: bool) -> None:
+		last_id = 0
+		while True:
+			rows = db.execute(query.where(id_column > last_id).order_by(id_column).limit(batch_size)).all()
+			if not rows:
+				return
+			last_id = rows[-1][0]
+			for row_id, recorded in rows:
+				report.rows_checked += 1
+				try:
+					found, _ = locate_file(upload_dir, Path(recorded))
+				except FileNotFoundError:
+					report.rows_missing += 1
+					report.missing_paths.append(recorded)
+					if fix_missing and not dry_run:
+						owner_filter = StoredFile.blob_id == row_id if is_blob else StoredFile.id == row_id
+						report.files_tombstoned += db.execute(
+							update(StoredFile)
+							.where(owner_filter, StoredFile.deleted_at.is_(None))
+							.values(deleted_at=utcnow())
+						).rowcount
+					continue
+				if str(found) != recorded:
+					report.rows_relocated += 1
+					if not dry_run:
+						if is_blob:
+							db.execute(update(Blob).where(Blob.id == row_id).values(storage_path=str(found)))
+						db.execute(
+							update(StoredFile)
+							.where(StoredFile.blob_id == row_id if is_blob else StoredFile.id == row_id)
+							.values(upload_path=str(found))
+						)
+			db.commit()
+			throttle.pace(len(rows))
+
+	# Object storage locators are not under UPLOAD_DIR.
+	check_rows(select(Blob.id, Blob.storage_path).where(Blob.storage_path.not_like("%://%")), Blob.id, True)
+	check_rows(
+		select(StoredFile.id, StoredFile.upload_path).where(
+			StoredFile.blob_id.is_(None), StoredFile.deleted_at.is_(None), StoredFile.upload_path.not_like("%://%")
+		),
+		StoredFile.id,
+		False,
+	)
+	return report
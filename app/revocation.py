@@ -0,0 +1,172 @@
+import asyncio
+from contextlib import suppress
+from datetime import timedelta
+import logging
+import time
+
+from sqlalchemy import delete, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import database
+from app.config import Settings
+from app.models import BundleFile, LinkRevocation, as_utc, utcnow
+from app.utils import link_issued_at_ms
+
+
+# Postgres can commit ids out of order; re-reading recent rows catches late ones.
+REFRESH_LOOKBACK_SECONDS = 60
+PRUNE_INTERVAL_SECONDS = 300
+
+logger = logging.getLogger(__name__)
+
+revocation_index: "RevocationIndex | None" = None
+
+
+def _watermark_ms(row: LinkRevocation) -> int:
+	return int(as_utc(row.issued_before).timestamp() * 1000)
+
+
+class RevocationIndex:
+	"""Per-worker, in-memory view of ``link_revocations`` consulted on every download.
+
+	Revoked link ids sit in a dict (id -> expiry); file and user revocations
+	collapse into a single "not before" watermark per key, so a check is at
+	most three dict lookups however many links were revoked, and none while
+	nothing is revoked. Revocations made by this worker apply immediately;
+	other workers' are picked up every ``refresh_seconds``. Entries are dropped
+	once every token they cover has expired.
+	"""
+
+	def __init__(self, refresh_seconds: float, clock=time.time):
+		self._refresh_seconds = refresh_seconds
+		self._clock = clock
+		self._links: dict[str, float] = {}
+		self._files: dict[int, tuple[int, float]] = {}
+		self._users: dict[int, tuple[int, float]] = {}
+		self._last_id = 0
+		self._last_prune = 0.0
+		self._worker: asyncio.Task | None = None
+		self.refreshes = 0
+		self.rows_pruned = 0
+		self.errors = 0
+
+	def is_revoked(self, file_id: int | None, owner_user_id: int, link_id: str | None) -> bool:
+		"""``file_id=None`` checks only the link itself and its owner's watermark."""
+		if not (self._links or self._files or self._users):
+			return False
+		if link_id is not None and link_id in self._links:
+			return True
+		# Tokens minted before links had ids count as issued at time 0.
+		issued_at_ms = link_issued_at_ms(link_id)
+		if file_id is not None:
+			watermark = self._files.get(file_id)
+			if watermark is not None and issued_at_ms <= watermark[0]:
+				return True
+		watermark = self._users.get(owner_user_id)
+		return watermark is not None and issued_at_ms <= watermark[0]
+
+	def apply(self, row: LinkRevocation) -> None:
+		expires_at = as_utc(row.expires_at).timestamp()
+		if row.link_id is not None:
+			self._links[row.link_id] = max(expires_at, self._links.get(row.link_id, 0.0))
+			return
+		watermarks, key = (self._files, row.file_id) if row.file_id is not None else (self._users, row.owner_user_id)
+		watermark_ms = _watermark_ms(row)
+		current = watermarks.get(key)
+		if current is not None:
+			watermark_ms, expires_at = max(watermark_ms, current[0]), max(expires_at, current[1])
+		watermarks[key] = (watermark_ms, expires_at)
+
+	def prune(self) -> None:
+		now = self._clock()
+		self._links = {link_id: expires for link_id, expires in self._links.items() if expires > now}
+		self._files = {key: entry for key, entry in self._files.items() if entry[1] > now}
+		self._users = {key: entry for key, entry in self._users.items() if entry[1] > now}
+
+	async def refresh(self) -> int:
+		now = utcnow()
+		async with database.AsyncSessionLocal() as db:
+			rows = list(
+				await db.scalars(
+					select(LinkRevocation)
+					.where(
+						or_(
+							LinkRevocation.id > self._last_id,
+							LinkRevocation.created_at >= now - timedelta(seconds=REFRESH_LOOKBACK_SECONDS),
+						),
+						LinkRevocation.expires_at > now,
+					)
+					.order_by(LinkRevocation.id)
+				)
+			)
+		for row in rows:
+			self.apply(row)
+			self._last_id = max(self._last_id, row.id)
+		self.prune()
+		self.refreshes += 1
+		return len(rows)
+
+	async def prune_rows(self) -> int:
+		"""Deletes revocations, and bundle memberships, that no unexpired token can use."""
+
+		async def delete_expired(session: AsyncSession) -> int:
+			now = utcnow()
+			result = await session.execute(delete(LinkRevocation).where(LinkRevocation.expires_at <= now))
+			bundles = await session.execute(delete(BundleFile).where(BundleFile.expires_at <= now))
+			return result.rowcount + bundles.rowcount
+
+		async with database.AsyncSessionLocal() as db:
+			pruned = await database.run_write(db, delete_expired)
+		self.rows_pruned += pruned
+		return pruned
+
+	async def start(self) -> None:
+		await self.refresh()
+		if self._worker is None:
+			self._worker = asyncio.create_task(self._run())
+
+	async def stop(self) -> None:
+		worker, self._worker = self._worker, None
+		if worker is not None:
+			worker.cancel()
+			with suppress(asyncio.CancelledError):
+				await worker
+
+	def stats(self) -> dict:
+		return {
+			"links": len(self._links),
+			"files": len(self._files),
+			"users": len(self._users),
+			"refreshes": self.refreshes,
+			"rows_pruned": self.rows_pruned,
+			"errors": self.errors,
+		}
+
+	async def _run(self) -> None:
+		while True:
+			await asyncio.sleep(self._refresh_seconds)
+			try:
+				await self.refresh()
+				if self._clock() - self._last_prune >= PRUNE_INTERVAL_SECONDS:
+					self._last_prune = self._clock()
+					await self.prune_rows()
+			except Exception:
+				self.errors += 1
+				logger.exception("Refreshing link revocations failed")
+
+
+async def record_revocation(db: AsyncSession, revocation: LinkRevocation) -> None:
+	"""Stores ``revocation`` and applies it to this worker's index straight away."""
+
+	async def insert_revocation(session: AsyncSession) -> None:
+		session.add(revocation)
+		await session.flush()
+
+	await database.run_write(db, insert_revocation)
+	if revocation_index is not None:
+		revocation_index.apply(revocation)
+
+
+def init_revocation_index(settings: Settings) -> None:
+	global revocation_index
+	revocation_index = RevocationIndex(settings.revocation_refresh_seconds)
@@ -1,42 +1,436 @@
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from functools import partial
+import gzip
 from pathlib import Path
+from secrets import token_hex
+from urllib.parse import quote
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.config import get_settings
-from app.database import get_db
-from app.models import StoredFile
-from app.utils import decode_download_token
+from app import cache, revocation
+from app.cache import FileMeta
+from app.config import Settings
+from app.database import get_async_db
+from app.models import BundleFile, StoredFile, as_utc
+from app.storage import LocalBackend, backend_for, iter_gunzip, locate_file, open_decoded
+from app.utils import get_app_settings, verify_download_token
+from app.zipstream import ZipEntry, iter_zip, unique_archive_names
 
 
 router = APIRouter(tags=["download"])
 
 
-@router.get("/download/{token}")
-def download_file(token: str, db: Session = Depends(get_db)):
-	settings = get_settings()
-	payload = decode_download_token(token, settings.signing_secret, settings.signing_algorithm)
+class RangeFileResponse(FileResponse):
+	"""FileResponse with an RFC 9110 compliant multipart/byteranges body.
+
+	Starlette reports the boundary in Content-Range instead of Content-Type,
+	separates parts with bare LF and omits the unit from the 416 Content-Range,
+	all of which segmented download clients reject.
+	"""
+
+	async def __call__(self, scope, receive, send) -> None:
+		async def send_wrapper(message) -> None:
+			if message["type"] == "http.response.start" and message["status"] == 416:
+				message["headers"] = [
+					(name, b"bytes " + value if name == b"content-range" else value)
+					for name, value in message["headers"]
+				]
+			await send(message)
+
+		await super().__call__(scope, receive, send_wrapper)
+
+	async def _handle_multiple_ranges(self, send, ranges, file_size, send_header_only) -> None:
+		boundary = token_hex(13)
+		content_type = self.headers["content-type"]
+		part_headers = [
+			f"--{boundary}\r\nContent-Type: {content_type}\r\nContent-Range: bytes {start}-{end - 1}/{file_size}\r\n\r\n".encode(
+				"latin-1"
+			)
+			for start, end in ranges
+		]
+		closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+		content_length = (
+			sum(len(header) + (end - start) for header, (start, end) in zip(part_headers, ranges))
+			+ 2 * (len(ranges) - 1)
+			+ len(closing)
+		)
+		self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+		self.headers["content-length"] = str(content_length)
+		await send({"type": "http.response.start", "status": 206, "headers": self.raw_headers})
+		if send_header_only:
+			await send({"type": "http.response.body", "body": b"", "more_body": False})
+			return
+
+		async with await anyio.open_file(self.path, mode="rb") as file:
+			for index, (header, (start, end)) in enumerate(zip(part_headers, ranges)):
+				prefix = b"\r\n" + header if index else header
+				await send({"type": "http.response.body", "body": prefix, "more_body": True})
+				await file.seek(start)
+				while start < end:
+					chunk = await file.read(min(self.chunk_size, end - start))
+					if not chunk:
+						break
+					start += len(chunk)
+					await send({"type": "http.response.body", "body": chunk, "more_body": True})
+			await send({"type": "http.response.body", "body": closing, "more_body": False})
+
+
+def build_validators(stored_file: StoredFile | FileMeta, encoded: bool = False) -> tuple[str, str]:
+	created_at = as_utc(stored_file.created_at)
+	# Each content coding is its own representation and needs its own strong ETag.
+	suffix = f"-{stored_file.content_encoding}" if encoded else ""
+	etag = f'"{stored_file.id}-{stored_file.size_bytes}-{int(created_at.timestamp() * 1_000_000):x}{suffix}"'
+	last_modified = format_datetime(created_at.replace(microsecond=0), usegmt=True)
+	return etag, last_modified
+
+
+def _etag_matches(header_value: str, etag: str) -> bool:
+	if header_value.strip() == "*":
+		return True
+	# If-None-Match uses weak comparison (RFC 9110, section 13.1.2).
+	candidates = [candidate.strip().removeprefix("W/") for candidate in header_value.split(",")]
+	return etag.removeprefix("W/") in candidates
+
+
+def accepts_encoding(header_value: str | None, coding: str) -> bool:
+	"""Whether an ``Accept-Encoding`` value allows ``coding``; an explicit entry outranks ``*``."""
+	if not header_value:
+		return False
+	wildcard = False
+	for item in header_value.split(","):
+		name, _, params = item.partition(";")
+		name = name.strip().lower()
+		quality = 1.0
+		for param in params.split(";"):
+			key, _, value = param.partition("=")
+			if key.strip().lower() == "q":
+				try:
+					quality = float(value)
+				except ValueError:
+					quality = 0.0
+		if name == coding or (coding == "gzip" and name == "x-gzip"):
+			return quality > 0
+		if name == "*":
+			wildcard = quality > 0
+	return wildcard
+
+
+def is_not_modified(request: Request, etag: str, last_modified: str) -> bool:
+	if_none_match = request.headers.get("if-none-match")
+	if if_none_match is not None:
+		return _etag_matches(if_none_match, etag)
+
+	if_modified_since = request.headers.get("if-modified-since")
+	if if_modified_since is None:
+		return False
+	try:
+		since = parsedate_to_datetime(if_modified_since)
+	except (TypeError, ValueError):
+		return False
+	if since.tzinfo is None:
+		since = since.replace(tzinfo=timezone.utc)
+	return parsedate_to_datetime(last_modified) <= since
+
+
+@router.get("/download/bundle/{token}")
+async def download_bundle(
+	token: str,
+	settings: Settings = Depends(get_app_settings),
+	db: AsyncSession = Depends(get_async_db),
+):
+	payload = verify_download_token(token, settings, subject="bundle-download")
 
-	file_id = payload.get("file_id")
 	owner_user_id = payload.get("owner_user_id")
-	if not isinstance(file_id, int) or not isinstance(owner_user_id, int):
+	link_id = payload.get("jti")
+	# JWT bundle links issued before membership moved server-side list their files.
+	file_ids = payload.get("file_ids")
+	if file_ids is None and isinstance(link_id, str):
+		members = select(BundleFile.file_id).where(BundleFile.link_id == link_id).order_by(BundleFile.position)
+		file_ids = list(await db.scalars(members))
+	if (
+		not isinstance(file_ids, list)
+		or not all(isinstance(file_id, int) for file_id in file_ids)
+		or not isinstance(owner_user_id, int)
+	):
 		raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Malformed token")
 
-	stored_file = (
-		db.query(StoredFile)
-		.filter(StoredFile.id == file_id, StoredFile.owner_user_id == owner_user_id)
-		.first()
+	revocation_index = revocation.revocation_index
+	if revocation_index is not None:
+		if revocation_index.is_revoked(None, owner_user_id, link_id):
+			raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Download link has been revoked")
+		# Files whose links were revoked are left out like deleted ones.
+		file_ids = [file_id for file_id in file_ids if not revocation_index.is_revoked(file_id, owner_user_id, link_id)]
+
+	rows = await db.scalars(
+		select(StoredFile).where(
+			StoredFile.id.in_(file_ids), StoredFile.owner_user_id == owner_user_id, StoredFile.deleted_at.is_(None)
+		)
 	)
-	if stored_file is None:
+	by_id = {stored_file.id: stored_file for stored_file in rows}
+	# Files deleted since the link was minted are left out of the archive.
+	present: list[tuple[StoredFile, Path | None]] = []
+	for file_id in file_ids:
+		if file_id not in by_id:
+			continue
+		locator = by_id[file_id].upload_path
+		if not isinstance(backend_for(locator), LocalBackend):
+			present.append((by_id[file_id], None))
+			continue
+		try:
+			path, _ = await anyio.to_thread.run_sync(locate_file, settings.upload_dir, Path(locator))
+		except FileNotFoundError:
+			continue
+		present.append((by_id[file_id], path))
+	if not present:
 		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
 
+	names = unique_archive_names(stored_file.original_filename for stored_file, _ in present)
+	entries = [
+		ZipEntry(
+			name=name,
+			path=path,
+			size_bytes=stored_file.size_bytes,
+			modified_at=stored_file.created_at,
+			opener=None
+			if path is not None and stored_file.content_encoding is None
+			else partial(open_decoded, str(path or stored_file.upload_path), stored_file.content_encoding),
+		)
+		for name, (stored_file, path) in zip(names, present)
+	]
+	return StreamingResponse(
+		iter_zip(entries),
+		media_type="application/zip",
+		headers={"Content-Disposition": f'attachment; filename="bundle-{len(entries)}-files.zip"'},
+	)
+
+
+def _check_revoked(payload: dict) -> dict:
+	revocation_index = revocation.revocation_index
+	if revocation_index is not None and revocation_index.is_revoked(
+		payload["file_id"], payload["owner_user_id"], payload.get("jti")
+	):
+		raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Download link has been revoked")
+	return payload
+
+
+def _verify_download_token(token: str, settings: Settings) -> dict:
+	# Cached payloads are re-checked too: revocation must not wait for the cache TTL.
+	download_cache = cache.download_cache
+	if download_cache is not None:
+		payload = download_cache.get_token_payload(token)
+		if payload is not None:
+			return _check_revoked(payload)
+
+	payload = verify_download_token(token, settings)
+	if not isinstance(payload.get("file_id"), int) or not isinstance(payload.get("owner_user_id"), int):
+		raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Malformed token")
+
+	if download_cache is not None:
+		download_cache.put_token_payload(token, payload)
+	return _check_revoked(payload)
+
+
+async def _load_file_meta(db: AsyncSession, file_id: int, owner_user_id: int) -> FileMeta | None:
+	download_cache = cache.download_cache
+	if download_cache is not None:
+		meta = download_cache.get_file(file_id)
+		if meta is not None:
+			return meta if meta.owner_user_id == owner_user_id else None
+
+	stored_file = await db.scalar(
+		select(StoredFile).where(
+			StoredFile.id == file_id, StoredFile.owner_user_id == owner_user_id, StoredFile.deleted_at.is_(None)
+		)
+	)
+	if stored_file is None:
+		return None
+	meta = FileMeta(
+		id=stored_file.id,
+		owner_user_id=stored_file.owner_user_id,
+		original_filename=stored_file.original_filename,
+		content_type=stored_file.content_type,
+		size_bytes=stored_file.size_bytes,
+		upload_path=stored_file.upload_path,
+		created_at=stored_file.created_at,
+		content_encoding=stored_file.content_encoding,
+		stored_size_bytes=stored_file.stored_size_bytes,
+	)
+	if download_cache is not None:
+		download_cache.put_file(meta)
+	return meta
+
+
+def content_disposition(filename: str) -> str:
+	# Same encoding FileResponse uses, for responses that don't go through it.
+	quoted = quote(filename)
+	if quoted != filename:
+		return f"attachment; filename*=utf-8''{quoted}"
+	return f'attachment; filename="{filename}"'
+
+
+def offload_response(settings: Settings, stored_file: FileMeta, headers: dict[str, str]) -> Response:
+	"""Hands the byte transfer to the front proxy.
+
+	nginx resolves ``X-Accel-Redirect`` against an ``internal`` location that
+	maps ``DOWNLOAD_OFFLOAD_PREFIX`` onto ``UPLOAD_DIR``; Apache/lighttpd read
+	the absolute path from ``X-Sendfile``. The proxy serves Range requests.
+	"""
 	path = Path(stored_file.upload_path)
-	if not path.exists():
-		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File data missing")
+	headers = {
+		**headers,
+		"Content-Type": stored_file.content_type,
+		"Content-Disposition": content_disposition(stored_file.original_filename),
+	}
+	if settings.download_offload == "x-sendfile":
+		headers["X-Sendfile"] = str(path.resolve())
+	else:
+		try:
+			relative = path.relative_to(settings.upload_dir)
+		except ValueError:
+			relative = path.resolve().relative_to(settings.upload_dir.resolve())
+		headers["X-Accel-Redirect"] = settings.download_offload_prefix + quote(relative.as_posix())
+	return Response(status_code=status.HTTP_200_OK, headers=headers)
+
+
+def _memory_response(stored_file: FileMeta, data: bytes, headers: dict[str, str]) -> Response:
+	return Response(
+		content=data,
+		media_type=stored_file.content_type,
+		headers={**headers, "Content-Disposition": content_disposition(stored_file.original_filename)},
+	)
+
+
+def _stored_size(stored_file: FileMeta) -> int:
+	return stored_file.size_bytes if stored_file.stored_size_bytes is None else stored_file.stored_size_bytes
+
+
+def _iter_decoded(opener):
+	# Runs in the threadpool (StreamingResponse iterates sync iterators there),
+	# which is also where the blocking open belongs.
+	yield from iter_gunzip(opener())
+
+
+def _decoded_response(stored_file: FileMeta, opener, headers: dict[str, str]) -> StreamingResponse:
+	"""Streams a compressed-at-rest file decompressed, for clients without a matching Accept-Encoding.
+
+	The decoded length is known, so the response still carries Content-Length;
+	Range is not offered on this representation.
+	"""
+	return StreamingResponse(
+		_iter_decoded(opener),
+		media_type=stored_file.content_type,
+		headers={
+			**headers,
+			"Accept-Ranges": "none",
+			"Content-Length": str(stored_file.size_bytes),
+			"Content-Disposition": content_disposition(stored_file.original_filename),
+		},
+	)
+
+
+@router.get("/download/{token}")
+async def download_file(
+	token: str,
+	request: Request,
+	settings: Settings = Depends(get_app_settings),
+	db: AsyncSession = Depends(get_async_db),
+):
+	payload = _verify_download_token(token, settings)
+	stored_file = await _load_file_meta(db, payload["file_id"], payload["owner_user_id"])
+	if stored_file is None:
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+
+	storage_backend = backend_for(stored_file.upload_path)
+	is_remote = not isinstance(storage_backend, LocalBackend)
+	# Compressed-at-rest files go out as stored to clients that accept the
+	# coding and are decompressed on the fly for everyone else.
+	encoded = stored_file.content_encoding is not None
+	send_encoded = encoded and accepts_encoding(request.headers.get("accept-encoding"), stored_file.content_encoding)
+	decode = encoded and not send_encoded
+	etag, last_modified = build_validators(stored_file, send_encoded)
+	validator_headers = {"ETag": etag, "Last-Modified": last_modified}
+	if encoded:
+		validator_headers["Vary"] = "Accept-Encoding"
+	encoding_headers = {"Content-Encoding": stored_file.content_encoding} if send_encoded else {}
+
+	if is_remote or settings.download_offload != "none":
+		if is_not_modified(request, etag, last_modified):
+			return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validator_headers)
+		if is_remote and decode:
+			return _decoded_response(stored_file, partial(storage_backend.open, stored_file.upload_path), validator_headers)
+		if is_remote:
+			# The object store serves the bytes, including Range requests, straight to the client.
+			url = storage_backend.presigned_url(
+				stored_file.upload_path,
+				stored_file.original_filename,
+				stored_file.content_type,
+				stored_file.content_encoding if send_encoded else None,
+			)
+			return RedirectResponse(
+				url,
+				status_code=status.HTTP_307_TEMPORARY_REDIRECT,
+				headers={**validator_headers, "Cache-Control": "no-store"},
+			)
+		if not decode:
+			return offload_response(settings, stored_file, {**validator_headers, **encoding_headers})
+
+	# Small hot files are answered from memory. Range requests always go to
+	# the file so the cache never has to slice or build multipart bodies.
+	byte_cache = cache.byte_cache
+	# Ids can be reused after a purge; the creation time tells the rows apart.
+	byte_version = as_utc(stored_file.created_at)
+	stored_size = _stored_size(stored_file)
+	use_byte_cache = byte_cache is not None and "range" not in request.headers and byte_cache.admits(stored_size)
+	if not decode:
+		validator_headers["Accept-Ranges"] = "bytes"
+	if use_byte_cache:
+		if byte_cache.contains(stored_file.id, byte_version) and is_not_modified(request, etag, last_modified):
+			return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validator_headers)
+		data = byte_cache.get(stored_file.id, byte_version)
+		if data is not None:
+			if decode:
+				data = await anyio.to_thread.run_sync(gzip.decompress, data)
+			return _memory_response(stored_file, data, {**validator_headers, **encoding_headers})
+
+	try:
+		# FileResponse needs the stat for Content-Length anyway; doing it here
+		# doubles as the existence check.
+		path, stat_result = await anyio.to_thread.run_sync(
+			locate_file, settings.upload_dir, Path(stored_file.upload_path)
+		)
+	except FileNotFoundError as exc:
+		cache.invalidate_file(stored_file.id)
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File data missing") from exc
+	if str(path) != stored_file.upload_path:
+		# Moved by the layout migration; reload the row on the next request.
+		cache.invalidate_file(stored_file.id)
+
+	if is_not_modified(request, etag, last_modified):
+		return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validator_headers)
+
+	if use_byte_cache:
+		data = await anyio.to_thread.run_sync(path.read_bytes)
+		if len(data) == stored_size:
+			byte_cache.put(stored_file.id, byte_version, data)
+		if decode:
+			data = await anyio.to_thread.run_sync(gzip.decompress, data)
+		return _memory_response(stored_file, data, {**validator_headers, **encoding_headers})
+
+	if decode:
+		return _decoded_response(stored_file, partial(path.open, "rb"), validator_headers)
 
-	return FileResponse(
+	# FileResponse serves single and multi-range requests (206/416) and honours
+	# If-Range against the validators passed in here rather than its stat-based ones.
+	# For gzip-encoded files the ranges apply to the stored (encoded) bytes.
+	return RangeFileResponse(
 		path=path,
 		media_type=stored_file.content_type,
 		filename=stored_file.original_filename,
+		headers={**validator_headers, **encoding_headers},
+		stat_result=stat_result,
 	)
@@ -1,53 +1,140 @@
+from datetime import datetime, timedelta
 from pathlib import Path
+import re
+from typing import Literal
 import uuid
 
-from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.audit import flush_link_audits, record_link_audit, record_link_audits
+from app.cache import invalidate_file
 from app.config import get_settings
-from app.database import get_db
-from app.models import LinkAudit, StoredFile
-from app.schemas import FileMetadataResponse, LinkAuditResponse, SignedLinkRequest, SignedLinkResponse, UploadResponse
-from app.utils import create_download_token, require_user_id
+from app.database import get_async_db, run_write
+from app.jsonstream import stream_page
+from app.models import BundleFile, LinkAudit, LinkRevocation, StoredFile, as_utc, utcnow
+from app.pagination import DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT
+from app.revocation import record_revocation
+from app.schemas import (
+	BundleLinkRequest,
+	BundleLinkResponse,
+	BulkSignedLinkRequest,
+	BulkSignedLinkResponse,
+	BulkSignedLinkResult,
+	FileMetadataResponse,
+	LinkAuditResponse,
+	LinkRevocationRequest,
+	LinkRevocationResponse,
+	SignedLinkRequest,
+	SignedLinkResponse,
+	UploadResponse,
+	UsageResponse,
+)
+from app.search import indexed_candidates, match_condition
+from app.storage import AsyncBlobWriter, compression_level_for, run_io, stage_blob, store_blob
+from app.usage import charge_usage, get_usage, quota_exceeded, release_usage, remaining_quota
+from app.utils import issue_bundle_token, issue_download_token, new_link_id, require_user_id
 
 
 router = APIRouter(prefix="/files", tags=["files"])
 
+_LINK_ID = re.compile(r"[0-9a-f]{20}")
+
+
+def _public_base_url(request: Request) -> str:
+	forwarded_proto = request.headers.get("x-forwarded-proto")
+	forwarded_host = request.headers.get("x-forwarded-host")
+	host = forwarded_host or request.headers.get("host")
+	scheme = forwarded_proto or request.url.scheme
+
+	if host:
+		return f"{scheme}://{host}"
+	return str(request.base_url).rstrip("/")
+
+
+async def _record_upload(
+	db: AsyncSession,
+	writer: AsyncBlobWriter,
+	sha256: str,
+	staged_locator: str | None,
+	user_id: int,
+	original_name: str,
+	content_type: str,
+	quota_bytes: int,
+) -> StoredFile:
+	# Charged first so a refused upload never moves bytes into storage.
+	await charge_usage(db, user_id, writer.size_bytes, quota_bytes)
+	blob = await store_blob(
+		db,
+		writer.tmp_path,
+		sha256,
+		writer.size_bytes,
+		staged_locator,
+		writer.content_encoding,
+		writer.stored_size_bytes,
+	)
+	db_file = StoredFile(
+		owner_user_id=user_id,
+		original_filename=original_name,
+		stored_filename=f"{uuid.uuid4().hex}_{Path(original_name).name}",
+		content_type=content_type,
+		size_bytes=blob.size_bytes,
+		upload_path=blob.storage_path,
+		content_encoding=blob.content_encoding,
+		stored_size_bytes=blob.stored_size_bytes,
+		blob_id=blob.id,
+	)
+	db.add(db_file)
+	await db.flush()
+	return db_file
+
 
 @router.post("/upload", response_model=UploadResponse, status_code=status.HTTP_201_CREATED)
 async def upload_file(
 	file: UploadFile = File(...),
 	user_id: int = Depends(require_user_id),
-	db: Session = Depends(get_db),
+	db: AsyncSession = Depends(get_async_db),
 ):
 	settings = get_settings()
 	upload_dir = settings.upload_dir
-	upload_dir.mkdir(parents=True, exist_ok=True)
+	await run_io(lambda: upload_dir.mkdir(parents=True, exist_ok=True))
 
 	original_name = file.filename or "unnamed"
-	stored_filename = f"{uuid.uuid4().hex}_{Path(original_name).name}"
-	destination = upload_dir / stored_filename
+	content_type = file.content_type or "application/octet-stream"
+	quota_bytes = settings.user_quota_bytes
+	remaining = await remaining_quota(db, user_id, quota_bytes)
+	# Don't hold a read transaction (and its connection) open while the body is copied.
+	await db.close()
 
-	bytes_written = 0
-	with destination.open("wb") as out_file:
+	# Disk writes run on the bounded I/O pool and the DB work on the async
+	# engine, so a slow disk or a locked database only stalls this request.
+	writer = await AsyncBlobWriter.open(
+		upload_dir,
+		settings.upload_write_buffer_bytes,
+		compression_level_for(settings, content_type),
+		settings.storage_compression_min_savings_percent,
+	)
+	try:
 		while True:
-			chunk = await file.read(1024 * 1024)
+			chunk = await file.read(settings.upload_chunk_size_bytes)
 			if not chunk:
 				break
-			out_file.write(chunk)
-			bytes_written += len(chunk)
-
-	db_file = StoredFile(
-		owner_user_id=user_id,
-		original_filename=original_name,
-		stored_filename=stored_filename,
-		content_type=file.content_type or "application/octet-stream",
-		size_bytes=bytes_written,
-		upload_path=str(destination),
-	)
-	db.add(db_file)
-	db.commit()
-	db.refresh(db_file)
+			if remaining is not None and writer.size_bytes + len(chunk) > remaining:
+				raise quota_exceeded(quota_bytes)
+			await writer.write(chunk)
+		sha256 = await writer.close()
+		staged_locator = await stage_blob(db, writer.tmp_path, sha256)
+		db_file = await run_write(
+			db,
+			lambda session: _record_upload(
+				session, writer, sha256, staged_locator, user_id, original_name, content_type, quota_bytes
+			),
+		)
+	except Exception:
+		await writer.discard()
+		raise
 
 	return UploadResponse(
 		file_id=db_file.id,
@@ -57,66 +144,158 @@ async def upload_file(
 	)
 
 
+def _file_filters(
+	owner_filter,
+	content_type: str | None,
+	min_size: int | None,
+	max_size: int | None,
+	created_after: datetime | None,
+	created_before: datetime | None,
+) -> list:
+	filters = [owner_filter, StoredFile.deleted_at.is_(None)]
+	if content_type is not None:
+		filters.append(StoredFile.content_type == content_type)
+	if min_size is not None:
+		filters.append(StoredFile.size_bytes >= min_size)
+	if max_size is not None:
+		filters.append(StoredFile.size_bytes <= max_size)
+	if created_after is not None:
+		filters.append(StoredFile.created_at >= created_after)
+	if created_before is not None:
+		filters.append(StoredFile.created_at < created_before)
+	return filters
+
+
+async def _files_page(
+	db: AsyncSession, request: Request, filters: list, limit: int, cursor: str | None
+) -> StreamingResponse:
+	# Labelled and ordered like FileMetadataResponse, which documents the output.
+	query = select(
+		StoredFile.id.label("file_id"),
+		StoredFile.original_filename.label("filename"),
+		StoredFile.content_type,
+		StoredFile.size_bytes,
+		StoredFile.created_at.label("uploaded_at"),
+	).where(*filters)
+	# Served by ix_stored_files_owner_created_id.
+	return await stream_page(db, request, query, StoredFile.created_at, StoredFile.id, limit, cursor)
+
+
 @router.get("", response_model=list[FileMetadataResponse])
-def list_user_files(
+async def list_user_files(
+	request: Request,
+	limit: int = Query(default=DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+	cursor: str | None = None,
+	content_type: str | None = None,
+	min_size: int | None = Query(default=None, ge=0),
+	max_size: int | None = Query(default=None, ge=0),
+	created_after: datetime | None = None,
+	created_before: datetime | None = None,
+	user_id: int = Depends(require_user_id),
+	db: AsyncSession = Depends(get_async_db),
+):
+	owner_filter = StoredFile.owner_user_id == user_id
+	filters = _file_filters(owner_filter, content_type, min_size, max_size, created_after, created_before)
+	return await _files_page(db, request, filters, limit, cursor)
+
+
+@router.get("/search", response_model=list[FileMetadataResponse])
+async def search_user_files(
+	request: Request,
+	q: str = Query(min_length=1, max_length=255),
+	match: Literal["substring", "prefix"] = "substring",
+	limit: int = Query(default=DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+	cursor: str | None = None,
+	content_type: str | None = None,
+	min_size: int | None = Query(default=None, ge=0),
+	max_size: int | None = Query(default=None, ge=0),
+	created_after: datetime | None = None,
+	created_before: datetime | None = None,
 	user_id: int = Depends(require_user_id),
-	db: Session = Depends(get_db),
+	db: AsyncSession = Depends(get_async_db),
 ):
-	files = (
-		db.query(StoredFile)
-		.filter(StoredFile.owner_user_id == user_id)
-		.order_by(StoredFile.created_at.desc())
-		.all()
+	owner_filter = StoredFile.owner_user_id == user_id
+	candidate_ids = await indexed_candidates(db, q, user_id)
+	if candidate_ids is not None:
+		# "+ 0" stops SQLite from walking the owner's whole index and probing the
+		# candidates row by row; it fetches the candidates by id instead.
+		owner_filter = StoredFile.owner_user_id + 0 == user_id
+	filters = _file_filters(owner_filter, content_type, min_size, max_size, created_after, created_before)
+	if candidate_ids is not None:
+		filters.append(StoredFile.id.in_(candidate_ids))
+	filters.append(match_condition(q, prefix=match == "prefix"))
+	return await _files_page(db, request, filters, limit, cursor)
+
+
+@router.get("/usage", response_model=UsageResponse)
+async def get_user_usage(
+	user_id: int = Depends(require_user_id),
+	db: AsyncSession = Depends(get_async_db),
+):
+	usage = await get_usage(db, user_id)
+	return UsageResponse(
+		user_id=user_id,
+		bytes_used=usage.bytes_used if usage is not None else 0,
+		file_count=usage.file_count if usage is not None else 0,
+		last_upload_at=usage.last_upload_at if usage is not None else None,
+		quota_bytes=get_settings().user_quota_bytes or None,
 	)
-	return [
-		FileMetadataResponse(
-			file_id=stored_file.id,
-			filename=stored_file.original_filename,
-			content_type=stored_file.content_type,
-			size_bytes=stored_file.size_bytes,
-			uploaded_at=stored_file.created_at,
-		)
-		for stored_file in files
-	]
 
 
 @router.get("/users/{user_id}/link-audits", response_model=list[LinkAuditResponse])
-def list_user_link_audits(
+async def list_user_link_audits(
 	user_id: int,
+	request: Request,
+	limit: int = Query(default=DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+	cursor: str | None = None,
+	file_id: int | None = None,
+	created_after: datetime | None = None,
+	created_before: datetime | None = None,
 	auth_user_id: int = Depends(require_user_id),
-	db: Session = Depends(get_db),
+	db: AsyncSession = Depends(get_async_db),
 ):
 	if user_id != auth_user_id:
 		raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to view this user's audits")
 
-	audits = (
-		db.query(LinkAudit, StoredFile)
-		.join(StoredFile, StoredFile.id == LinkAudit.file_id)
-		.filter(StoredFile.owner_user_id == user_id)
-		.order_by(LinkAudit.created_at.desc())
-		.all()
-	)
+	# Read-your-writes for audits still sitting in this worker's buffer.
+	await flush_link_audits()
 
-	return [
-		LinkAuditResponse(
-			audit_id=audit.id,
-			file_id=stored_file.id,
-			filename=stored_file.original_filename,
-			requester_user_id=audit.requester_user_id,
-			ttl_seconds=audit.ttl_seconds,
-			created_at=audit.created_at,
+	# Labelled and ordered like LinkAuditResponse, which documents the output.
+	query = (
+		select(
+			LinkAudit.id.label("audit_id"),
+			LinkAudit.file_id,
+			StoredFile.original_filename.label("filename"),
+			LinkAudit.requester_user_id,
+			LinkAudit.ttl_seconds,
+			LinkAudit.link_id,
+			LinkAudit.created_at,
+		)
+		.join(StoredFile, StoredFile.id == LinkAudit.file_id)
+		# Only owners mint links, so filtering on the requester walks
+		# ix_link_audits_requester_created_id in page order.
+		.where(
+			LinkAudit.requester_user_id == user_id,
+			StoredFile.owner_user_id == user_id,
+			StoredFile.deleted_at.is_(None),
 		)
-		for audit, stored_file in audits
-	]
+	)
+	if file_id is not None:
+		query = query.where(LinkAudit.file_id == file_id)
+	if created_after is not None:
+		query = query.where(LinkAudit.created_at >= created_after)
+	if created_before is not None:
+		query = query.where(LinkAudit.created_at < created_before)
+	return await stream_page(db, request, query, LinkAudit.created_at, LinkAudit.id, limit, cursor)
 
 
 @router.post("/{file_id}/signed-link", response_model=SignedLinkResponse)
-def create_signed_link(
+async def create_signed_link(
 	file_id: int,
 	payload: SignedLinkRequest,
 	request: Request,
 	user_id: int = Depends(require_user_id),
-	db: Session = Depends(get_db),
+	db: AsyncSession = Depends(get_async_db),
 ):
 	settings = get_settings()
 
@@ -126,57 +305,206 @@ def create_signed_link(
 			detail=f"ttl_seconds exceeds max allowed value ({settings.max_ttl_seconds})",
 		)
 
-	stored_file = (
-		db.query(StoredFile)
-		.filter(StoredFile.id == file_id, StoredFile.owner_user_id == user_id)
-		.first()
+	stored_file = await db.scalar(
+		select(StoredFile).where(
+			StoredFile.id == file_id, StoredFile.owner_user_id == user_id, StoredFile.deleted_at.is_(None)
+		)
 	)
 	if stored_file is None:
 		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
 
-	token = create_download_token(
-		file_id=stored_file.id,
-		owner_user_id=stored_file.owner_user_id,
-		ttl_seconds=payload.ttl_seconds,
-		secret=settings.signing_secret,
-		algorithm=settings.signing_algorithm,
+	link_id = new_link_id()
+	token = issue_download_token(settings, stored_file.id, stored_file.owner_user_id, payload.ttl_seconds, link_id)
+
+	await record_link_audit(db, stored_file.id, user_id, payload.ttl_seconds, link_id)
+
+	download_url = f"{_public_base_url(request)}/download/{token}"
+	return SignedLinkResponse(
+		file_id=stored_file.id, ttl_seconds=payload.ttl_seconds, download_url=download_url, link_id=link_id
 	)
 
-	audit = LinkAudit(file_id=stored_file.id, requester_user_id=user_id, ttl_seconds=payload.ttl_seconds)
-	db.add(audit)
-	db.commit()
 
-	forwarded_proto = request.headers.get("x-forwarded-proto")
-	forwarded_host = request.headers.get("x-forwarded-host")
-	host = forwarded_host or request.headers.get("host")
-	scheme = forwarded_proto or request.url.scheme
+@router.post("/signed-links", response_model=BulkSignedLinkResponse)
+async def create_signed_links(
+	payload: BulkSignedLinkRequest,
+	request: Request,
+	user_id: int = Depends(require_user_id),
+	db: AsyncSession = Depends(get_async_db),
+):
+	settings = get_settings()
 
-	if host:
-		download_url = f"{scheme}://{host}/download/{token}"
-	else:
-		download_url = f"{str(request.base_url).rstrip('/')}/download/{token}"
+	requested_ids = {item.file_id for item in payload.items}
+	owned_ids = set(
+		await db.scalars(
+			select(StoredFile.id).where(
+				StoredFile.id.in_(requested_ids), StoredFile.owner_user_id == user_id, StoredFile.deleted_at.is_(None)
+			)
+		)
+	)
 
-	return SignedLinkResponse(file_id=stored_file.id, ttl_seconds=payload.ttl_seconds, download_url=download_url)
+	base_url = _public_base_url(request)
+	results = []
+	audits = []
+	for item in payload.items:
+		result = BulkSignedLinkResult(file_id=item.file_id, ttl_seconds=item.ttl_seconds)
+		if item.ttl_seconds > settings.max_ttl_seconds:
+			result.error = f"ttl_seconds exceeds max allowed value ({settings.max_ttl_seconds})"
+		elif item.file_id not in owned_ids:
+			result.error = "File not found"
+		else:
+			result.link_id = new_link_id()
+			token = issue_download_token(settings, item.file_id, user_id, item.ttl_seconds, result.link_id)
+			result.download_url = f"{base_url}/download/{token}"
+			audits.append((item.file_id, user_id, item.ttl_seconds, result.link_id))
+		results.append(result)
 
+	await record_link_audits(db, audits)
+	return BulkSignedLinkResponse(results=results)
 
-@router.delete("/{file_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_file(
+
+@router.post("/bundle-link", response_model=BundleLinkResponse)
+async def create_bundle_link(
+	payload: BundleLinkRequest,
+	request: Request,
+	user_id: int = Depends(require_user_id),
+	db: AsyncSession = Depends(get_async_db),
+):
+	settings = get_settings()
+
+	if payload.ttl_seconds > settings.max_ttl_seconds:
+		raise HTTPException(
+			status_code=status.HTTP_400_BAD_REQUEST,
+			detail=f"ttl_seconds exceeds max allowed value ({settings.max_ttl_seconds})",
+		)
+
+	file_ids = list(dict.fromkeys(payload.file_ids))
+	owned_ids = set(
+		await db.scalars(
+			select(StoredFile.id).where(
+				StoredFile.id.in_(file_ids), StoredFile.owner_user_id == user_id, StoredFile.deleted_at.is_(None)
+			)
+		)
+	)
+	missing = [file_id for file_id in file_ids if file_id not in owned_ids]
+	if missing:
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Files not found: {missing[:20]}")
+
+	link_id = new_link_id()
+	expires_at = utcnow() + timedelta(seconds=payload.ttl_seconds)
+
+	async def insert_bundle(session: AsyncSession) -> None:
+		await session.execute(
+			insert(BundleFile),
+			[
+				{"link_id": link_id, "position": position, "file_id": file_id, "expires_at": expires_at}
+				for position, file_id in enumerate(file_ids)
+			],
+		)
+
+	await run_write(db, insert_bundle)
+	token = issue_bundle_token(settings, user_id, payload.ttl_seconds, link_id)
+	await record_link_audits(db, [(file_id, user_id, payload.ttl_seconds, link_id) for file_id in file_ids])
+
+	download_url = f"{_public_base_url(request)}/download/bundle/{token}"
+	return BundleLinkResponse(
+		file_ids=file_ids, ttl_seconds=payload.ttl_seconds, download_url=download_url, link_id=link_id
+	)
+
+
+def _watermark(payload: LinkRevocationRequest | None) -> datetime:
+	now = utcnow()
+	if payload is None or payload.issued_before is None:
+		return now
+	return min(as_utc(payload.issued_before), now)
+
+
+@router.delete("/links/{link_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_link(
+	link_id: str,
+	user_id: int = Depends(require_user_id),
+	db: AsyncSession = Depends(get_async_db),
+):
+	if not _LINK_ID.fullmatch(link_id):
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Link not found")
+
+	# The audit trail is what ties a link id to its owner and expiry.
+	await flush_link_audits()
+	issued = (
+		await db.execute(
+			select(LinkAudit.created_at, LinkAudit.ttl_seconds).where(
+				LinkAudit.link_id == link_id, LinkAudit.requester_user_id == user_id
+			)
+		)
+	).all()
+	if not issued:
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Link not found")
+
+	# Audits are written after the token is minted, so this never undershoots exp.
+	expires_at = max(as_utc(created_at) + timedelta(seconds=ttl_seconds) for created_at, ttl_seconds in issued)
+	if expires_at > utcnow():
+		await record_revocation(db, LinkRevocation(owner_user_id=user_id, link_id=link_id, expires_at=expires_at))
+
+
+@router.post("/links/revoke", response_model=LinkRevocationResponse)
+async def revoke_user_links(
+	payload: LinkRevocationRequest | None = None,
+	user_id: int = Depends(require_user_id),
+	db: AsyncSession = Depends(get_async_db),
+):
+	issued_before = _watermark(payload)
+	expires_at = issued_before + timedelta(seconds=get_settings().max_ttl_seconds)
+	await record_revocation(
+		db, LinkRevocation(owner_user_id=user_id, issued_before=issued_before, expires_at=expires_at)
+	)
+	return LinkRevocationResponse(issued_before=issued_before)
+
+
+@router.post("/{file_id}/links/revoke", response_model=LinkRevocationResponse)
+async def revoke_file_links(
 	file_id: int,
+	payload: LinkRevocationRequest | None = None,
 	user_id: int = Depends(require_user_id),
-	db: Session = Depends(get_db),
+	db: AsyncSession = Depends(get_async_db),
 ):
-	stored_file = (
-		db.query(StoredFile)
-		.filter(StoredFile.id == file_id, StoredFile.owner_user_id == user_id)
-		.first()
+	owned = await db.scalar(
+		select(StoredFile.id).where(
+			StoredFile.id == file_id, StoredFile.owner_user_id == user_id, StoredFile.deleted_at.is_(None)
+		)
 	)
-	if stored_file is None:
+	if owned is None:
 		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
 
-	file_path = Path(stored_file.upload_path)
-	if file_path.exists() and file_path.is_file():
-		file_path.unlink()
+	issued_before = _watermark(payload)
+	expires_at = issued_before + timedelta(seconds=get_settings().max_ttl_seconds)
+	await record_revocation(
+		db,
+		LinkRevocation(owner_user_id=user_id, file_id=file_id, issued_before=issued_before, expires_at=expires_at),
+	)
+	return LinkRevocationResponse(file_id=file_id, issued_before=issued_before)
+
+
+async def _tombstone_file(db: AsyncSession, file_id: int, user_id: int) -> bool:
+	live = (StoredFile.id == file_id, StoredFile.owner_user_id == user_id, StoredFile.deleted_at.is_(None))
+	size_bytes = await db.scalar(select(StoredFile.size_bytes).where(*live))
+	if size_bytes is None:
+		return False
+	result = await db.execute(
+		update(StoredFile).where(*live).values(deleted_at=utcnow()).execution_options(synchronize_session=False)
+	)
+	# Only the delete that wins the tombstone gives the bytes back.
+	if result.rowcount:
+		await release_usage(db, user_id, size_bytes)
+	return bool(result.rowcount)
 
-	db.query(LinkAudit).filter(LinkAudit.file_id == stored_file.id).delete(synchronize_session=False)
-	db.delete(stored_file)
-	db.commit()
+
+@router.delete("/{file_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_file(
+	file_id: int,
+	user_id: int = Depends(require_user_id),
+	db: AsyncSession = Depends(get_async_db),
+):
+	# Only a tombstone is written here; app.purge removes audits, the row and
+	# the bytes in the background.
+	if not await run_write(db, lambda session: _tombstone_file(session, file_id, user_id)):
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+	invalidate_file(file_id)
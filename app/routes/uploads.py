@@ -0,0 +1,356 @@
+import asyncio
+from datetime import datetime, timedelta
+import fcntl
+import os
+from pathlib import Path
+import time
+import uuid
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from app.config import get_settings
+from app.database import get_async_db, run_write
+from app.models import StoredFile, UploadPart, UploadSession, as_utc, utcnow
+from app.schemas import UploadPartResponse, UploadResponse, UploadSessionCreateRequest, UploadSessionResponse
+from app.storage import (
+	GZIP,
+	GzipSpool,
+	compression_level_for,
+	hash_file,
+	pwrite_all,
+	run_io,
+	stage_blob,
+	store_blob,
+	tmp_dir,
+)
+from app.usage import charge_usage, quota_exceeded, remaining_quota
+from app.utils import require_user_id
+
+
+MAX_PART_NUMBER = 10000
+# How long completing a session waits for part uploads already writing to it.
+PART_WRITE_WAIT_SECONDS = 30.0
+PART_WRITE_POLL_SECONDS = 0.05
+
+router = APIRouter(prefix="/files/uploads", tags=["uploads"])
+
+
+def session_data_path(upload_dir: Path, upload_id: str) -> Path:
+	# Parts are written in place at their final offset, so completing a session
+	# is a rename into the blob store rather than a concatenation.
+	return tmp_dir(upload_dir) / f"upload-{upload_id}"
+
+
+async def _delete_expired_sessions(db: AsyncSession, cutoff: datetime) -> list[str]:
+	# A session being completed keeps its row and data until completion ends.
+	upload_ids = list(
+		await db.scalars(
+			select(UploadSession.id).where(UploadSession.expires_at < cutoff, UploadSession.completing_at.is_(None))
+		)
+	)
+	if upload_ids:
+		await db.execute(delete(UploadPart).where(UploadPart.upload_id.in_(upload_ids)))
+		await db.execute(delete(UploadSession).where(UploadSession.id.in_(upload_ids)))
+	return upload_ids
+
+
+async def expire_upload_sessions(db: AsyncSession, upload_dir: Path, now: datetime | None = None) -> int:
+	cutoff = now or utcnow()
+	upload_ids = await run_write(db, lambda session: _delete_expired_sessions(session, cutoff))
+	# Only after the rows are gone, so a failed write leaves the data in place.
+	for upload_id in upload_ids:
+		await run_io(session_data_path(upload_dir, upload_id).unlink, True)
+	return len(upload_ids)
+
+
+async def _get_active_session(db: AsyncSession, upload_id: str, user_id: int) -> UploadSession:
+	upload_session = await db.scalar(
+		select(UploadSession)
+		.where(UploadSession.id == upload_id, UploadSession.owner_user_id == user_id)
+		.options(selectinload(UploadSession.parts))
+	)
+	if upload_session is None or as_utc(upload_session.expires_at) <= utcnow():
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload session not found")
+	return upload_session
+
+
+def _session_response(upload_session: UploadSession) -> UploadSessionResponse:
+	return UploadSessionResponse(
+		upload_id=upload_session.id,
+		filename=upload_session.original_filename,
+		part_size=upload_session.part_size,
+		expires_at=upload_session.expires_at,
+		parts=[
+			UploadPartResponse(
+				part_number=part.part_number,
+				offset=(part.part_number - 1) * upload_session.part_size,
+				size_bytes=part.size_bytes,
+			)
+			for part in upload_session.parts
+		],
+	)
+
+
+def _completing() -> HTTPException:
+	return HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload session is being completed")
+
+
+async def _lock_for_completion(data_path: Path) -> int:
+	"""Opens the session file exclusively, once part uploads already writing to it are done."""
+	fd = await run_io(os.open, data_path, os.O_RDONLY)
+	deadline = time.monotonic() + PART_WRITE_WAIT_SECONDS
+	try:
+		while True:
+			try:
+				await run_io(fcntl.flock, fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+				return fd
+			except BlockingIOError:
+				if time.monotonic() > deadline:
+					raise HTTPException(
+						status_code=status.HTTP_409_CONFLICT, detail="Parts are still being uploaded"
+					) from None
+				await asyncio.sleep(PART_WRITE_POLL_SECONDS)
+	except BaseException:
+		await run_io(os.close, fd)
+		raise
+
+
+def _check_parts(part_size: int, parts: list[UploadPart]) -> None:
+	if not parts:
+		raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No parts have been uploaded")
+	missing = sorted(set(range(1, parts[-1].part_number + 1)) - {part.part_number for part in parts})
+	if missing:
+		raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Missing parts: {missing[:20]}")
+	short_parts = [part.part_number for part in parts[:-1] if part.size_bytes != part_size]
+	if short_parts:
+		raise HTTPException(
+			status_code=status.HTTP_409_CONFLICT,
+			detail=f"Only the last part may be smaller than part_size; short parts: {short_parts[:20]}",
+		)
+
+
+@router.post("", response_model=UploadSessionResponse, status_code=status.HTTP_201_CREATED)
+async def create_upload_session(
+	payload: UploadSessionCreateRequest,
+	user_id: int = Depends(require_user_id),
+	db: AsyncSession = Depends(get_async_db),
+):
+	settings = get_settings()
+	upload_session = UploadSession(
+		id=uuid.uuid4().hex,
+		owner_user_id=user_id,
+		original_filename=payload.filename,
+		content_type=payload.content_type or "application/octet-stream",
+		part_size=payload.part_size,
+		expires_at=utcnow() + timedelta(seconds=settings.upload_session_ttl_seconds),
+		parts=[],
+	)
+
+	async def insert_session(session: AsyncSession) -> None:
+		session.add(upload_session)
+
+	await run_write(db, insert_session)
+	return _session_response(upload_session)
+
+
+@router.get("/{upload_id}", response_model=UploadSessionResponse)
+async def get_upload_session(
+	upload_id: str,
+	user_id: int = Depends(require_user_id),
+	db: AsyncSession = Depends(get_async_db),
+):
+	return _session_response(await _get_active_session(db, upload_id, user_id))
+
+
+@router.put("/{upload_id}/parts/{part_number}", response_model=UploadPartResponse)
+async def upload_part(
+	upload_id: str,
+	part_number: int,
+	request: Request,
+	user_id: int = Depends(require_user_id),
+	db: AsyncSession = Depends(get_async_db),
+):
+	if not 1 <= part_number <= MAX_PART_NUMBER:
+		raise HTTPException(
+			status_code=status.HTTP_400_BAD_REQUEST,
+			detail=f"part_number must be between 1 and {MAX_PART_NUMBER}",
+		)
+	upload_session = await _get_active_session(db, upload_id, user_id)
+	if upload_session.completing_at is not None:
+		raise _completing()
+	part_size = upload_session.part_size
+	offset = (part_number - 1) * part_size
+	settings = get_settings()
+	quota_bytes = settings.user_quota_bytes
+	remaining = await remaining_quota(db, user_id, quota_bytes)
+	if remaining is not None:
+		# The session's other parts will count against the quota on completion.
+		remaining -= sum(part.size_bytes for part in upload_session.parts if part.part_number != part_number)
+
+	data_path = session_data_path(settings.upload_dir, upload_id)
+	fd = await run_io(os.open, data_path, os.O_WRONLY | os.O_CREAT, 0o600)
+	try:
+		# Held until the part is recorded, so completion waits for writes that
+		# got here before it, and sees their rows once it has the file.
+		try:
+			await run_io(fcntl.flock, fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+		except BlockingIOError:
+			raise _completing() from None
+		# Re-checked under the lock: completion marks the session before it locks the file.
+		completing_at = await db.scalar(select(UploadSession.completing_at).where(UploadSession.id == upload_id))
+		if completing_at is not None:
+			raise _completing()
+		# Don't hold a read transaction (and its connection) open while the body streams in.
+		await db.close()
+
+		bytes_written = 0
+		buffer = bytearray()
+		async for chunk in request.stream():
+			if bytes_written + len(buffer) + len(chunk) > part_size:
+				raise HTTPException(
+					status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+					detail=f"Part exceeds the session part_size ({part_size})",
+				)
+			if remaining is not None and bytes_written + len(buffer) + len(chunk) > remaining:
+				raise quota_exceeded(quota_bytes)
+			buffer += chunk
+			if len(buffer) >= settings.upload_write_buffer_bytes:
+				bytes_written += await run_io(pwrite_all, fd, bytes(buffer), offset + bytes_written)
+				buffer.clear()
+		if buffer:
+			bytes_written += await run_io(pwrite_all, fd, bytes(buffer), offset + bytes_written)
+
+		if bytes_written == 0:
+			raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Part body is empty")
+
+		async def record_part(session: AsyncSession) -> None:
+			# Re-sending a part overwrites it, which is what makes retries idempotent.
+			part = UploadPart(
+				upload_id=upload_id, part_number=part_number, size_bytes=bytes_written, created_at=utcnow()
+			)
+			await session.merge(part)
+
+		await run_write(db, record_part)
+	finally:
+		await run_io(os.close, fd)
+	return UploadPartResponse(part_number=part_number, offset=offset, size_bytes=bytes_written)
+
+
+@router.post("/{upload_id}/complete", response_model=UploadResponse, status_code=status.HTTP_201_CREATED)
+async def complete_upload_session(
+	upload_id: str,
+	user_id: int = Depends(require_user_id),
+	db: AsyncSession = Depends(get_async_db),
+):
+	upload_session = await _get_active_session(db, upload_id, user_id)
+	if upload_session.completing_at is not None:
+		raise _completing()
+	original_name = upload_session.original_filename
+	content_type = upload_session.content_type
+	part_size = upload_session.part_size
+	_check_parts(part_size, upload_session.parts)
+
+	async def mark_completing(session: AsyncSession) -> int:
+		result = await session.execute(
+			update(UploadSession)
+			.where(UploadSession.id == upload_id, UploadSession.completing_at.is_(None))
+			.values(completing_at=utcnow())
+		)
+		return result.rowcount
+
+	if not await run_write(db, mark_completing):
+		raise _completing()
+
+	async def unmark_completing(session: AsyncSession) -> None:
+		await session.execute(
+			update(UploadSession).where(UploadSession.id == upload_id).values(completing_at=None)
+		)
+
+	settings = get_settings()
+	data_path = session_data_path(settings.upload_dir, upload_id)
+	encoder = None
+	fd = None
+	try:
+		fd = await _lock_for_completion(data_path)
+		# Parts recorded while we waited for their writes count too.
+		parts = list(
+			await db.scalars(
+				select(UploadPart).where(UploadPart.upload_id == upload_id).order_by(UploadPart.part_number)
+			)
+		)
+		await db.close()
+		_check_parts(part_size, parts)
+		total_size = (len(parts) - 1) * part_size + parts[-1].size_bytes
+		# A retried final part may have been shorter than the first attempt.
+		await run_io(os.truncate, data_path, total_size)
+		compression_level = compression_level_for(settings, content_type)
+		if compression_level is not None:
+			encoder = await run_io(
+				GzipSpool, settings.upload_dir, compression_level, settings.storage_compression_min_savings_percent
+			)
+		sha256, size_bytes = await run_io(hash_file, data_path, encoder)
+		stored_path, content_encoding, stored_size_bytes = data_path, None, None
+		if encoder is not None and await run_io(encoder.finish):
+			stored_path, content_encoding, stored_size_bytes = encoder.path, GZIP, encoder.size_bytes
+		staged_locator = await stage_blob(db, stored_path, sha256)
+
+		async def finalize_session(session: AsyncSession) -> StoredFile:
+			await charge_usage(session, user_id, size_bytes, settings.user_quota_bytes)
+			blob = await store_blob(
+				session, stored_path, sha256, size_bytes, staged_locator, content_encoding, stored_size_bytes
+			)
+			db_file = StoredFile(
+				owner_user_id=user_id,
+				original_filename=original_name,
+				stored_filename=f"{uuid.uuid4().hex}_{Path(original_name).name}",
+				content_type=content_type,
+				size_bytes=blob.size_bytes,
+				upload_path=blob.storage_path,
+				content_encoding=blob.content_encoding,
+				stored_size_bytes=blob.stored_size_bytes,
+				blob_id=blob.id,
+			)
+			session.add(db_file)
+			await session.execute(delete(UploadPart).where(UploadPart.upload_id == upload_id))
+			await session.execute(delete(UploadSession).where(UploadSession.id == upload_id))
+			await session.flush()
+			return db_file
+
+		db_file = await run_write(db, finalize_session)
+	except Exception:
+		# E.g. a missing part or the quota: the client may fix that and complete again.
+		if encoder is not None:
+			await run_io(encoder.abandon)
+		await run_write(db, unmark_completing)
+		raise
+	finally:
+		if fd is not None:
+			await run_io(os.close, fd)
+	if stored_path != data_path:
+		await run_io(data_path.unlink, True)
+
+	return UploadResponse(
+		file_id=db_file.id,
+		filename=db_file.original_filename,
+		size_bytes=db_file.size_bytes,
+		uploaded_at=db_file.created_at,
+	)
+
+
+@router.delete("/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def abort_upload_session(
+	upload_id: str,
+	user_id: int = Depends(require_user_id),
+	db: AsyncSession = Depends(get_async_db),
+):
+	await _get_active_session(db, upload_id, user_id)
+
+	async def delete_session(session: AsyncSession) -> None:
+		await session.execute(delete(UploadPart).where(UploadPart.upload_id == upload_id))
+		await session.execute(delete(UploadSession).where(UploadSession.id == upload_id))
+
+	await run_write(db, delete_session)
+	await run_io(session_data_path(get_settings().upload_dir, upload_id).unlink, True)
@@ -10,6 +10,14 @@ class UploadResponse(BaseModel):
 	uploaded_at: datetime
 
 
+class UsageResponse(BaseModel):
+	user_id: int
+	bytes_used: int
+	file_count: int
+	last_upload_at: datetime | None = None
+	quota_bytes: int | None = None
+
+
 class FileMetadataResponse(BaseModel):
 	file_id: int
 	filename: str
@@ -26,6 +34,50 @@ class SignedLinkResponse(BaseModel):
 	file_id: int
 	ttl_seconds: int
 	download_url: str
+	link_id: str
+
+
+class BulkSignedLinkItem(BaseModel):
+	file_id: int
+	ttl_seconds: int = Field(gt=0, le=86400)
+
+
+class BulkSignedLinkRequest(BaseModel):
+	items: list[BulkSignedLinkItem] = Field(min_length=1, max_length=1000)
+
+
+class BulkSignedLinkResult(BaseModel):
+	file_id: int
+	ttl_seconds: int
+	download_url: str | None = None
+	link_id: str | None = None
+	error: str | None = None
+
+
+class BulkSignedLinkResponse(BaseModel):
+	results: list[BulkSignedLinkResult]
+
+
+class BundleLinkRequest(BaseModel):
+	file_ids: list[int] = Field(min_length=1, max_length=1000)
+	ttl_seconds: int = Field(gt=0, le=86400)
+
+
+class BundleLinkResponse(BaseModel):
+	file_ids: list[int]
+	ttl_seconds: int
+	download_url: str
+	link_id: str
+
+
+class LinkRevocationRequest(BaseModel):
+	# Defaults to now; later times are clamped to now.
+	issued_before: datetime | None = None
+
+
+class LinkRevocationResponse(BaseModel):
+	file_id: int | None = None
+	issued_before: datetime
 
 
 class LinkAuditResponse(BaseModel):
@@ -34,5 +86,25 @@ class LinkAuditResponse(BaseModel):
 	filename: str
 	requester_user_id: int
 	ttl_seconds: int
+	link_id: str | None
 	created_at: datetime
 
+
+class UploadSessionCreateRequest(BaseModel):
+	filename: str = Field(min_length=1, max_length=255)
+	content_type: str | None = Field(default=None, max_length=255)
+	part_size: int = Field(default=8 * 1024 * 1024, ge=64 * 1024, le=256 * 1024 * 1024)
+
+
+class UploadPartResponse(BaseModel):
+	part_number: int
+	offset: int
+	size_bytes: int
+
+
+class UploadSessionResponse(BaseModel):
+	upload_id: str
+	filename: str
+	part_size: int
+	expires_at: datetime
+	parts: list[UploadPartResponse]
@@ -0,0 +1,173 @@
+import logging
+
+from sqlalchemy import column, or_, select, table, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import StoredFile
+
+
+# Both indexes work on character trigrams; shorter queries cannot use them.
+MIN_INDEXED_QUERY_LENGTH = 3
+# Above this many of the owner's files matching, a query is too common for the index to beat a scan.
+INDEX_CANDIDATE_LIMIT = 5000
+FTS_TABLE = "stored_files_fts"
+FTS_CONTENT_VIEW = "stored_files_search"
+POSTGRES_INDEX = "ix_stored_files_owner_search_trgm"
+# Built by migration 3, before the index was scoped to the owner.
+LEGACY_POSTGRES_INDEX = "ix_stored_files_search_trgm"
+
+logger = logging.getLogger(__name__)
+
+# "fts5", "trigram", or None when the database has neither and search scans the owner's rows.
+search_backend: str | None = None
+
+_fts = table(FTS_TABLE, column("rowid"), column(FTS_TABLE))
+
+# External-content FTS5 table over a view that adds the owner as a delimited
+# token, so one MATCH finds only the owner's files. It stores only the index,
+# and triggers keep it in step with every insert, delete and rename of a
+# stored_files row.
+_OWNER_KEY = "'<' || {row}.owner_user_id || '>'"
+_SQLITE_DDL = (
+	f"""CREATE VIEW IF NOT EXISTS {FTS_CONTENT_VIEW} AS
+	SELECT id, {_OWNER_KEY.format(row="stored_files")} AS owner_key, original_filename, content_type
+	FROM stored_files""",
+	f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(owner_key, original_filename, content_type, "
+	f"content='{FTS_CONTENT_VIEW}', content_rowid='id', tokenize='trigram')",
+	f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON stored_files BEGIN
+		INSERT INTO {FTS_TABLE}(rowid, owner_key, original_filename, content_type)
+		VALUES (new.id, {_OWNER_KEY.format(row="new")}, new.original_filename, new.content_type);
+	END""",
+	f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON stored_files BEGIN
+		INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, owner_key, original_filename, content_type)
+		VALUES ('delete', old.id, {_OWNER_KEY.format(row="old")}, old.original_filename, old.content_type);
+	END""",
+	f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+	AFTER UPDATE OF owner_user_id, original_filename, content_type ON stored_files BEGIN
+		INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, owner_key, original_filename, content_type)
+		VALUES ('delete', old.id, {_OWNER_KEY.format(row="old")}, old.original_filename, old.content_type);
+		INSERT INTO {FTS_TABLE}(rowid, owner_key, original_filename, content_type)
+		VALUES (new.id, {_OWNER_KEY.format(row="new")}, new.original_filename, new.content_type);
+	END""",
+)
+_SQLITE_LEGACY_DROP = (
+	f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+	f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+	f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+	f"DROP TABLE IF EXISTS {FTS_TABLE}",
+)
+
+# btree_gin lets the owner equality and the trigram match share one GIN scan.
+_POSTGRES_DDL = (
+	"CREATE EXTENSION IF NOT EXISTS pg_trgm",
+	"CREATE EXTENSION IF NOT EXISTS btree_gin",
+	f"CREATE INDEX IF NOT EXISTS {POSTGRES_INDEX} ON stored_files "
+	"USING gin (owner_user_id, original_filename gin_trgm_ops, content_type gin_trgm_ops)",
+	f"DROP INDEX IF EXISTS {LEGACY_POSTGRES_INDEX}",
+)
+
+
+def _create_sqlite_index(connection: Connection) -> bool:
+	existing = connection.scalar(
+		text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+	)
+	try:
+		with connection.begin_nested():
+			if existing is not None and "owner_key" not in existing:
+				for statement in _SQLITE_LEGACY_DROP:
+					connection.execute(text(statement))
+			for statement in _SQLITE_DDL:
+				connection.execute(text(statement))
+	except DBAPIError:
+		logger.warning("SQLite lacks FTS5 with the trigram tokenizer (3.34+); search will scan", exc_info=True)
+		return False
+	if existing is None or "owner_key" not in existing:
+		# Index the rows that predate the table.
+		connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+	return True
+
+
+def _create_postgres_index(connection: Connection) -> bool:
+	try:
+		with connection.begin_nested():
+			for statement in _POSTGRES_DDL:
+				connection.execute(text(statement))
+	except DBAPIError:
+		logger.warning(
+			"Could not enable pg_trgm and btree_gin or build the search index; search keeps any older index",
+			exc_info=True,
+		)
+		return False
+	return True
+
+
+def create_search_index(connection: Connection) -> bool:
+	"""Creates the dialect's owner-scoped filename index, replacing an older unscoped one.
+
+	Run by the schema migrations.
+	"""
+	create = {"sqlite": _create_sqlite_index, "postgresql": _create_postgres_index}.get(connection.dialect.name)
+	return create(connection) if create is not None else False
+
+
+def init_search_index(engine: Engine) -> None:
+	"""Looks up which index the migrations managed to create, without changing the schema."""
+	global search_backend
+	dialect = engine.dialect.name
+	if dialect == "sqlite":
+		probe = text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name")
+		backend, names = "fts5", (FTS_TABLE,)
+	elif dialect == "postgresql":
+		probe = text("SELECT 1 FROM pg_indexes WHERE indexname = :name")
+		backend, names = "trigram", (POSTGRES_INDEX, LEGACY_POSTGRES_INDEX)
+	else:
+		search_backend = None
+		return
+	with engine.connect() as connection:
+		found = any(connection.scalar(probe, {"name": name}) for name in names)
+	search_backend = backend if found else None
+
+
+def _fts_phrase(query: str) -> str:
+	return '"' + query.replace('"', '""') + '"'
+
+
+def match_condition(query: str, prefix: bool = False):
+	"""Where-clause for files whose name or content type contains (or starts with) ``query``.
+
+	Case-insensitive, with LIKE wildcards in ``query`` taken literally. On
+	Postgres, ILIKE over both columns is answered from the trigram GIN index.
+	"""
+	if prefix:
+		return or_(
+			StoredFile.original_filename.istartswith(query, autoescape=True),
+			StoredFile.content_type.istartswith(query, autoescape=True),
+		)
+	return or_(
+		StoredFile.original_filename.icontains(query, autoescape=True),
+		StoredFile.content_type.icontains(query, autoescape=True),
+	)
+
+
+async def indexed_candidates(db: AsyncSession, query: str, owner_user_id: int) -> list[int] | None:
+	"""Ids of the owner's files that the FTS5 index says contain ``query``.
+
+	Returns ``None`` when the index cannot narrow things down: no FTS5 table, a
+	query shorter than a trigram, or more than ``INDEX_CANDIDATE_LIMIT`` of the
+	owner's files matching. The caller then walks the owner's files newest
+	first, which for such a common term fills a page almost immediately.
+	"""
+	if search_backend != "fts5" or len(query) < MIN_INDEXED_QUERY_LENGTH:
+		return None
+	# A trigram phrase matches any row containing the query as a substring; the
+	# owner's delimited key cannot be a substring of another owner's.
+	expression = f"owner_key : {_fts_phrase(f'<{owner_user_id}>')} AND "
+	expression += f"{{original_filename content_type}} : {_fts_phrase(query)}"
+	hits = list(
+		await db.scalars(
+			select(_fts.c.rowid).where(_fts.c[FTS_TABLE].op("MATCH")(expression)).limit(INDEX_CANDIDATE_LIMIT + 1)
+		)
+	)
+	return hits if len(hits) <= INDEX_CANDIDATE_LIMIT else None
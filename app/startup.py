@@ -0,0 +1,182 @@
+import asyncio
+from collections.abc import Iterator
+from contextlib import contextmanager
+import logging
+import os
+import time
+
+from app import database, metrics
+from app.config import Settings
+from app.utils import issue_download_token
+
+
+# Not a real user; warm-up requests only ever read, and find nothing.
+WARM_UP_USER_ID = 2**31 - 1
+
+logger = logging.getLogger(__name__)
+
+
+def _process_started() -> float:
+	"""When this process started, on the ``time.monotonic`` clock.
+
+	Read from /proc on Linux so interpreter and server start-up count too;
+	elsewhere it falls back to when this module was imported.
+	"""
+	try:
+		with open("/proc/self/stat", "rb") as stat:
+			# Fields after the parenthesised command name; starttime is field 22.
+			fields = stat.read().rsplit(b")", 1)[1].split()
+		started_since_boot = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+		return time.monotonic() - (time.clock_gettime(time.CLOCK_BOOTTIME) - started_since_boot)
+	except (OSError, ValueError, IndexError, AttributeError):
+		return time.monotonic()
+
+
+PROCESS_STARTED = _process_started()
+
+
+class StartupTracker:
+	"""One worker's start: ``starting`` until warmed up, ``ready``, then ``draining`` on shutdown.
+
+	Times are seconds since the process started, so ``seconds_to_first_request``
+	is the cold-start cost an autoscaled instance adds to the request it was
+	started for.
+	"""
+
+	def __init__(self, process_started: float = PROCESS_STARTED):
+		self.process_started = process_started
+		self.status = "starting"
+		self.phases: dict[str, float] = {}
+		self.seconds_to_ready: float | None = None
+		self.seconds_to_first_request: float | None = None
+
+	def _elapsed(self) -> float:
+		return round(time.monotonic() - self.process_started, 4)
+
+	@contextmanager
+	def phase(self, name: str) -> Iterator[None]:
+		started = time.monotonic()
+		try:
+			yield
+		finally:
+			self.phases[name] = round(time.monotonic() - started, 4)
+
+	def mark_imported(self) -> None:
+		self.phases["import"] = self._elapsed()
+
+	def mark_created(self) -> None:
+		self.phases["create_app"] = round(self._elapsed() - self.phases["import"], 4)
+
+	def mark_ready(self) -> None:
+		self.status = "ready"
+		self.seconds_to_ready = self._elapsed()
+		metrics.STARTUP_SECONDS.labels("ready").set(self.seconds_to_ready)
+		logger.info("Ready %.3fs after process start (%s)", self.seconds_to_ready, self.phases)
+
+	def mark_draining(self) -> None:
+		self.status = "draining"
+
+	def mark_first_request(self) -> None:
+		self.seconds_to_first_request = self._elapsed()
+		metrics.STARTUP_SECONDS.labels("first_request").set(self.seconds_to_first_request)
+		logger.info("Served the first request %.3fs after process start", self.seconds_to_first_request)
+
+	def stats(self) -> dict:
+		return {
+			"status": self.status,
+			"seconds_to_ready": self.seconds_to_ready,
+			"seconds_to_first_request": self.seconds_to_first_request,
+			"phases": dict(self.phases),
+		}
+
+
+class FirstRequestMiddleware:
+	"""Pure ASGI middleware that records when the first real request finishes, then gets out of the way."""
+
+	def __init__(self, app, tracker: StartupTracker):
+		self.app = app
+		self.tracker = tracker
+
+	async def __call__(self, scope, receive, send) -> None:
+		await self.app(scope, receive, send)
+		if (
+			self.tracker.seconds_to_first_request is None
+			and scope["type"] == "http"
+			and not scope.get(metrics.WARM_UP_SCOPE_KEY)
+		):
+			self.tracker.mark_first_request()
+
+
+async def _send_warm_up_request(app, method: str, path: str, headers: dict[str, str], body: bytes = b"") -> int:
+	path, _, query = path.partition("?")
+	scope = {
+		"type": "http",
+		# 2.4: responses do not listen for disconnects, so bodies are always sent in full.
+		"asgi": {"version": "3.0", "spec_version": "2.4"},
+		"http_version": "1.1",
+		"method": method,
+		"scheme": "http",
+		"path": path,
+		"raw_path": path.encode(),
+		"root_path": "",
+		"query_string": query.encode(),
+		"headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+		"client": None,
+		"server": ("warm-up", 80),
+		"state": {},
+		metrics.WARM_UP_SCOPE_KEY: True,
+	}
+	finished = asyncio.Event()
+	request_sent = False
+	status_code = 500
+
+	async def receive() -> dict:
+		nonlocal request_sent
+		if not request_sent:
+			request_sent = True
+			return {"type": "http.request", "body": body, "more_body": False}
+		await finished.wait()
+		return {"type": "http.disconnect"}
+
+	async def send(message: dict) -> None:
+		nonlocal status_code
+		if message["type"] == "http.response.start":
+			status_code = message["status"]
+
+	try:
+		await app(scope, receive, send)
+	finally:
+		finished.set()
+	return status_code
+
+
+async def warm_up(app, settings: Settings) -> None:
+	"""Readies this worker for real traffic before it reports ready.
+
+	Opens the database pools to their steady size, then sends the read paths
+	of the busiest endpoints through the app in-process. That builds the
+	middleware stack and fills SQLAlchemy's compiled-statement cache, the
+	response serializers and the token code the first real requests would
+	otherwise pay for. A failed warm-up request is logged, never fatal.
+	"""
+	await database.warm_pool(settings)
+	user = {"X-User-Id": str(WARM_UP_USER_ID)}
+	# Signs with the configured format and keys; the file does not exist, so this ends in a 404.
+	token = issue_download_token(settings, WARM_UP_USER_ID, WARM_UP_USER_ID, 60)
+	json_body = {**user, "Content-Type": "application/json"}
+	for method, path, headers, body in (
+		("GET", "/files?limit=1", user, b""),
+		("GET", "/files?limit=1", {**user, "Accept": "application/x-ndjson"}, b""),
+		("GET", "/files/search?q=warm-up&limit=1", user, b""),
+		("GET", "/files/usage", user, b""),
+		# Reads the file before anything is written, so this is a 404 too.
+		("POST", f"/files/{WARM_UP_USER_ID}/signed-link", json_body, b'{"ttl_seconds": 60}'),
+		("GET", f"/download/{token}", {}, b""),
+	):
+		try:
+			status_code = await _send_warm_up_request(app, method, path, headers, body)
+		except Exception:
+			logger.warning("Warm-up request %s %s failed", method, path, exc_info=True)
+			continue
+		if status_code >= 500:
+			logger.warning("Warm-up request %s %s answered %d", method, path, status_code)
@@ -0,0 +1,604 @@
+from abc import ABC, abstractmethod
+import asyncio
+from collections.abc import Iterator
+from contextlib import suppress
+import gzip
+import hashlib
+import os
+from pathlib import Path
+import re
+from typing import BinaryIO
+from urllib.parse import quote
+import uuid
+import zlib
+
+import anyio
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import Settings
+from app.models import Blob
+
+
+TMP_DIR_NAME = ".tmp"
+HASH_CHUNK_SIZE = 1024 * 1024
+GZIP = "gzip"
+# Compression is abandoned once this much input shows it will not pay off.
+COMPRESSION_PROBE_BYTES = 1024 * 1024
+DECODE_CHUNK_SIZE = 256 * 1024
+MAX_FANOUT_DEPTH = 4
+FANOUT_WIDTH = 2
+
+# A blob's name: its digest, then (since blobs got their own paths) a per-blob suffix.
+_BLOB_NAME = re.compile(r"([0-9a-f]{64})(?:-[0-9a-f]{32})?")
+
+io_limiter: anyio.CapacityLimiter | None = None
+
+
+def init_io_limiter(threads: int) -> None:
+	"""Bounds how many threads may block on upload disk I/O at once.
+
+	Kept separate from the default threadpool so a slow disk cannot starve sync
+	routes and DB work of threads.
+	"""
+	global io_limiter
+	io_limiter = anyio.CapacityLimiter(threads)
+
+
+async def run_io(func, *args):
+	return await anyio.to_thread.run_sync(func, *args, limiter=io_limiter)
+
+
+def pwrite_all(fd: int, data: bytes, offset: int) -> int:
+	view = memoryview(data)
+	while view:
+		written = os.pwrite(fd, view, offset)
+		view = view[written:]
+		offset += written
+	return len(data)
+
+
+def tmp_dir(upload_dir: Path) -> Path:
+	path = upload_dir / TMP_DIR_NAME
+	path.mkdir(parents=True, exist_ok=True)
+	return path
+
+
+def compression_level_for(settings: Settings, content_type: str) -> int | None:
+	"""The gzip level to store ``content_type`` with, or ``None`` to keep it as uploaded."""
+	if settings.storage_compression != GZIP:
+		return None
+	media_type = content_type.split(";", 1)[0].strip().lower()
+	for pattern in settings.storage_compressible_types:
+		if media_type == pattern or (pattern.endswith("/*") and media_type.startswith(pattern[:-1])):
+			return settings.storage_compression_level
+	return None
+
+
+class GzipSpool:
+	"""Gzip-compresses a byte stream into a temp file next to the raw one.
+
+	Gives up (and drops its file) as soon as the first
+	``COMPRESSION_PROBE_BYTES`` show the savings will stay under
+	``min_savings_percent``, so incompressible uploads with a text content type
+	cost little CPU; ``finish`` applies the same test to the whole stream.
+	"""
+
+	def __init__(self, upload_dir: Path, level: int, min_savings_percent: int):
+		self.path = tmp_dir(upload_dir) / f"{uuid.uuid4().hex}.gz"
+		self.raw_bytes = 0
+		self.size_bytes = 0
+		self.abandoned = False
+		self._min_savings_percent = min_savings_percent
+		self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+		self._probed = False
+		self._file = self.path.open("wb")
+
+	def write(self, chunk: bytes) -> None:
+		if self.abandoned:
+			return
+		self._emit(self._compressor.compress(chunk))
+		self.raw_bytes += len(chunk)
+		if not self._probed and self.raw_bytes >= COMPRESSION_PROBE_BYTES:
+			self._probed = True
+			if not self._pays_off():
+				self.abandon()
+
+	def finish(self) -> bool:
+		"""Flushes the stream; returns whether the compressed file should be kept."""
+		if self.abandoned:
+			return False
+		self._emit(self._compressor.flush())
+		self._file.close()
+		if not self._pays_off():
+			self.abandon()
+			return False
+		return True
+
+	def abandon(self) -> None:
+		self.abandoned = True
+		if not self._file.closed:
+			self._file.close()
+		self.path.unlink(missing_ok=True)
+
+	def _emit(self, data: bytes) -> None:
+		if data:
+			self._file.write(data)
+			self.size_bytes += len(data)
+
+	def _pays_off(self) -> bool:
+		return self.size_bytes * 100 <= self.raw_bytes * (100 - self._min_savings_percent)
+
+
+class BlobWriter:
+	"""Streams an upload into a temporary file while hashing it.
+
+	The temp file lives under ``upload_dir`` so it can be renamed into the
+	content-addressed store without copying the bytes again. With an
+	``encoder`` the upload is compressed in the same pass; if that pays off,
+	``close`` swaps ``tmp_path`` for the compressed file and sets
+	``content_encoding``. The digest is always of the uploaded bytes.
+	"""
+
+	def __init__(self, upload_dir: Path, encoder: GzipSpool | None = None):
+		self.upload_dir = upload_dir
+		self.tmp_path = tmp_dir(upload_dir) / uuid.uuid4().hex
+		self.size_bytes = 0
+		self.content_encoding: str | None = None
+		self.stored_size_bytes: int | None = None
+		self._encoder = encoder
+		self._hasher = hashlib.sha256()
+		self._file = self.tmp_path.open("wb")
+
+	def write(self, chunk: bytes) -> None:
+		self._file.write(chunk)
+		self._hasher.update(chunk)
+		self.size_bytes += len(chunk)
+		if self._encoder is not None:
+			self._encoder.write(chunk)
+
+	def close(self) -> str:
+		self._file.close()
+		if self._encoder is not None and self._encoder.finish():
+			self.tmp_path.unlink(missing_ok=True)
+			self.tmp_path = self._encoder.path
+			self.content_encoding = GZIP
+			self.stored_size_bytes = self._encoder.size_bytes
+		return self._hasher.hexdigest()
+
+	def discard(self) -> None:
+		if not self._file.closed:
+			self._file.close()
+		self.tmp_path.unlink(missing_ok=True)
+		if self._encoder is not None:
+			self._encoder.abandon()
+
+
+class AsyncBlobWriter:
+	"""Buffers upload chunks on the event loop and writes them on the I/O pool.
+
+	At most one buffer write is in flight while the next one fills. ``write``
+	waits for it before submitting another, so a slow disk pushes back on the
+	request body instead of growing memory.
+	"""
+
+	def __init__(self, writer: BlobWriter, buffer_size: int):
+		self._writer = writer
+		self._buffer_size = buffer_size
+		self._buffer = bytearray()
+		self._pending: asyncio.Task | None = None
+
+	@classmethod
+	async def open(
+		cls, upload_dir: Path, buffer_size: int, compression_level: int | None = None, min_savings_percent: int = 0
+	) -> "AsyncBlobWriter":
+		def create() -> BlobWriter:
+			encoder = None
+			if compression_level is not None:
+				encoder = GzipSpool(upload_dir, compression_level, min_savings_percent)
+			return BlobWriter(upload_dir, encoder)
+
+		return cls(await run_io(create), buffer_size)
+
+	@property
+	def tmp_path(self) -> Path:
+		return self._writer.tmp_path
+
+	@property
+	def size_bytes(self) -> int:
+		return self._writer.size_bytes + len(self._buffer)
+
+	@property
+	def content_encoding(self) -> str | None:
+		return self._writer.content_encoding
+
+	@property
+	def stored_size_bytes(self) -> int | None:
+		return self._writer.stored_size_bytes
+
+	async def write(self, chunk: bytes) -> None:
+		self._buffer += chunk
+		if len(self._buffer) >= self._buffer_size:
+			await self._submit()
+
+	async def close(self) -> str:
+		await self._submit()
+		await self._wait_pending()
+		return await run_io(self._writer.close)
+
+	async def discard(self) -> None:
+		with suppress(Exception):
+			await self._wait_pending()
+		await run_io(self._writer.discard)
+
+	async def _submit(self) -> None:
+		await self._wait_pending()
+		if not self._buffer:
+			return
+		data = bytes(self._buffer)
+		self._buffer.clear()
+		self._pending = asyncio.create_task(run_io(self._writer.write, data))
+
+	async def _wait_pending(self) -> None:
+		pending, self._pending = self._pending, None
+		if pending is not None:
+			await pending
+
+
+def fanout_path(upload_dir: Path, name: str, depth: int) -> Path:
+	"""Places ``name`` under ``depth`` levels of two-hex-digit directories (``ab/cd/<name>``).
+
+	Blob names start with their SHA-256 digest; other names are hashed so that
+	legacy per-upload files spread as evenly.
+	"""
+	match = _BLOB_NAME.fullmatch(name)
+	key = match.group(1) if match else hashlib.sha256(name.encode()).hexdigest()
+	levels = [key[level * FANOUT_WIDTH : (level + 1) * FANOUT_WIDTH] for level in range(depth)]
+	return upload_dir.joinpath(*levels, name)
+
+
+def blob_name(sha256: str) -> str:
+	"""A name no other blob row will ever have, even one for the same content.
+
+	Blob rows come and go: a purge may delete the last row for a digest while
+	an upload of the same bytes is inserting a new one. With one name per
+	digest the purge would then unlink the new row's bytes, and concurrent
+	uploads in different encodings would overwrite each other's.
+	"""
+	return f"{sha256}-{uuid.uuid4().hex}"
+
+
+def blob_sha256(name: str) -> str | None:
+	"""The digest a blob file is named after, or ``None`` for other files."""
+	match = _BLOB_NAME.fullmatch(name)
+	return match.group(1) if match else None
+
+
+def candidate_paths(upload_dir: Path, path: Path) -> list[Path]:
+	"""The recorded path first, then every layout the same file could have moved to."""
+	candidates = [path]
+	for depth in range(MAX_FANOUT_DEPTH + 1):
+		candidate = fanout_path(upload_dir, path.name, depth)
+		if candidate not in candidates:
+			candidates.append(candidate)
+	return candidates
+
+
+def locate_file(upload_dir: Path, path: Path) -> tuple[Path, os.stat_result]:
+	"""Stats ``path``, falling back to the other fan-out layouts.
+
+	While ``python -m app.cli migrate-layout`` runs, metadata cached before a
+	file moved still points at its old location.
+	"""
+	for candidate in candidate_paths(upload_dir, path):
+		try:
+			return candidate, os.stat(candidate)
+		except FileNotFoundError:
+			continue
+	raise FileNotFoundError(path)
+
+
+def remove_file(path: Path) -> None:
+	if path.exists() and path.is_file():
+		path.unlink()
+
+
+def hash_file(path: Path, encoder: GzipSpool | None = None) -> tuple[str, int]:
+	"""Digest and size of ``path``; an ``encoder`` is fed the same reads."""
+	hasher = hashlib.sha256()
+	size_bytes = 0
+	with path.open("rb") as in_file:
+		while chunk := in_file.read(HASH_CHUNK_SIZE):
+			hasher.update(chunk)
+			size_bytes += len(chunk)
+			if encoder is not None:
+				encoder.write(chunk)
+	return hasher.hexdigest(), size_bytes
+
+
+class GzipReader(gzip.GzipFile):
+	"""Decompressing reader that also closes the stream it reads from."""
+
+	def __init__(self, source: BinaryIO):
+		super().__init__(fileobj=source, mode="rb")
+		self._source = source
+
+	def close(self) -> None:
+		try:
+			super().close()
+		finally:
+			self._source.close()
+
+
+def open_decoded(locator: str, content_encoding: str | None) -> BinaryIO:
+	"""Opens the bytes behind ``locator`` as they were uploaded."""
+	source = backend_for(locator).open(locator)
+	return GzipReader(source) if content_encoding == GZIP else source
+
+
+def iter_gunzip(source: BinaryIO, chunk_size: int = DECODE_CHUNK_SIZE) -> Iterator[bytes]:
+	"""Decompresses a gzip stream chunk by chunk; output per chunk is capped at ``4 * chunk_size``."""
+	decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+	with source:
+		while data := source.read(chunk_size):
+			while data:
+				output = decoder.decompress(data, 4 * chunk_size)
+				data = decoder.unconsumed_tail
+				if output:
+					yield output
+		if tail := decoder.flush():
+			yield tail
+
+
+class StorageBackend(ABC):
+	"""Where blob bytes live once an upload has been hashed.
+
+	Uploads are always spooled to a local temp file first (the content address
+	is only known once the last byte is in); ``store`` moves or copies that file
+	into the backend and returns the locator recorded in ``Blob.storage_path``.
+	Backends with slow stores set ``stages_outside_writes`` so the transfer
+	happens before the write transaction instead of inside it. Methods block
+	and are called through ``run_io``.
+	"""
+
+	stages_outside_writes = False
+
+	@abstractmethod
+	def owns(self, locator: str) -> bool: ...
+
+	@abstractmethod
+	def store(self, tmp_path: Path, sha256: str) -> str: ...
+
+	@abstractmethod
+	def delete(self, locator: str) -> None: ...
+
+	@abstractmethod
+	def open(self, locator: str) -> BinaryIO: ...
+
+	@abstractmethod
+	def presigned_url(
+		self, locator: str, filename: str, content_type: str, content_encoding: str | None = None
+	) -> str:
+		"""A short-lived URL clients fetch the bytes from without going through the app."""
+
+
+class LocalBackend(StorageBackend):
+	def __init__(self, upload_dir: Path, fanout_depth: int = 0):
+		self.upload_dir = upload_dir
+		self.fanout_depth = fanout_depth
+
+	def owns(self, locator: str) -> bool:
+		return "://" not in locator
+
+	def store(self, tmp_path: Path, sha256: str) -> str:
+		destination = fanout_path(self.upload_dir, blob_name(sha256), self.fanout_depth)
+		destination.parent.mkdir(parents=True, exist_ok=True)
+		os.replace(tmp_path, destination)
+		return str(destination)
+
+	def delete(self, locator: str) -> None:
+		remove_file(Path(locator))
+
+	def open(self, locator: str) -> BinaryIO:
+		return locate_file(self.upload_dir, Path(locator))[0].open("rb")
+
+	def presigned_url(
+		self, locator: str, filename: str, content_type: str, content_encoding: str | None = None
+	) -> str:
+		# Local files are streamed by the app (or handed to the proxy with DOWNLOAD_OFFLOAD).
+		raise RuntimeError("Files in UPLOAD_DIR have no presigned URL; the app serves them")
+
+
+class S3Backend(StorageBackend):
+	"""S3-compatible object storage (AWS S3, DigitalOcean Spaces, MinIO).
+
+	Objects are uploaded with boto3's managed transfer, which switches to a
+	multipart upload above ``multipart_chunk_bytes`` and sends parts in
+	parallel. Downloads are presigned ``GetObject`` URLs carrying the file's
+	own name and content type, since one blob may back several files.
+	"""
+
+	stages_outside_writes = True
+
+	def __init__(
+		self,
+		client,
+		bucket: str,
+		key_prefix: str,
+		fanout_depth: int,
+		presign_ttl_seconds: int,
+		multipart_chunk_bytes: int,
+	):
+		from boto3.s3.transfer import TransferConfig
+
+		self.client = client
+		self.bucket = bucket
+		self.key_prefix = key_prefix
+		self.fanout_depth = fanout_depth
+		self.presign_ttl_seconds = presign_ttl_seconds
+		self.transfer_config = TransferConfig(
+			multipart_threshold=multipart_chunk_bytes, multipart_chunksize=multipart_chunk_bytes
+		)
+
+	@classmethod
+	def from_settings(cls, settings: Settings) -> "S3Backend":
+		try:
+			import boto3
+			from botocore.config import Config
+		except ImportError as exc:
+			raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)") from exc
+
+		client = boto3.client(
+			"s3",
+			endpoint_url=settings.s3_endpoint_url,
+			region_name=settings.s3_region,
+			aws_access_key_id=settings.s3_access_key_id,
+			aws_secret_access_key=settings.s3_secret_access_key,
+			# SigV2 presigned URLs are rejected by newer regions and by Spaces.
+			config=Config(signature_version="s3v4"),
+		)
+		return cls(
+			client,
+			bucket=settings.s3_bucket,
+			key_prefix=settings.s3_key_prefix,
+			fanout_depth=settings.upload_fanout_depth,
+			presign_ttl_seconds=settings.s3_presign_ttl_seconds,
+			multipart_chunk_bytes=settings.s3_multipart_chunk_bytes,
+		)
+
+	def _key(self, locator: str) -> str:
+		return locator.removeprefix(f"s3://{self.bucket}/")
+
+	def owns(self, locator: str) -> bool:
+		return locator.startswith(f"s3://{self.bucket}/")
+
+	def store(self, tmp_path: Path, sha256: str) -> str:
+		key = fanout_path(Path(), blob_name(sha256), self.fanout_depth).as_posix()
+		if self.key_prefix:
+			key = f"{self.key_prefix}/{key}"
+		self.client.upload_file(str(tmp_path), self.bucket, key, Config=self.transfer_config)
+		return f"s3://{self.bucket}/{key}"
+
+	def delete(self, locator: str) -> None:
+		self.client.delete_object(Bucket=self.bucket, Key=self._key(locator))
+
+	def open(self, locator: str) -> BinaryIO:
+		return self.client.get_object(Bucket=self.bucket, Key=self._key(locator))["Body"]
+
+	def presigned_url(
+		self, locator: str, filename: str, content_type: str, content_encoding: str | None = None
+	) -> str:
+		quoted = quote(filename)
+		params = {
+			"Bucket": self.bucket,
+			"Key": self._key(locator),
+			"ResponseContentType": content_type,
+			"ResponseContentDisposition": f"attachment; filename*=utf-8''{quoted}",
+		}
+		if content_encoding is not None:
+			params["ResponseContentEncoding"] = content_encoding
+		return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=self.presign_ttl_seconds)
+
+
+backend: StorageBackend | None = None
+local_backend: LocalBackend | None = None
+
+
+def init_storage_backend(settings: Settings) -> None:
+	"""``backend`` receives new blobs; locators written by the other backend stay readable."""
+	global backend, local_backend
+	local_backend = LocalBackend(settings.upload_dir, settings.upload_fanout_depth)
+	backend = S3Backend.from_settings(settings) if settings.storage_backend == "s3" else local_backend
+
+
+def backend_for(locator: str) -> StorageBackend:
+	if backend is not None and backend.owns(locator):
+		return backend
+	if local_backend is not None and local_backend.owns(locator):
+		return local_backend
+	raise RuntimeError(f"No configured storage backend for {locator}")
+
+
+async def stage_blob(db: AsyncSession, tmp_path: Path, sha256: str) -> str | None:
+	"""Uploads new content to a remote backend before the write transaction starts.
+
+	Returns the locator to hand to ``store_blob``, or ``None`` when the backend
+	is local or the content is already stored.
+	"""
+	if not backend.stages_outside_writes:
+		return None
+	if await db.scalar(select(Blob.id).where(Blob.sha256 == sha256)) is not None:
+		return None
+	return await run_io(backend.store, tmp_path, sha256)
+
+
+async def store_blob(
+	db: AsyncSession,
+	tmp_path: Path,
+	sha256: str,
+	size_bytes: int,
+	staged_locator: str | None = None,
+	content_encoding: str | None = None,
+	stored_size_bytes: int | None = None,
+) -> Blob:
+	"""Moves a finished temp file into the storage backend and takes a reference on it.
+
+	Identical content is kept once: if a blob with the same digest exists its
+	reference count is bumped and the temp file is dropped, whatever encoding
+	either copy has. ``content_encoding`` describes ``tmp_path`` when it holds
+	compressed bytes. Callers commit.
+	"""
+	for _ in range(3):
+		blob = (await db.execute(select(Blob).where(Blob.sha256 == sha256))).scalar_one_or_none()
+		if blob is not None:
+			result = await db.execute(
+				update(Blob).where(Blob.id == blob.id).values(ref_count=Blob.ref_count + 1)
+				.execution_options(synchronize_session=False)
+			)
+			if result.rowcount:
+				await run_io(tmp_path.unlink, True)
+				if staged_locator is not None:
+					# Staged before a concurrent upload of the same content inserted its row.
+					await run_io(backend_for(staged_locator).delete, staged_locator)
+				await db.refresh(blob)
+				return blob
+			continue
+
+		storage_path = staged_locator or await run_io(backend.store, tmp_path, sha256)
+		staged_locator = storage_path
+		await run_io(tmp_path.unlink, True)
+		blob = Blob(
+			sha256=sha256,
+			size_bytes=size_bytes,
+			storage_path=storage_path,
+			content_encoding=content_encoding,
+			stored_size_bytes=stored_size_bytes,
+			ref_count=1,
+		)
+		try:
+			async with db.begin_nested():
+				db.add(blob)
+		except IntegrityError:
+			# A concurrent upload of the same content won the insert; retry as a dedupe hit.
+			continue
+		return blob
+
+	raise RuntimeError(f"Could not store blob {sha256}")
+
+
+async def release_blob(db: AsyncSession, blob_id: int) -> str | None:
+	"""Drops one reference to a blob.
+
+	Returns the locator whose bytes should be deleted once the caller has
+	committed, or ``None`` while other files still reference the blob.
+	"""
+	await db.execute(update(Blob).where(Blob.id == blob_id).values(ref_count=Blob.ref_count - 1))
+	blob = (
+		await db.execute(select(Blob).where(Blob.id == blob_id, Blob.ref_count <= 0))
+	).scalar_one_or_none()
+	if blob is None:
+		return None
+	locator = blob.storage_path
+	await db.delete(blob)
+	return locator
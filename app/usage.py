@@ -0,0 +1,150 @@
+from dataclasses import dataclass, field
+
+from fastapi import HTTPException, status
+from sqlalchemy import func, select, union, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models import StoredFile, UserUsage, utcnow
+
+
+def quota_exceeded(quota_bytes: int) -> HTTPException:
+	return HTTPException(
+		status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=f"Storage quota exceeded ({quota_bytes} bytes)"
+	)
+
+
+async def get_usage(db: AsyncSession, user_id: int) -> UserUsage | None:
+	return await db.get(UserUsage, user_id)
+
+
+async def remaining_quota(db: AsyncSession, user_id: int, quota_bytes: int) -> int | None:
+	"""Bytes ``user_id`` may still add, or ``None`` when quotas are off."""
+	if not quota_bytes:
+		return None
+	bytes_used = await db.scalar(select(UserUsage.bytes_used).where(UserUsage.user_id == user_id))
+	return max(0, quota_bytes - (bytes_used or 0))
+
+
+async def charge_usage(db: AsyncSession, user_id: int, size_bytes: int, quota_bytes: int = 0) -> None:
+	"""Adds one file of ``size_bytes`` to the user's totals inside the caller's transaction.
+
+	With ``quota_bytes`` set the increment is conditional, so concurrent
+	uploads that each passed the streaming check cannot overshoot together;
+	the loser gets a 413 and the caller's transaction rolls back.
+	"""
+	if quota_bytes and size_bytes > quota_bytes:
+		raise quota_exceeded(quota_bytes)
+	for _ in range(3):
+		query = update(UserUsage).where(UserUsage.user_id == user_id)
+		if quota_bytes:
+			query = query.where(UserUsage.bytes_used + size_bytes <= quota_bytes)
+		result = await db.execute(
+			query.values(
+				bytes_used=UserUsage.bytes_used + size_bytes,
+				file_count=UserUsage.file_count + 1,
+				last_upload_at=utcnow(),
+			).execution_options(synchronize_session=False)
+		)
+		if result.rowcount:
+			return
+		if await db.scalar(select(UserUsage.user_id).where(UserUsage.user_id == user_id)) is not None:
+			raise quota_exceeded(quota_bytes)
+
+		try:
+			async with db.begin_nested():
+				db.add(UserUsage(user_id=user_id, bytes_used=size_bytes, file_count=1, last_upload_at=utcnow()))
+		except IntegrityError:
+			# A concurrent first upload created the row; retry as an increment.
+			continue
+		return
+
+	raise RuntimeError(f"Could not update usage for user {user_id}")
+
+
+async def release_usage(db: AsyncSession, user_id: int, size_bytes: int) -> None:
+	"""Subtracts one file of ``size_bytes``; the caller commits with the tombstone."""
+	await db.execute(
+		update(UserUsage)
+		.where(UserUsage.user_id == user_id)
+		.values(bytes_used=UserUsage.bytes_used - size_bytes, file_count=UserUsage.file_count - 1)
+		.execution_options(synchronize_session=False)
+	)
+
+
+@dataclass
+class UsageReport:
+	users_checked: int = 0
+	users_corrected: int = 0
+	corrected_user_ids: list[int] = field(default_factory=list)
+
+
+def rebuild_usage(db: Session, batch_size: int = 500, dry_run: bool = False) -> UsageReport:
+	"""Recomputes every user's totals from ``stored_files`` and fixes drifted rows.
+
+	Works through users in batches of ``batch_size``. Each batch locks its
+	usage rows before summing the files (``FOR UPDATE`` on Postgres; SQLite
+	serializes writers anyway), so uploads and deletes committing meanwhile
+	are either already in the sums or apply their own change afterwards.
+	"""
+	report = UsageReport()
+	users = union(select(StoredFile.owner_user_id.label("user_id")), select(UserUsage.user_id)).subquery()
+	last_user_id = None
+	while True:
+		query = select(users.c.user_id).order_by(users.c.user_id).limit(batch_size)
+		if last_user_id is not None:
+			query = query.where(users.c.user_id > last_user_id)
+		user_ids = list(db.scalars(query))
+		if not user_ids:
+			return report
+		last_user_id = user_ids[-1]
+
+		if not dry_run:
+			# Rows must exist before they can be locked.
+			existing = set(db.scalars(select(UserUsage.user_id).where(UserUsage.user_id.in_(user_ids))))
+			for user_id in user_ids:
+				if user_id not in existing:
+					try:
+						with db.begin_nested():
+							db.add(UserUsage(user_id=user_id, bytes_used=0, file_count=0))
+					except IntegrityError:
+						pass
+
+		recorded = {
+			row.user_id: row
+			for row in db.scalars(
+				select(UserUsage).where(UserUsage.user_id.in_(user_ids)).with_for_update()
+			)
+		}
+		actual = {
+			row.owner_user_id: row
+			for row in db.execute(
+				select(
+					StoredFile.owner_user_id,
+					func.coalesce(func.sum(StoredFile.size_bytes), 0).label("bytes_used"),
+					func.count().label("file_count"),
+					func.max(StoredFile.created_at).label("last_upload_at"),
+				)
+				.where(StoredFile.owner_user_id.in_(user_ids), StoredFile.deleted_at.is_(None))
+				.group_by(StoredFile.owner_user_id)
+			)
+		}
+		for user_id in user_ids:
+			report.users_checked += 1
+			usage = recorded.get(user_id)
+			totals = actual.get(user_id)
+			bytes_used, file_count = (totals.bytes_used, totals.file_count) if totals is not None else (0, 0)
+			if usage is not None and (usage.bytes_used, usage.file_count) == (bytes_used, file_count):
+				continue
+			report.users_corrected += 1
+			report.corrected_user_ids.append(user_id)
+			if usage is not None and not dry_run:
+				usage.bytes_used = bytes_used
+				usage.file_count = file_count
+				if usage.last_upload_at is None and totals is not None:
+					usage.last_upload_at = totals.last_upload_at
+		if dry_run:
+			db.rollback()
+		else:
+			db.commit()
@@ -0,0 +1,97 @@
+import asyncio
+from contextlib import suppress
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+
+WriteOp = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class WriteQueue:
+	"""Runs database writes one batch at a time on a single task.
+
+	Each submitted op runs inside its own SAVEPOINT so a failing op only rolls
+	back itself; the batch is then committed once (group commit) and every
+	caller is resumed with its own result or exception. Ops that arrive while a
+	batch is committing form the next batch.
+	"""
+
+	def __init__(self, session_factory: async_sessionmaker, max_batch_size: int = 64, max_delay_seconds: float = 0.0):
+		self._session_factory = session_factory
+		self._max_batch_size = max_batch_size
+		self._max_delay_seconds = max_delay_seconds
+		self._queue: asyncio.Queue[tuple[WriteOp, asyncio.Future]] = asyncio.Queue()
+		self._worker: asyncio.Task | None = None
+		self.batches_committed = 0
+		self.ops_committed = 0
+
+	def start(self) -> None:
+		if self._worker is None:
+			self._worker = asyncio.create_task(self._run())
+
+	async def stop(self) -> None:
+		worker, self._worker = self._worker, None
+		if worker is None:
+			return
+		# Let queued writes land before shutting down.
+		await self._queue.join()
+		worker.cancel()
+		with suppress(asyncio.CancelledError):
+			await worker
+
+	async def submit(self, op: WriteOp) -> Any:
+		if self._worker is None:
+			raise RuntimeError("Write queue is not running")
+		future = asyncio.get_running_loop().create_future()
+		await self._queue.put((op, future))
+		return await future
+
+	async def _collect_batch(self) -> list[tuple[WriteOp, asyncio.Future]]:
+		batch = [await self._queue.get()]
+		if self._max_delay_seconds:
+			await asyncio.sleep(self._max_delay_seconds)
+		while len(batch) < self._max_batch_size:
+			try:
+				batch.append(self._queue.get_nowait())
+			except asyncio.QueueEmpty:
+				break
+		return batch
+
+	async def _run(self) -> None:
+		while True:
+			batch = await self._collect_batch()
+			try:
+				await self._commit_batch(batch)
+			finally:
+				for _ in batch:
+					self._queue.task_done()
+
+	async def _commit_batch(self, batch: list[tuple[WriteOp, asyncio.Future]]) -> None:
+		results: list[tuple[asyncio.Future, bool, Any]] = []
+		try:
+			async with self._session_factory() as session:
+				for op, future in batch:
+					if future.cancelled():
+						continue
+					try:
+						async with session.begin_nested():
+							results.append((future, True, await op(session)))
+					except Exception as exc:
+						results.append((future, False, exc))
+				await session.commit()
+		except Exception as exc:
+			for _, future in batch:
+				if not future.done():
+					future.set_exception(exc)
+			return
+
+		self.batches_committed += 1
+		self.ops_committed += sum(1 for _, ok, _ in results if ok)
+		for future, ok, value in results:
+			if future.done():
+				continue
+			if ok:
+				future.set_result(value)
+			else:
+				future.set_exception(value)
@@ -0,0 +1,90 @@
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO
+import zipfile
+
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class ZipEntry:
+	name: str
+	path: Path | None
+	size_bytes: int
+	modified_at: datetime
+	# Members that are not local files (e.g. object storage) supply a reader instead of a path.
+	opener: Callable[[], BinaryIO] | None = None
+
+	def open(self) -> BinaryIO:
+		return self.opener() if self.opener is not None else self.path.open("rb")
+
+
+class _DrainableSink:
+	"""Write-only, unseekable file object that hands written bytes back out.
+
+	Because it cannot seek, ``zipfile`` writes each member with a trailing data
+	descriptor instead of patching the local header, which is what lets the
+	archive be streamed without a temp file.
+	"""
+
+	def __init__(self) -> None:
+		self._chunks: list[bytes] = []
+		self._offset = 0
+
+	def write(self, data) -> int:
+		self._chunks.append(bytes(data))
+		self._offset += len(data)
+		return len(data)
+
+	def tell(self) -> int:
+		return self._offset
+
+	def seek(self, *_args) -> int:
+		raise OSError("stream is not seekable")
+
+	def flush(self) -> None:
+		pass
+
+	def drain(self) -> Iterator[bytes]:
+		if self._chunks:
+			chunks, self._chunks = self._chunks, []
+			yield b"".join(chunks)
+
+
+def unique_archive_names(names: Iterable[str]) -> list[str]:
+	seen: set[str] = set()
+	unique = []
+	for name in names:
+		candidate = Path(name).name or "unnamed"
+		stem, suffix = Path(candidate).stem, Path(candidate).suffix
+		counter = 2
+		while candidate in seen:
+			candidate = f"{stem} ({counter}){suffix}"
+			counter += 1
+		seen.add(candidate)
+		unique.append(candidate)
+	return unique
+
+
+def iter_zip(entries: Iterable[ZipEntry]) -> Iterator[bytes]:
+	"""Yields a STORED (uncompressed) ZIP archive of ``entries`` chunk by chunk.
+
+	Memory stays bounded by one read chunk; ZIP64 records are emitted for
+	members and offsets beyond the 4 GiB limits.
+	"""
+	sink = _DrainableSink()
+	with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+		for entry in entries:
+			modified_at = max(entry.modified_at.replace(tzinfo=None), datetime(1980, 1, 1))
+			info = zipfile.ZipInfo(entry.name, date_time=modified_at.timetuple()[:6])
+			info.compress_type = zipfile.ZIP_STORED
+			force_zip64 = entry.size_bytes >= zipfile.ZIP64_LIMIT
+			with archive.open(info, "w", force_zip64=force_zip64) as member, entry.open() as source:
+				while chunk := source.read(READ_CHUNK_SIZE):
+					member.write(chunk)
+					yield from sink.drain()
+			yield from sink.drain()
+	yield from sink.drain()
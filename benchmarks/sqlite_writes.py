@@ -0,0 +1,92 @@
+"""Compare SQLite write throughput with and without WAL + the serialized writer.
+
+Run from the repository root:
+
+	python -m benchmarks.sqlite_writes --writes 2000 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from pathlib import Path
+import tempfile
+import time
+
+from app import database
+from app.config import get_settings
+from app.models import LinkAudit
+
+
+MODES = {
+	"rollback-journal, commit per write": {
+		"SQLITE_WAL": "false",
+		"SQLITE_SYNCHRONOUS": "FULL",
+		"SQLITE_SERIALIZED_WRITES": "false",
+	},
+	"wal, commit per write": {
+		"SQLITE_WAL": "true",
+		"SQLITE_SYNCHRONOUS": "NORMAL",
+		"SQLITE_SERIALIZED_WRITES": "false",
+	},
+	"wal, serialized group commit": {
+		"SQLITE_WAL": "true",
+		"SQLITE_SYNCHRONOUS": "NORMAL",
+		"SQLITE_SERIALIZED_WRITES": "true",
+	},
+}
+
+
+async def _run_mode(writes: int, concurrency: int) -> dict:
+	if database.write_queue is not None:
+		database.write_queue.start()
+	semaphore = asyncio.Semaphore(concurrency)
+	failures = 0
+
+	async def write_one(index: int) -> None:
+		nonlocal failures
+
+		async def op(session) -> None:
+			session.add(LinkAudit(file_id=1, requester_user_id=index, ttl_seconds=60))
+
+		async with semaphore:
+			try:
+				async with database.AsyncSessionLocal() as session:
+					await database.run_write(session, op)
+			except Exception:
+				failures += 1
+
+	started = time.perf_counter()
+	await asyncio.gather(*(write_one(index) for index in range(writes)))
+	elapsed = time.perf_counter() - started
+
+	result = {"writes": writes, "failures": failures, "seconds": round(elapsed, 4), "writes_per_second": round(writes / elapsed, 1)}
+	if database.write_queue is not None:
+		await database.write_queue.stop()
+		result["batches"] = database.write_queue.batches_committed
+	await database.async_engine.dispose()
+	database.engine.dispose()
+	return result
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--writes", type=int, default=2000)
+	parser.add_argument("--concurrency", type=int, default=64)
+	args = parser.parse_args()
+
+	results = {}
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		for index, (name, env) in enumerate(MODES.items()):
+			os.environ.update(env)
+			os.environ["DATABASE_URL"] = f"sqlite:///{Path(tmp_dir) / f'bench-{index}.db'}"
+			os.environ["DB_POOL_SIZE"] = str(args.concurrency)
+			database.init_database(get_settings())
+			database.Base.metadata.create_all(bind=database.engine)
+			results[name] = asyncio.run(_run_mode(args.writes, args.concurrency))
+
+	print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,132 @@
+"""Measure time-to-first-request of a freshly started server, optionally against a budget.
+
+Run from the repository root:
+
+	python -m benchmarks.startup --runs 3
+	python -m benchmarks.startup --runs 3 --workers 2 --budget-seconds 5
+
+Each run starts ``uvicorn app.main:app`` as a new process on the same
+temporary SQLite database (``--database-url`` for another, empty one), polls
+``GET /ready`` until it answers 200, then sends ``GET /files``. The first run
+starts on an empty database and so includes the migrations; later runs are
+restarts. Reported per run:
+
+* ``ready_seconds`` / ``first_request_seconds``: from spawning the process to
+  ``/ready`` answering 200 and to the first real response, as a client sees it;
+* ``server``: the worker's own ``/ready`` report (seconds since process start,
+  and how long each startup phase took).
+
+With ``--budget-seconds``, exits non-zero if any run's first request took
+longer; CI uses this to keep cold starts from creeping up.
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+POLL_INTERVAL_SECONDS = 0.01
+
+
+def free_port() -> int:
+	with socket.socket() as sock:
+		sock.bind(("127.0.0.1", 0))
+		return sock.getsockname()[1]
+
+
+def start_once(env: dict, workers: int, timeout: float) -> dict:
+	port = free_port()
+	command = [
+		sys.executable, "-m", "uvicorn", "app.main:app",
+		"--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning",
+	]
+	base_url = f"http://127.0.0.1:{port}"
+	started = time.perf_counter()
+	process = subprocess.Popen(command, cwd=PROJECT_ROOT, env=env)
+	try:
+		with httpx.Client(base_url=base_url, timeout=timeout) as client:
+			deadline = started + timeout
+			while True:
+				if process.poll() is not None:
+					raise RuntimeError(f"server exited with {process.returncode} before it was ready")
+				if time.perf_counter() > deadline:
+					raise RuntimeError(f"server not ready after {timeout}s")
+				try:
+					if client.get("/ready").status_code == 200:
+						break
+				except httpx.TransportError:
+					pass
+				time.sleep(POLL_INTERVAL_SECONDS)
+			ready_seconds = time.perf_counter() - started
+
+			request_started = time.perf_counter()
+			client.get("/files", headers={"X-User-Id": "1"}).raise_for_status()
+			first_request_seconds = time.perf_counter() - started
+			first_request_ms = (time.perf_counter() - request_started) * 1000
+			# Possibly another worker than the one that answered, with --workers > 1.
+			server = client.get("/ready").json()
+	finally:
+		process.terminate()
+		process.wait(timeout=30)
+	return {
+		"ready_seconds": round(ready_seconds, 3),
+		"first_request_seconds": round(first_request_seconds, 3),
+		"first_request_latency_ms": round(first_request_ms, 3),
+		"server": server,
+	}
+
+
+def run(args: argparse.Namespace) -> dict:
+	runs = []
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		work_dir = Path(tmp_dir)
+		database_url = args.database_url
+		if database_url == "sqlite":
+			database_url = f"sqlite:///{work_dir / 'bench.db'}"
+		env = {
+			**os.environ,
+			"DATABASE_URL": database_url,
+			"UPLOAD_DIR": str(work_dir / "uploads"),
+			"AUDIT_SPOOL_DIR": str(work_dir / "audit-spool"),
+		}
+		env.setdefault("SIGNING_SECRET", "benchmark-secret")
+		for _ in range(args.runs):
+			runs.append(start_once(env, args.workers, args.timeout))
+
+	slowest = max(run["first_request_seconds"] for run in runs)
+	report = {
+		"meta": {"database": args.database_url, "runs": args.runs, "workers": args.workers},
+		"runs": runs,
+		"slowest_first_request_seconds": slowest,
+	}
+	if args.budget_seconds is not None:
+		report["budget"] = {"seconds": args.budget_seconds, "exceeded": slowest > args.budget_seconds}
+	return report
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--database-url", default="sqlite", help="empty database to start on (default: temporary SQLite)")
+	parser.add_argument("--runs", type=int, default=3, help="server starts; the first one migrates")
+	parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes per start")
+	parser.add_argument("--timeout", type=float, default=60.0, help="give up on a start after this long")
+	parser.add_argument("--budget-seconds", type=float, help="fail if any start takes longer to serve its first request")
+	args = parser.parse_args()
+	report = run(args)
+	print(json.dumps(report, indent=2))
+	if report.get("budget", {}).get("exceeded"):
+		slowest = report["slowest_first_request_seconds"]
+		sys.exit(f"time-to-first-request {slowest}s exceeds the {args.budget_seconds}s budget")
+
+
+if __name__ == "__main__":
+	main()
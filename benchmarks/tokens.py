@@ -0,0 +1,56 @@
+"""Compare encode/decode throughput of JWT and compact download tokens.
+
+Run from the repository root:
+
+	python -m benchmarks.tokens --iterations 20000
+"""
+
+import argparse
+import json
+import time
+
+from app.utils import create_compact_token, create_download_token, decode_compact_token, decode_download_token
+
+
+SECRET = "benchmark-secret"
+
+
+def _ops_per_second(func, iterations: int) -> float:
+	started = time.perf_counter()
+	for _ in range(iterations):
+		func()
+	return round(iterations / (time.perf_counter() - started), 1)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--iterations", type=int, default=20000)
+	args = parser.parse_args()
+
+	jwt_token = create_download_token(1234, 5678, 600, SECRET, "HS256")
+	compact_token = create_compact_token(1234, 5678, 600, 0, SECRET)
+	keys = {0: SECRET}
+
+	results = {
+		"jwt": {
+			"token_length": len(jwt_token),
+			"encode_per_second": _ops_per_second(
+				lambda: create_download_token(1234, 5678, 600, SECRET, "HS256"), args.iterations
+			),
+			"decode_per_second": _ops_per_second(
+				lambda: decode_download_token(jwt_token, SECRET, "HS256"), args.iterations
+			),
+		},
+		"compact": {
+			"token_length": len(compact_token),
+			"encode_per_second": _ops_per_second(
+				lambda: create_compact_token(1234, 5678, 600, 0, SECRET), args.iterations
+			),
+			"decode_per_second": _ops_per_second(lambda: decode_compact_token(compact_token, keys), args.iterations),
+		},
+	}
+	print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+	main()
@@ -17,6 +17,12 @@ def build_client(tmp_path: Path) -> TestClient:
     return TestClient(app)
 
 
+def purge_deleted(client: TestClient) -> int:
+    from app import purge
+
+    return client.portal.call(purge.purge_worker.run_once)
+
+
 def test_upload_and_list_metadata(tmp_path: Path):
     with build_client(tmp_path) as client:
         upload_response = client.post(
@@ -104,7 +110,11 @@ def test_delete_file_removes_metadata_and_disk_file(tmp_path: Path):
 
         delete_response = client.delete(f"/files/{file_id}", headers={"X-User-Id": "12"})
         assert delete_response.status_code == 204
+        assert client.get("/files", headers={"X-User-Id": "12"}).json() == []
+        assert client.delete(f"/files/{file_id}", headers={"X-User-Id": "12"}).status_code == 404
+        assert disk_path.exists()
 
+        assert purge_deleted(client) == 1
         with SessionLocal() as session:
             stored_file_after_delete = session.query(StoredFile).filter(StoredFile.id == file_id).first()
             assert stored_file_after_delete is None
@@ -153,7 +163,480 @@ def test_list_user_link_audits(tmp_path: Path):
         assert audits[0]["ttl_seconds"] == 123
 
 
+def test_link_audit_pages_follow_the_requester_index(tmp_path: Path):
+    from sqlalchemy import event
+
+    from app import database
+
+    with build_client(tmp_path) as client:
+        for name in ("a.txt", "b.txt", "c.txt"):
+            upload_and_sign(client, "26", name, name.encode())
+
+        statements = []
+
+        def capture(_connection, _cursor, statement, parameters, _context, _executemany) -> None:
+            if "FROM link_audits" in statement:
+                statements.append((statement, parameters))
+
+        event.listen(database.async_engine.sync_engine, "before_cursor_execute", capture)
+        try:
+            first = client.get("/files/users/26/link-audits?limit=2", headers={"X-User-Id": "26"})
+            cursor = first.headers["X-Next-Cursor"]
+            client.get(f"/files/users/26/link-audits?limit=2&cursor={cursor}", headers={"X-User-Id": "26"})
+        finally:
+            event.remove(database.async_engine.sync_engine, "before_cursor_execute", capture)
+
+    assert statements
+    with database.engine.connect() as connection:
+        for statement, parameters in statements:
+            plan_rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            plan = " ".join(row[-1] for row in plan_rows)
+            assert "ix_link_audits_requester_created_id" in plan
+            assert "TEMP B-TREE" not in plan
+
+
 def test_list_user_link_audits_forbidden_when_user_mismatch(tmp_path: Path):
     with build_client(tmp_path) as client:
         forbidden_response = client.get("/files/users/99/link-audits", headers={"X-User-Id": "98"})
         assert forbidden_response.status_code == 403
+
+
+def upload_file(
+    client: TestClient, user_id: str, filename: str, content: bytes, content_type: str = "application/octet-stream"
+) -> int:
+    upload_response = client.post(
+        "/files/upload",
+        headers={"X-User-Id": user_id},
+        files={"file": (filename, content, content_type)},
+    )
+    assert upload_response.status_code == 201
+    assert upload_response.json()["size_bytes"] == len(content)
+    return upload_response.json()["file_id"]
+
+
+def sign_file(client: TestClient, user_id: str, file_id: int, ttl_seconds: int = 600) -> dict:
+    sign_response = client.post(
+        f"/files/{file_id}/signed-link",
+        headers={"X-User-Id": user_id},
+        json={"ttl_seconds": ttl_seconds},
+    )
+    assert sign_response.status_code == 200
+    return sign_response.json()
+
+
+def token_of(signed_link: dict) -> str:
+    return signed_link["download_url"].rsplit("/", 1)[1]
+
+
+def upload_and_sign(
+    client: TestClient,
+    user_id: str,
+    filename: str,
+    content: bytes,
+    ttl_seconds: int = 600,
+    content_type: str = "application/octet-stream",
+) -> str:
+    file_id = upload_file(client, user_id, filename, content, content_type)
+    return token_of(sign_file(client, user_id, file_id, ttl_seconds))
+
+
+def test_download_single_and_multi_range(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        token = upload_and_sign(client, "31", "range.bin", b"0123456789")
+
+        single = client.get(f"/download/{token}", headers={"Range": "bytes=2-5"})
+        assert single.status_code == 206
+        assert single.content == b"2345"
+        assert single.headers["content-range"] == "bytes 2-5/10"
+
+        suffix = client.get(f"/download/{token}", headers={"Range": "bytes=-3"})
+        assert suffix.status_code == 206
+        assert suffix.content == b"789"
+
+        multi = client.get(f"/download/{token}", headers={"Range": "bytes=0-1,8-9"})
+        assert multi.status_code == 206
+        assert multi.headers["content-type"].startswith("multipart/byteranges")
+        boundary = multi.headers["content-type"].split("boundary=", 1)[1]
+        assert int(multi.headers["content-length"]) == len(multi.content)
+        assert multi.content.count(f"--{boundary}\r\n".encode()) == 2
+        assert b"Content-Range: bytes 0-1/10\r\n\r\n01\r\n" in multi.content
+        assert multi.content.endswith(f"89\r\n--{boundary}--\r\n".encode())
+
+        unsatisfiable = client.get(f"/download/{token}", headers={"Range": "bytes=50-60"})
+        assert unsatisfiable.status_code == 416
+        assert unsatisfiable.headers["content-range"] == "bytes */10"
+
+
+def test_download_conditional_requests(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        token = upload_and_sign(client, "32", "cached.bin", b"cache-me")
+
+        first = client.get(f"/download/{token}")
+        assert first.status_code == 200
+        etag = first.headers["etag"]
+        last_modified = first.headers["last-modified"]
+
+        not_modified = client.get(f"/download/{token}", headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304
+        assert not_modified.content == b""
+
+        since = client.get(f"/download/{token}", headers={"If-Modified-Since": last_modified})
+        assert since.status_code == 304
+
+        changed = client.get(f"/download/{token}", headers={"If-None-Match": '"something-else"'})
+        assert changed.status_code == 200
+
+        resumed = client.get(f"/download/{token}", headers={"Range": "bytes=6-", "If-Range": etag})
+        assert resumed.status_code == 206
+        assert resumed.content == b"me"
+
+        stale = client.get(f"/download/{token}", headers={"Range": "bytes=6-", "If-Range": '"stale"'})
+        assert stale.status_code == 200
+        assert stale.content == b"cache-me"
+
+
+def test_identical_uploads_share_one_blob(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        first = client.post(
+            "/files/upload",
+            headers={"X-User-Id": "51"},
+            files={"file": ("installer.bin", b"same-bytes", "application/octet-stream")},
+        )
+        second = client.post(
+            "/files/upload",
+            headers={"X-User-Id": "52"},
+            files={"file": ("copy.bin", b"same-bytes", "application/octet-stream")},
+        )
+        assert first.status_code == 201 and second.status_code == 201
+
+        from app.database import SessionLocal
+        from app.models import Blob, StoredFile
+
+        with SessionLocal() as session:
+            rows = session.query(StoredFile).order_by(StoredFile.id).all()
+            assert rows[0].upload_path == rows[1].upload_path
+            blob = session.query(Blob).one()
+            assert blob.ref_count == 2
+            disk_path = Path(blob.storage_path)
+
+        assert client.delete(f"/files/{first.json()['file_id']}", headers={"X-User-Id": "51"}).status_code == 204
+        purge_deleted(client)
+        assert disk_path.exists()
+        with SessionLocal() as session:
+            assert session.query(Blob).one().ref_count == 1
+
+        assert client.delete(f"/files/{second.json()['file_id']}", headers={"X-User-Id": "52"}).status_code == 204
+        purge_deleted(client)
+        assert not disk_path.exists()
+        with SessionLocal() as session:
+            assert session.query(Blob).count() == 0
+
+
+def test_multipart_upload_session_out_of_order_parts(tmp_path: Path):
+    part_size = 64 * 1024
+    content = bytes(range(256)) * 600
+    parts = [content[offset : offset + part_size] for offset in range(0, len(content), part_size)]
+    assert len(parts) == 3
+
+    with build_client(tmp_path) as client:
+        headers = {"X-User-Id": "61"}
+        create_response = client.post(
+            "/files/uploads",
+            headers=headers,
+            json={"filename": "big.bin", "content_type": "application/octet-stream", "part_size": part_size},
+        )
+        assert create_response.status_code == 201
+        upload_id = create_response.json()["upload_id"]
+
+        for part_number in (3, 1):
+            part_response = client.put(
+                f"/files/uploads/{upload_id}/parts/{part_number}",
+                headers=headers,
+                content=parts[part_number - 1],
+            )
+            assert part_response.status_code == 200
+
+        incomplete = client.post(f"/files/uploads/{upload_id}/complete", headers=headers)
+        assert incomplete.status_code == 409
+
+        status_response = client.get(f"/files/uploads/{upload_id}", headers=headers)
+        received = {part["part_number"]: part["offset"] for part in status_response.json()["parts"]}
+        assert received == {1: 0, 3: 2 * part_size}
+
+        assert client.put(f"/files/uploads/{upload_id}/parts/2", headers=headers, content=parts[1]).status_code == 200
+        oversized = client.put(f"/files/uploads/{upload_id}/parts/2", headers=headers, content=b"x" * (part_size + 1))
+        assert oversized.status_code == 413
+
+        complete_response = client.post(f"/files/uploads/{upload_id}/complete", headers=headers)
+        assert complete_response.status_code == 201
+        assert complete_response.json()["size_bytes"] == len(content)
+        assert client.get(f"/files/uploads/{upload_id}", headers=headers).status_code == 404
+
+        sign_response = client.post(
+            f"/files/{complete_response.json()['file_id']}/signed-link",
+            headers=headers,
+            json={"ttl_seconds": 600},
+        )
+        token = sign_response.json()["download_url"].rsplit("/", 1)[1]
+        assert client.get(f"/download/{token}").content == content
+
+
+def test_expired_upload_sessions_are_removed(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        headers = {"X-User-Id": "62"}
+        upload_id = client.post("/files/uploads", headers=headers, json={"filename": "stale.bin"}).json()["upload_id"]
+        assert client.put(f"/files/uploads/{upload_id}/parts/1", headers=headers, content=b"partial").status_code == 200
+
+        from datetime import datetime, timedelta, timezone
+
+        from app import database
+        from app.routes.uploads import expire_upload_sessions, session_data_path
+
+        data_path = session_data_path(tmp_path / "uploads", upload_id)
+        assert data_path.exists()
+
+        async def expire() -> int:
+            async with database.AsyncSessionLocal() as session:
+                return await expire_upload_sessions(
+                    session, tmp_path / "uploads", now=datetime.now(timezone.utc) + timedelta(days=2)
+                )
+
+        removed = client.portal.call(expire)
+        assert removed == 1
+        assert not data_path.exists()
+        assert client.get(f"/files/uploads/{upload_id}", headers=headers).status_code == 404
+
+
+def test_expiry_leaves_sessions_that_are_completing(tmp_path: Path):
+    from datetime import datetime, timedelta, timezone
+
+    from sqlalchemy import update
+
+    from app import database
+    from app.models import UploadSession
+    from app.routes.uploads import expire_upload_sessions, session_data_path
+
+    with build_client(tmp_path) as client:
+        headers = {"X-User-Id": "63"}
+        upload_id = client.post("/files/uploads", headers=headers, json={"filename": "slow.bin"}).json()["upload_id"]
+        assert client.put(f"/files/uploads/{upload_id}/parts/1", headers=headers, content=b"partial").status_code == 200
+        with database.SessionLocal() as session:
+            session.execute(update(UploadSession).values(completing_at=datetime.now(timezone.utc)))
+            session.commit()
+
+        async def expire() -> int:
+            async with database.AsyncSessionLocal() as session:
+                return await expire_upload_sessions(
+                    session, tmp_path / "uploads", now=datetime.now(timezone.utc) + timedelta(days=2)
+                )
+
+        assert client.portal.call(expire) == 0
+        assert session_data_path(tmp_path / "uploads", upload_id).exists()
+
+
+def test_parts_are_refused_while_a_session_completes(tmp_path: Path, monkeypatch):
+    import fcntl
+
+    from app.routes import uploads
+
+    monkeypatch.setattr(uploads, "PART_WRITE_WAIT_SECONDS", 0.2)
+    with build_client(tmp_path) as client:
+        headers = {"X-User-Id": "63"}
+        upload_id = client.post("/files/uploads", headers=headers, json={"filename": "race.bin"}).json()["upload_id"]
+        assert client.put(f"/files/uploads/{upload_id}/parts/1", headers=headers, content=b"first").status_code == 200
+
+        # A part upload still writing holds the session file; completion gives up and can be retried.
+        with open(uploads.session_data_path(tmp_path / "uploads", upload_id), "rb") as writer:
+            fcntl.flock(writer, fcntl.LOCK_SH)
+            busy = client.post(f"/files/uploads/{upload_id}/complete", headers=headers)
+        assert busy.status_code == 409 and busy.json()["detail"] == "Parts are still being uploaded"
+
+        from app.database import SessionLocal
+        from app.models import UploadSession, utcnow
+
+        with SessionLocal() as session:
+            session.get(UploadSession, upload_id).completing_at = utcnow()
+            session.commit()
+        refused = client.put(f"/files/uploads/{upload_id}/parts/1", headers=headers, content=b"changed")
+        assert refused.status_code == 409
+        assert client.post(f"/files/uploads/{upload_id}/complete", headers=headers).status_code == 409
+
+        with SessionLocal() as session:
+            session.get(UploadSession, upload_id).completing_at = None
+            session.commit()
+        complete_response = client.post(f"/files/uploads/{upload_id}/complete", headers=headers)
+        assert complete_response.status_code == 201 and complete_response.json()["size_bytes"] == len(b"first")
+
+
+def test_failed_completion_leaves_no_compressed_spool(tmp_path: Path, monkeypatch):
+    content = b"".join(b"%d,row\n" % row for row in range(20000))
+    monkeypatch.setenv("STORAGE_COMPRESSION", "gzip")
+    monkeypatch.setenv("USER_QUOTA_BYTES", str(len(content) + 10))
+    with build_client(tmp_path) as client:
+        headers = {"X-User-Id": "64"}
+        upload_id = client.post(
+            "/files/uploads", headers=headers, json={"filename": "rows.csv", "content_type": "text/csv"}
+        ).json()["upload_id"]
+        assert client.put(f"/files/uploads/{upload_id}/parts/1", headers=headers, content=content).status_code == 200
+        upload_and_sign(client, "64", "other.txt", b"0123456789ab")
+
+        assert client.post(f"/files/uploads/{upload_id}/complete", headers=headers).status_code == 413
+        assert [path.name for path in (tmp_path / "uploads" / ".tmp").iterdir()] == [f"upload-{upload_id}"]
+        # Not left marked as completing: freeing space lets the same session finish.
+        file_id = client.get("/files", headers=headers).json()[0]["file_id"]
+        assert client.delete(f"/files/{file_id}", headers=headers).status_code == 204
+        assert client.post(f"/files/uploads/{upload_id}/complete", headers=headers).status_code == 201
+
+
+def test_upload_with_small_write_buffer_preserves_content(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("UPLOAD_CHUNK_SIZE_BYTES", "300")
+    monkeypatch.setenv("UPLOAD_WRITE_BUFFER_BYTES", "1000")
+    content = os.urandom(10_000)
+
+    with build_client(tmp_path) as client:
+        token = upload_and_sign(client, "71", "buffered.bin", content)
+        assert client.get(f"/download/{token}").content == content
+
+
+def test_bulk_signed_links_report_per_item_errors(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("MAX_TTL_SECONDS", "3600")
+
+    with build_client(tmp_path) as client:
+        owned_ids = []
+        for name in ("one.txt", "two.txt"):
+            response = client.post(
+                "/files/upload",
+                headers={"X-User-Id": "91"},
+                files={"file": (name, name.encode(), "text/plain")},
+            )
+            owned_ids.append(response.json()["file_id"])
+        foreign_id = client.post(
+            "/files/upload",
+            headers={"X-User-Id": "92"},
+            files={"file": ("other.txt", b"other", "text/plain")},
+        ).json()["file_id"]
+
+        bulk_response = client.post(
+            "/files/signed-links",
+            headers={"X-User-Id": "91"},
+            json={
+                "items": [
+                    {"file_id": owned_ids[0], "ttl_seconds": 600},
+                    {"file_id": foreign_id, "ttl_seconds": 600},
+                    {"file_id": owned_ids[1], "ttl_seconds": 7200},
+                    {"file_id": owned_ids[1], "ttl_seconds": 60},
+                ]
+            },
+        )
+        assert bulk_response.status_code == 200
+        results = bulk_response.json()["results"]
+        assert [result["error"] is None for result in results] == [True, False, False, True]
+        assert results[1]["error"] == "File not found"
+        assert "exceeds max allowed" in results[2]["error"]
+
+        token = results[3]["download_url"].rsplit("/", 1)[1]
+        assert client.get(f"/download/{token}").content == b"two.txt"
+
+        audits = client.get("/files/users/91/link-audits", headers={"X-User-Id": "91"}).json()
+        assert sorted(audit["ttl_seconds"] for audit in audits) == [60, 600]
+
+
+def test_bundle_link_streams_zip_of_owned_files(tmp_path: Path):
+    import io
+    import zipfile
+
+    with build_client(tmp_path) as client:
+        headers = {"X-User-Id": "95"}
+        file_ids = [
+            client.post("/files/upload", headers=headers, files={"file": (name, data, "text/plain")}).json()["file_id"]
+            for name, data in (("report.txt", b"first"), ("report.txt", b"second"))
+        ]
+        foreign_id = client.post(
+            "/files/upload", headers={"X-User-Id": "96"}, files={"file": ("x.txt", b"x", "text/plain")}
+        ).json()["file_id"]
+
+        forbidden = client.post(
+            "/files/bundle-link", headers=headers, json={"file_ids": [*file_ids, foreign_id], "ttl_seconds": 600}
+        )
+        assert forbidden.status_code == 404
+
+        bundle_response = client.post(
+            "/files/bundle-link", headers=headers, json={"file_ids": file_ids, "ttl_seconds": 600}
+        )
+        assert bundle_response.status_code == 200
+        token = bundle_response.json()["download_url"].rsplit("/", 1)[1]
+
+        download_response = client.get(f"/download/bundle/{token}")
+        assert download_response.status_code == 200
+        assert download_response.headers["content-type"] == "application/zip"
+        archive = zipfile.ZipFile(io.BytesIO(download_response.content))
+        assert archive.read("report.txt") == b"first"
+        assert archive.read("report (2).txt") == b"second"
+
+        single_token = upload_and_sign(client, "95", "single.txt", b"single")
+        assert client.get(f"/download/bundle/{single_token}").status_code == 403
+        assert client.get(f"/download/{token}").status_code == 403
+
+
+def test_bundle_links_are_short_and_signed_with_the_link_keys(tmp_path: Path, monkeypatch):
+    import io
+    import zipfile
+
+    monkeypatch.setenv("SIGNING_KEYS", "1:old-secret")
+    with build_client(tmp_path) as client:
+        headers = {"X-User-Id": "98"}
+        file_ids = [
+            client.post("/files/upload", headers=headers, files={"file": (f"{index}.txt", b"%d" % index, "text/plain")})
+            .json()["file_id"]
+            for index in range(40)
+        ]
+
+        def bundle(ids: list[int]) -> str:
+            response = client.post("/files/bundle-link", headers=headers, json={"file_ids": ids, "ttl_seconds": 600})
+            return response.json()["download_url"].rsplit("/", 1)[1]
+
+        small, large = bundle(file_ids[:1]), bundle(file_ids)
+        assert len(small) == len(large) < 60
+        assert len(zipfile.ZipFile(io.BytesIO(client.get(f"/download/bundle/{large}").content)).namelist()) == 40
+
+    monkeypatch.setenv("SIGNING_KEYS", "2:new-secret")
+    with build_client(tmp_path) as client:
+        assert client.get(f"/download/bundle/{large}").status_code == 403
+
+
+def test_list_files_keyset_pagination_and_filters(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        headers = {"X-User-Id": "97"}
+        for index in range(5):
+            content_type = "text/csv" if index % 2 else "text/plain"
+            response = client.post(
+                "/files/upload",
+                headers=headers,
+                files={"file": (f"f{index}.txt", b"x" * (index + 1), content_type)},
+            )
+            assert response.status_code == 201
+
+        seen = []
+        cursor = None
+        pages = 0
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            page = client.get("/files", headers=headers, params=params)
+            assert page.status_code == 200
+            seen.extend(item["filename"] for item in page.json())
+            pages += 1
+            cursor = page.headers.get("x-next-cursor")
+            if cursor is None:
+                break
+        assert pages == 3
+        assert seen == [f"f{index}.txt" for index in reversed(range(5))]
+
+        csv_only = client.get("/files", headers=headers, params={"content_type": "text/csv"}).json()
+        assert [item["filename"] for item in csv_only] == ["f3.txt", "f1.txt"]
+
+        sized = client.get("/files", headers=headers, params={"min_size": 2, "max_size": 4}).json()
+        assert sorted(item["size_bytes"] for item in sized) == [2, 3, 4]
+
+        assert client.get("/files", headers=headers, params={"cursor": "not-a-cursor"}).status_code == 400
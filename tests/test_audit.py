@@ -0,0 +1,78 @@
+import json
+from pathlib import Path
+
+from test_api import build_client, upload_and_sign
+
+
+def _audit_count() -> int:
+    from app.database import SessionLocal
+    from app.models import LinkAudit
+
+    with SessionLocal() as session:
+        return session.query(LinkAudit).count()
+
+
+def test_buffered_audits_flush_on_read_and_shutdown(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("AUDIT_BUFFER_ENABLED", "true")
+    monkeypatch.setenv("AUDIT_FLUSH_INTERVAL_MS", "60000")
+    monkeypatch.setenv("AUDIT_SPOOL_DIR", str(tmp_path / "spool"))
+
+    with build_client(tmp_path) as client:
+        upload_and_sign(client, "81", "a.txt", b"a")
+        assert _audit_count() == 0
+        assert len(list((tmp_path / "spool").glob("audit-*.jsonl"))) == 1
+
+        audits = client.get("/files/users/81/link-audits", headers={"X-User-Id": "81"}).json()
+        assert len(audits) == 1
+        assert list((tmp_path / "spool").glob("audit-*.jsonl")) == []
+
+        upload_and_sign(client, "81", "b.txt", b"b")
+
+    assert _audit_count() == 2
+    assert list((tmp_path / "spool").iterdir()) == []
+
+
+def _upload(tmp_path: Path, user_id: str) -> int:
+    with build_client(tmp_path) as client:
+        upload_and_sign(client, user_id, "a.txt", b"a")
+        return client.get("/files", headers={"X-User-Id": user_id}).json()[0]["file_id"]
+
+
+def test_spooled_audits_are_replayed_on_start(tmp_path: Path, monkeypatch):
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    monkeypatch.setenv("AUDIT_BUFFER_ENABLED", "true")
+    monkeypatch.setenv("AUDIT_SPOOL_DIR", str(spool_dir))
+    file_id = _upload(tmp_path, "82")
+
+    record = {"file_id": file_id, "requester_user_id": 82, "ttl_seconds": 60, "created_at": "2026-01-01T00:00:00+00:00"}
+    # pid 2**22 + 1 is above the default pid_max, so it can never be a live worker.
+    (spool_dir / f"audit-{2**22 + 1}-1.jsonl").write_text(json.dumps(record) + "\n" + '{"file_id": 1, "requ')
+
+    with build_client(tmp_path):
+        assert _audit_count() == 2
+
+    assert list(spool_dir.iterdir()) == []
+
+
+def test_a_rejected_spool_row_does_not_block_startup_or_its_batch(tmp_path: Path, monkeypatch):
+    from app import audit
+
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    monkeypatch.setenv("AUDIT_BUFFER_ENABLED", "true")
+    monkeypatch.setenv("AUDIT_SPOOL_DIR", str(spool_dir))
+    file_id = _upload(tmp_path, "83")
+
+    good = {"file_id": file_id, "requester_user_id": 83, "ttl_seconds": 60, "created_at": "2026-01-01T00:00:00+00:00"}
+    bad = {**good, "requester_user_id": None}
+    lines = [json.dumps(row) + "\n" for row in (good, bad, good)]
+    (spool_dir / f"audit-{2**22 + 1}-1.jsonl").write_text("".join(lines))
+    # A segment claimed by a replay that died is picked up again.
+    (spool_dir / f"audit-{2**22 + 1}-2.replay-{2**22 + 2}").write_text(lines[0])
+
+    with build_client(tmp_path):
+        assert _audit_count() == 4
+        assert audit.audit_buffer.records_dropped == 1
+
+    assert list(spool_dir.iterdir()) == []
@@ -0,0 +1,160 @@
+from datetime import datetime, timezone
+from pathlib import Path
+import time
+
+from sqlalchemy import event
+
+from app.cache import ByteCache, DownloadCache, FileMeta, TTLCache
+from test_api import build_client, upload_and_sign
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttl_cache_evicts_least_recently_used_and_expired():
+    clock = FakeClock()
+    cache = TTLCache(max_entries=2, ttl_seconds=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.evictions == 1
+
+    cache.set("short", 4, ttl_seconds=1)
+    clock.now = 2
+    assert cache.get("short") is None
+    assert cache.get("c") == 3
+    clock.now = 11
+    assert cache.get("c") is None
+    assert cache.stats()["hits"] == 2
+
+
+def test_download_cache_invalidate_file_drops_tokens():
+    cache = DownloadCache(max_tokens=10, max_files=10, ttl_seconds=60)
+    cache.put_token_payload("tok", {"file_id": 7, "owner_user_id": 1, "exp": time.time() + 30})
+    cache.put_token_payload("expired", {"file_id": 7, "owner_user_id": 1, "exp": time.time() - 1})
+    cache.put_file(FileMeta(7, 1, "a.txt", "text/plain", 1, "/tmp/a", datetime.now(timezone.utc)))
+    assert cache.get_token_payload("expired") is None
+
+    cache.invalidate_file(7)
+    assert cache.get_token_payload("tok") is None
+    assert cache.get_file(7) is None
+
+
+def test_hot_download_makes_no_db_queries(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        token = upload_and_sign(client, "101", "hot.txt", b"hot-content")
+        assert client.get(f"/download/{token}").status_code == 200
+
+        from app import database
+
+        statements = []
+
+        def listener(_conn, _cursor, statement, *_args):
+            statements.append(statement)
+
+        event.listen(database.async_engine.sync_engine, "before_cursor_execute", listener)
+        try:
+            assert client.get(f"/download/{token}").content == b"hot-content"
+        finally:
+            event.remove(database.async_engine.sync_engine, "before_cursor_execute", listener)
+        assert statements == []
+
+        stats = client.get("/cache/stats").json()["download"]
+        assert stats["tokens"]["hits"] >= 1 and stats["files"]["hits"] >= 1
+
+        file_id = client.get("/files", headers={"X-User-Id": "101"}).json()[0]["file_id"]
+        assert client.delete(f"/files/{file_id}", headers={"X-User-Id": "101"}).status_code == 204
+        assert client.get(f"/download/{token}").status_code == 404
+
+
+def test_byte_cache_respects_budget_admission_and_policy():
+    lru = ByteCache(max_bytes=10, max_file_bytes=6, policy="lru")
+    assert not lru.put(1, "v", b"x" * 7)
+    assert lru.put(1, "v", b"aaaa") and lru.put(2, "v", b"bbbb")
+    assert lru.get(1, "v") == b"aaaa"
+    lru.put(3, "v", b"cccc")
+    assert lru.get(2, "v") is None and lru.get(1, "v") == b"aaaa"
+    assert lru.size_bytes == 8 and lru.evictions == 1
+
+    lfu = ByteCache(max_bytes=10, max_file_bytes=6, policy="lfu")
+    lfu.put(1, "v", b"aaaa")
+    lfu.put(2, "v", b"bbbb")
+    lfu.get(1, "v")
+    lfu.get(1, "v")
+    lfu.get(2, "v")
+    lfu.put(3, "v", b"cccc")
+    assert lfu.get(1, "v") == b"aaaa" and lfu.get(2, "v") is None
+
+    stats = lfu.stats()
+    assert stats["hits"] == 4 and stats["misses"] == 1
+    assert stats["bytes_served"] == 16 and stats["hit_ratio"] == 0.8
+
+
+def test_byte_cache_lfu_breaks_ties_by_recency_and_survives_pops():
+    lfu = ByteCache(max_bytes=12, max_file_bytes=4, policy="lfu")
+    for file_id in (1, 2, 3):
+        lfu.put(file_id, "v", b"aaaa")
+    lfu.get(1, "v")
+    lfu.get(2, "v")
+    lfu.pop(3)
+    lfu.get(2, "v")
+    lfu.put(4, "v", b"dddd")
+    lfu.put(5, "v", b"eeee")
+    # 4 was served least; among the rest 1 was served less often than 2.
+    assert not lfu.contains(4, "v") and lfu.contains(1, "v") and lfu.contains(2, "v")
+    lfu.put(6, "v", b"ffff")
+    assert not lfu.contains(5, "v") and lfu.contains(2, "v")
+    assert lfu.size_bytes == 12 and len(lfu) == 3
+
+
+def test_byte_cache_entries_expire_and_belong_to_one_version():
+    now = [0.0]
+    cache = ByteCache(max_bytes=10, max_file_bytes=10, ttl_seconds=5, clock=lambda: now[0])
+    cache.put(1, "2024-01-01", b"old")
+    # A later row that reused the id (say, on a sibling worker after a purge) never sees these bytes.
+    assert cache.get(1, "2024-06-01") is None
+    assert len(cache) == 0 and cache.size_bytes == 0
+
+    cache.put(1, "2024-06-01", b"new")
+    now[0] = 4.9
+    assert cache.get(1, "2024-06-01") == b"new"
+    now[0] = 5.0
+    assert not cache.contains(1, "2024-06-01") and cache.size_bytes == 0
+
+
+def test_small_files_are_served_from_memory(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("DOWNLOAD_BYTE_CACHE_BYTES", str(1024 * 1024))
+    monkeypatch.setenv("DOWNLOAD_BYTE_CACHE_MAX_FILE_BYTES", "64")
+    with build_client(tmp_path) as client:
+        token = upload_and_sign(client, "102", "thumb.png", b"small-bytes")
+        big_token = upload_and_sign(client, "102", "big.bin", b"b" * 100)
+        first = client.get(f"/download/{token}")
+        assert first.content == b"small-bytes"
+        assert "thumb.png" in first.headers["content-disposition"]
+
+        from app import cache
+
+        hit = client.get(f"/download/{token}")
+        assert hit.content == b"small-bytes" and hit.headers["etag"] == first.headers["etag"]
+        assert client.get(f"/download/{token}", headers={"If-None-Match": hit.headers["etag"]}).status_code == 304
+        assert client.get(f"/download/{token}").content == b"small-bytes"
+        assert client.get(f"/download/{token}", headers={"Range": "bytes=0-4"}).content == b"small"
+        assert client.get(f"/download/{big_token}").content == b"b" * 100
+
+        stats = client.get("/cache/stats").json()["bytes"]
+        assert stats["entries"] == 1 and stats["size_bytes"] == len(b"small-bytes")
+        assert stats["hits"] == 2 and stats["misses"] == 1
+        assert stats["bytes_served"] == 2 * len(b"small-bytes")
+
+        files = client.get("/files", headers={"X-User-Id": "102"}).json()
+        file_id = next(item["file_id"] for item in files if item["filename"] == "thumb.png")
+        assert client.delete(f"/files/{file_id}", headers={"X-User-Id": "102"}).status_code == 204
+        assert cache.byte_cache.stats()["entries"] == 0
+        assert client.get(f"/download/{token}").status_code == 404
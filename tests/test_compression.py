@@ -0,0 +1,119 @@
+import gzip
+import io
+import os
+from pathlib import Path
+import zipfile
+
+from fastapi.testclient import TestClient
+
+from test_api import build_client, sign_file, token_of, upload_and_sign, upload_file
+
+
+CSV = b"".join(b"%d,widget-%d,ok,2024-01-01T00:00:00Z\n" % (row, row % 17) for row in range(20000))
+
+
+def compressing_client(tmp_path: Path, monkeypatch) -> TestClient:
+    monkeypatch.setenv("STORAGE_COMPRESSION", "gzip")
+    return build_client(tmp_path)
+
+
+def stored_row(file_id: int):
+    from app import database
+    from app.models import StoredFile
+
+    with database.SessionLocal() as db:
+        return db.get(StoredFile, file_id)
+
+
+def test_compressible_upload_is_stored_gzipped_and_negotiated(tmp_path: Path, monkeypatch):
+    with compressing_client(tmp_path, monkeypatch) as client:
+        file_id = upload_file(client, "111", "export.csv", CSV, "text/csv")
+        row = stored_row(file_id)
+        assert row.content_encoding == "gzip"
+        assert row.size_bytes == len(CSV)
+        assert row.stored_size_bytes == os.path.getsize(row.upload_path) < len(CSV) // 4
+        assert gzip.decompress(Path(row.upload_path).read_bytes()) == CSV
+        assert not list((tmp_path / "uploads" / ".tmp").iterdir())
+
+        token = token_of(sign_file(client, "111", file_id))
+        encoded = client.get(f"/download/{token}", headers={"Accept-Encoding": "gzip, deflate"})
+        assert encoded.status_code == 200
+        assert encoded.headers["content-encoding"] == "gzip"
+        assert encoded.headers["vary"] == "Accept-Encoding"
+        assert encoded.num_bytes_downloaded == row.stored_size_bytes
+        assert encoded.content == CSV
+
+        plain = client.get(f"/download/{token}", headers={"Accept-Encoding": "identity"})
+        assert plain.status_code == 200
+        assert "content-encoding" not in plain.headers
+        assert plain.headers["content-length"] == str(len(CSV))
+        assert plain.headers["accept-ranges"] == "none"
+        assert plain.content == CSV
+
+        # Each representation has its own validator.
+        assert encoded.headers["etag"] != plain.headers["etag"]
+        revalidated = client.get(
+            f"/download/{token}", headers={"Accept-Encoding": "gzip", "If-None-Match": encoded.headers["etag"]}
+        )
+        assert revalidated.status_code == 304
+        refused = client.get(f"/download/{token}", headers={"Accept-Encoding": "*, gzip;q=0"})
+        assert "content-encoding" not in refused.headers
+        assert refused.content == CSV
+
+
+def test_incompressible_or_binary_uploads_are_stored_as_is(tmp_path: Path, monkeypatch):
+    with compressing_client(tmp_path, monkeypatch) as client:
+        random_text = upload_file(client, "111", "noise.txt", os.urandom(64 * 1024), "text/plain")
+        binary = upload_file(client, "111", "export.bin", CSV, "application/octet-stream")
+
+        for file_id in (random_text, binary):
+            row = stored_row(file_id)
+            assert row.content_encoding is None
+            assert row.stored_size_bytes is None
+        assert not list((tmp_path / "uploads" / ".tmp").iterdir())
+
+
+def test_compressed_files_in_bundles_and_resumable_uploads(tmp_path: Path, monkeypatch):
+    headers = {"X-User-Id": "111"}
+    with compressing_client(tmp_path, monkeypatch) as client:
+        created = client.post(
+            "/files/uploads",
+            headers=headers,
+            json={"filename": "data.json", "content_type": "application/json", "part_size": len(CSV)},
+        )
+        upload_id = created.json()["upload_id"]
+        assert client.put(f"/files/uploads/{upload_id}/parts/1", headers=headers, content=CSV).status_code == 200
+        completed = client.post(f"/files/uploads/{upload_id}/complete", headers=headers)
+        assert completed.status_code == 201
+        resumable_id = completed.json()["file_id"]
+        assert stored_row(resumable_id).content_encoding == "gzip"
+
+        plain_id = upload_file(client, "111", "plain.bin", b"raw bytes", "application/octet-stream")
+        bundle = client.post(
+            "/files/bundle-link", headers=headers, json={"file_ids": [resumable_id, plain_id], "ttl_seconds": 600}
+        )
+        token = bundle.json()["download_url"].rsplit("/", 1)[1]
+        archive = zipfile.ZipFile(io.BytesIO(client.get(f"/download/bundle/{token}").content))
+        assert archive.read("data.json") == CSV
+        assert archive.read("plain.bin") == b"raw bytes"
+
+
+def test_compression_is_off_by_default(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        file_id = upload_file(client, "111", "export.csv", CSV, "text/csv")
+        assert stored_row(file_id).content_encoding is None
+
+
+def test_byte_cache_holds_compressed_bytes(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("DOWNLOAD_BYTE_CACHE_BYTES", str(1024 * 1024))
+    with compressing_client(tmp_path, monkeypatch) as client:
+        token = upload_and_sign(client, "111", "export.csv", CSV, content_type="text/csv")
+        for _ in range(2):
+            assert client.get(f"/download/{token}", headers={"Accept-Encoding": "gzip"}).content == CSV
+            assert client.get(f"/download/{token}", headers={"Accept-Encoding": "identity"}).content == CSV
+
+        from app import cache
+
+        stats = cache.byte_cache.stats()
+        assert stats["hits"] == 3
+        assert stats["size_bytes"] < len(CSV) // 4
@@ -28,3 +28,19 @@ def test_signing_secret_is_string(monkeypatch):
     settings = get_settings()
     assert isinstance(settings.signing_secret, str)
     assert settings.signing_secret == "my-secret-string"
+
+
+def test_db_pool_settings_parse(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "0")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "false")
+    settings = get_settings()
+    assert settings.db_pool_size == 20
+    assert settings.db_max_overflow == 0
+    assert settings.db_pool_pre_ping is False
+
+
+def test_invalid_bool_setting_raises(monkeypatch):
+    monkeypatch.setenv("DB_POOL_PRE_PING", "sometimes")
+    with pytest.raises(ValueError, match="DB_POOL_PRE_PING must be a boolean"):
+        get_settings()
@@ -0,0 +1,21 @@
+import pytest
+
+from app.database import to_async_url
+
+
+@pytest.mark.parametrize(
+    ("database_url", "expected"),
+    [
+        ("sqlite:///./data/app.db", "sqlite+aiosqlite:///./data/app.db"),
+        ("postgresql://user:pw@db:5432/files", "postgresql+asyncpg://user:pw@db:5432/files"),
+        ("postgresql+psycopg2://user:pw@db/files", "postgresql+asyncpg://user:pw@db/files"),
+        ("postgres://user:pw@db/files", "postgresql+asyncpg://user:pw@db/files"),
+    ],
+)
+def test_to_async_url(database_url: str, expected: str):
+    assert to_async_url(database_url) == expected
+
+
+def test_to_async_url_rejects_unknown_backend():
+    with pytest.raises(ValueError, match="No async driver"):
+        to_async_url("mysql://user:pw@db/files")
@@ -0,0 +1,106 @@
+import json
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+
+from test_api import build_client
+
+
+HEADERS = {"X-User-Id": "111"}
+NAMES = ["plain.txt", 'quote"and\\slash.txt', "tab\tnewline\n.txt", "naïve – résumé ✓.txt", "emoji-📦.bin"]
+
+
+def expected_files(file_ids: list[int]) -> bytes:
+    """What FastAPI's response_model rendering produced for the same rows."""
+    from app import database
+    from app.models import StoredFile
+    from app.schemas import FileMetadataResponse
+
+    with database.SessionLocal() as db:
+        rows = [db.get(StoredFile, file_id) for file_id in file_ids]
+        models = [
+            FileMetadataResponse(
+                file_id=row.id,
+                filename=row.original_filename,
+                content_type=row.content_type,
+                size_bytes=row.size_bytes,
+                uploaded_at=row.created_at,
+            )
+            for row in rows
+        ]
+    return TypeAdapter(list[FileMetadataResponse]).dump_json(models)
+
+
+def seed(client: TestClient) -> list[int]:
+    file_ids = []
+    for name in NAMES:
+        response = client.post("/files/upload", headers=HEADERS, files={"file": (name, b"x", "text/plain")})
+        assert response.status_code == 201
+        file_ids.append(response.json()["file_id"])
+    return file_ids[::-1]
+
+
+def test_file_listing_bytes_match_the_response_model(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        newest_first = seed(client)
+
+        response = client.get("/files", headers=HEADERS)
+        assert response.headers["content-type"] == "application/json"
+        assert response.content == expected_files(newest_first)
+        assert "x-next-cursor" not in response.headers
+
+        first = client.get("/files", headers=HEADERS, params={"limit": 2})
+        assert first.content == expected_files(newest_first[:2])
+        rest = client.get("/files", headers=HEADERS, params={"limit": 10, "cursor": first.headers["x-next-cursor"]})
+        assert rest.content == expected_files(newest_first[2:])
+
+        # A page that ends exactly at the last row has no next page.
+        assert "x-next-cursor" not in client.get("/files", headers=HEADERS, params={"limit": 5}).headers
+        assert client.get("/files", headers={"X-User-Id": "222"}).content == b"[]"
+
+
+def test_ndjson_listing(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        newest_first = seed(client)
+        accept = {**HEADERS, "Accept": "application/x-ndjson"}
+
+        response = client.get("/files", headers=accept, params={"limit": 3})
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = response.content.split(b"\n")
+        assert lines[-1] == b""
+        assert [json.loads(line) for line in lines[:-1]] == json.loads(expected_files(newest_first[:3]))
+        assert "x-next-cursor" in response.headers
+
+        found = client.get("/files/search", headers=accept, params={"q": "résumé"})
+        assert [json.loads(line)["filename"] for line in found.content.splitlines()] == [NAMES[3]]
+
+
+def test_link_audit_listing_bytes_match_the_response_model(tmp_path: Path):
+    from app.schemas import LinkAuditResponse
+
+    with build_client(tmp_path) as client:
+        file_id = seed(client)[-1]
+        for _ in range(3):
+            client.post(f"/files/{file_id}/signed-link", headers=HEADERS, json={"ttl_seconds": 60})
+
+        response = client.get("/files/users/111/link-audits", headers=HEADERS, params={"limit": 2})
+        audits = TypeAdapter(list[LinkAuditResponse]).validate_json(response.content)
+        assert [audit.file_id for audit in audits] == [file_id, file_id]
+        assert response.content == TypeAdapter(list[LinkAuditResponse]).dump_json(audits)
+        rest = client.get(
+            "/files/users/111/link-audits", headers=HEADERS, params={"cursor": response.headers["x-next-cursor"]}
+        )
+        assert len(rest.json()) == 1
+        assert rest.json()[0]["audit_id"] < audits[-1].audit_id
+
+
+def test_a_streamed_page_holds_one_pool_connection(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "1")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "0")
+    monkeypatch.setenv("DB_POOL_TIMEOUT_SECONDS", "1")
+    with build_client(tmp_path) as client:
+        seed(client)
+        assert client.get("/files", headers=HEADERS, params={"limit": 2}).status_code == 200
+        assert client.get("/files/search", headers=HEADERS, params={"q": "txt"}).status_code == 200
+        assert client.get("/files/users/111/link-audits", headers=HEADERS).status_code == 200
@@ -0,0 +1,77 @@
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from app.layout import migrate_layout
+from app.storage import LocalBackend, StorageBackend, fanout_path, locate_file
+from test_api import build_client, upload_and_sign
+
+
+def test_fanout_path_uses_digest_prefixes():
+    digest = hashlib.sha256(b"x").hexdigest()
+    assert fanout_path(Path("u"), digest, 0) == Path("u") / digest
+    assert fanout_path(Path("u"), digest, 2) == Path("u") / digest[:2] / digest[2:4] / digest
+
+    blob = f"{digest}-{'0' * 32}"
+    assert fanout_path(Path("u"), blob, 2) == Path("u") / digest[:2] / digest[2:4] / blob
+
+    legacy = fanout_path(Path("u"), "abc_notes.txt", 1)
+    assert legacy.name == "abc_notes.txt" and len(legacy.parent.name) == 2
+
+
+def test_locate_file_falls_back_to_other_layouts(tmp_path: Path):
+    digest = hashlib.sha256(b"moved").hexdigest()
+    moved = fanout_path(tmp_path, digest, 2)
+    moved.parent.mkdir(parents=True)
+    moved.write_bytes(b"moved")
+
+    path, stat_result = locate_file(tmp_path, tmp_path / digest)
+    assert path == moved and stat_result.st_size == 5
+
+
+def test_new_uploads_use_fanout_layout(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        upload_and_sign(client, "120", "a.txt", b"fan-out")
+    digest = hashlib.sha256(b"fan-out").hexdigest()
+    [path] = (tmp_path / "uploads").rglob(f"{digest}-*")
+    assert path.read_bytes() == b"fan-out"
+    assert path == fanout_path(tmp_path / "uploads", path.name, 2)
+
+
+def test_migrate_layout_moves_files_while_downloads_keep_working(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("UPLOAD_FANOUT_DEPTH", "0")
+    upload_dir = tmp_path / "uploads"
+    with build_client(tmp_path) as client:
+        first = upload_and_sign(client, "121", "a.txt", b"first")
+        second = upload_and_sign(client, "121", "b.txt", b"second")
+        duplicate = upload_and_sign(client, "121", "c.txt", b"first")
+        assert client.get(f"/download/{first}").content == b"first"
+        [flat] = upload_dir.glob(hashlib.sha256(b"first").hexdigest() + "-*")
+
+        from app import database
+
+        sleeps = []
+        with database.SessionLocal() as db:
+            report = migrate_layout(db, upload_dir, 2, batch_size=1, pause_seconds=0.01, grace_seconds=0, sleep=sleeps.append)
+        assert report.moved == 2 and report.batches == 2 and report.missing == 0
+        assert sleeps[0] == 0.01
+        assert not flat.exists()
+        assert fanout_path(upload_dir, flat.name, 2).read_bytes() == b"first"
+
+        # The first link's metadata is still cached with the old path.
+        assert client.get(f"/download/{first}").content == b"first"
+        assert client.get(f"/download/{second}").content == b"second"
+        assert client.get(f"/download/{duplicate}").content == b"first"
+
+        with database.SessionLocal() as db:
+            rerun = migrate_layout(db, upload_dir, 2, pause_seconds=0, grace_seconds=0)
+        assert rerun.moved == 0 and rerun.already_in_place == 2
+
+
+def test_storage_backends_implement_every_operation(tmp_path: Path):
+    with pytest.raises(TypeError):
+        StorageBackend()
+    backend = LocalBackend(tmp_path)
+    with pytest.raises(RuntimeError):
+        backend.presigned_url(str(tmp_path / "blob"), "a.txt", "text/plain")
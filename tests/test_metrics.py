@@ -0,0 +1,78 @@
+from pathlib import Path
+
+import pytest
+
+from test_api import build_client, upload_and_sign
+
+
+def sample(exposition: str, line_prefix: str) -> float:
+    for line in exposition.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_metrics_exposition_labels_routes_by_template(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        before = client.get("/metrics").text
+        token = upload_and_sign(client, "111", "report.txt", b"0123456789")
+        assert client.get(f"/download/{token}").status_code == 200
+        assert client.get("/download/not-a-token").status_code == 403
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        body = response.text
+
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert token not in body
+    ok = 'http_requests_total{method="GET",route="/download/{token}",status="200"}'
+    denied = 'http_requests_total{method="GET",route="/download/{token}",status="403"}'
+    assert sample(body, ok) - sample(before, ok) == 1
+    assert sample(body, denied) - sample(before, denied) == 1
+
+    downloaded = 'http_response_body_bytes_total{route="/download/{token}"}'
+    assert sample(body, downloaded) - sample(before, downloaded) >= 10
+    uploaded = 'http_request_body_bytes_total{route="/files/upload"}'
+    assert sample(body, uploaded) - sample(before, uploaded) > 10
+    # The scrape that produced ``body`` is still being served.
+    assert sample(body, "http_requests_in_flight") == 1
+
+
+def test_metrics_cover_database_tokens_and_pool(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        before = client.get("/metrics").text
+        token = upload_and_sign(client, "111", "report.txt", b"payload")
+        assert client.get(f"/download/{token}").status_code == 200
+        body = client.get("/metrics").text
+
+    queries = 'db_queries_total{engine="async"}'
+    assert sample(body, queries) > sample(before, queries)
+    assert sample(body, 'db_query_duration_seconds_count{engine="async"}') == sample(body, queries)
+
+    encode = 'download_token_duration_seconds_count{operation="encode",format="compact"}'
+    decode = 'download_token_duration_seconds_count{operation="decode",format="compact"}'
+    assert sample(body, encode) - sample(before, encode) == 1
+    assert sample(body, decode) - sample(before, decode) == 1
+
+    assert 'db_pool_checked_out{engine="sync"}' in body
+    assert sample(body, 'db_pool_capacity{engine="sync"}') == 15
+
+
+def test_metrics_can_be_disabled(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("METRICS_ENABLED", "false")
+    with build_client(tmp_path) as client:
+        assert client.get("/metrics").status_code == 404
+        assert client.get("/health").status_code == 200
+
+
+def test_metric_kinds_implement_children_and_samples():
+    from app import metrics
+
+    class Incomplete(metrics._Metric):
+        def _new_child(self):
+            return metrics._Value()
+
+    with pytest.raises(TypeError):
+        Incomplete("incomplete_total", "Never registered.")
+    assert all(metric.name != "incomplete_total" for metric in metrics.REGISTRY)
@@ -0,0 +1,85 @@
+import os
+from pathlib import Path
+from urllib.parse import unquote
+
+from fastapi.testclient import TestClient
+from starlette.responses import FileResponse
+
+from test_api import upload_and_sign
+
+
+class AccelRedirectProxy:
+    """Minimal stand-in for nginx: follows X-Accel-Redirect into a local directory."""
+
+    def __init__(self, app, prefix: str, root: Path):
+        self.app = app
+        self.prefix = prefix
+        self.root = root
+        self.offloaded = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        redirect = {}
+
+        async def intercept(message):
+            if message["type"] == "http.response.start":
+                headers = {name.decode().lower(): value.decode() for name, value in message["headers"]}
+                if "x-accel-redirect" in headers:
+                    redirect.update(headers)
+                    return
+            if redirect:
+                return
+            await send(message)
+
+        await self.app(scope, receive, intercept)
+        if redirect:
+            self.offloaded += 1
+            location = unquote(redirect.pop("x-accel-redirect"))
+            assert location.startswith(self.prefix)
+            passed = {name: redirect[name] for name in ("content-type", "content-disposition") if name in redirect}
+            response = FileResponse(self.root / location[len(self.prefix) :], headers=passed)
+            await response(scope, receive, send)
+
+
+def test_x_accel_redirect_offload_through_proxy_stand_in(tmp_path: Path, monkeypatch):
+    upload_dir = tmp_path / "uploads"
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp_path / 'test.db'}"
+    os.environ["UPLOAD_DIR"] = str(upload_dir)
+    os.environ["SIGNING_SECRET"] = "test-secret"
+    monkeypatch.setenv("DOWNLOAD_OFFLOAD", "x-accel-redirect")
+
+    from app.main import create_app
+
+    app = create_app()
+    proxy = AccelRedirectProxy(app, "/_protected/", upload_dir)
+    with TestClient(proxy) as client:
+        token = upload_and_sign(client, "111", "offloaded report.pdf", b"0123456789")
+
+        full = client.get(f"/download/{token}")
+        assert full.status_code == 200
+        assert full.content == b"0123456789"
+        assert full.headers["content-type"] == "application/octet-stream"
+        assert "offloaded%20report.pdf" in full.headers["content-disposition"]
+
+        ranged = client.get(f"/download/{token}", headers={"Range": "bytes=2-4"})
+        assert ranged.status_code == 206
+        assert ranged.content == b"234"
+        assert proxy.offloaded == 2
+
+        direct = TestClient(app).get(f"/download/{token}")
+        assert direct.content == b""
+        assert direct.headers["x-accel-redirect"].startswith("/_protected/")
+
+
+def test_x_sendfile_offload_header(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("DOWNLOAD_OFFLOAD", "x-sendfile")
+    from test_api import build_client
+
+    with build_client(tmp_path) as client:
+        token = upload_and_sign(client, "112", "a.txt", b"sendfile")
+        response = client.get(f"/download/{token}")
+        assert response.content == b""
+        assert Path(response.headers["x-sendfile"]).read_bytes() == b"sendfile"
@@ -0,0 +1,132 @@
+import hashlib
+import os
+from pathlib import Path
+import time
+
+from app.reconcile import reconcile_storage
+from test_api import build_client, purge_deleted, upload_and_sign
+
+
+def blob_file(upload_dir: Path, content: bytes) -> Path:
+    [path] = upload_dir.rglob(hashlib.sha256(content).hexdigest() + "-*")
+    return path
+
+
+def test_delete_is_a_tombstone_until_purged(tmp_path: Path, monkeypatch):
+    from app import purge
+
+    monkeypatch.setattr(purge, "AUDIT_DELETE_CHUNK_SIZE", 2)
+    headers = {"X-User-Id": "140"}
+    with build_client(tmp_path) as client:
+        token = upload_and_sign(client, "140", "gone.txt", b"gone")
+        kept = upload_and_sign(client, "140", "kept.txt", b"kept")
+        files = {item["filename"]: item["file_id"] for item in client.get("/files", headers=headers).json()}
+        for _ in range(4):
+            client.post(f"/files/{files['gone.txt']}/signed-link", headers=headers, json={"ttl_seconds": 60})
+
+        assert client.delete(f"/files/{files['gone.txt']}", headers=headers).status_code == 204
+        assert client.get(f"/download/{token}").status_code == 404
+        signed = client.post(f"/files/{files['gone.txt']}/signed-link", headers=headers, json={"ttl_seconds": 60})
+        assert signed.status_code == 404
+        audits = client.get("/files/users/140/link-audits", headers=headers).json()
+        assert {audit["filename"] for audit in audits} == {"kept.txt"}
+
+        assert purge_deleted(client) == 1
+        assert purge_deleted(client) == 0
+        stats = purge.purge_worker.stats()
+        assert stats["files_purged"] == 1 and stats["audits_purged"] == 5 and stats["blobs_deleted"] == 1
+        assert not list((tmp_path / "uploads").rglob(hashlib.sha256(b"gone").hexdigest() + "*"))
+        assert client.get(f"/download/{kept}").content == b"kept"
+
+
+def test_purge_never_deletes_bytes_of_a_concurrent_reupload(tmp_path: Path, monkeypatch):
+    from app.storage import LocalBackend
+
+    headers = {"X-User-Id": "142"}
+    with build_client(tmp_path) as client:
+        upload_and_sign(client, "142", "first.txt", b"same bytes")
+        file_id = client.get("/files", headers=headers).json()[0]["file_id"]
+        assert client.delete(f"/files/{file_id}", headers=headers).status_code == 204
+
+        reuploaded = []
+        delete = LocalBackend.delete
+
+        def reupload_then_delete(self, locator: str) -> None:
+            # The blob row is gone but its bytes are not yet: the same content arrives again.
+            reuploaded.append(upload_and_sign(client, "142", "second.txt", b"same bytes"))
+            delete(self, locator)
+
+        monkeypatch.setattr(LocalBackend, "delete", reupload_then_delete)
+        assert purge_deleted(client) == 1
+        assert client.get(f"/download/{reuploaded[0]}").content == b"same bytes"
+
+
+def test_reconcile_removes_orphans_and_repairs_rows(tmp_path: Path):
+    upload_dir = tmp_path / "uploads"
+    headers = {"X-User-Id": "141"}
+    with build_client(tmp_path) as client:
+        moved = upload_and_sign(client, "141", "moved.txt", b"moved")
+        lost = upload_and_sign(client, "141", "lost.txt", b"lost")
+
+        old = time.time() - 7200
+        orphan = upload_dir / "ab" / "cd" / ("ab" + "c" * 62)
+        orphan.parent.mkdir(parents=True, exist_ok=True)
+        orphan.write_bytes(b"orphan")
+        os.utime(orphan, (old, old))
+        fresh = upload_dir / "fresh-upload"
+        fresh.write_bytes(b"in flight")
+        stale_tmp = upload_dir / ".tmp" / "crashed"
+        stale_tmp.write_bytes(b"partial")
+        os.utime(stale_tmp, (old, old))
+
+        moved_path = blob_file(upload_dir, b"moved")
+        moved_path.rename(upload_dir / moved_path.name)
+        blob_file(upload_dir, b"lost").unlink()
+
+        from app import database
+
+        with database.SessionLocal() as db:
+            dry = reconcile_storage(db, upload_dir, tmp_grace_seconds=3600, dry_run=True, fix_missing=True)
+        assert dry.orphan_files == 1 and orphan.exists() and dry.rows_missing == 1 and dry.files_tombstoned == 0
+
+        sleeps = []
+        with database.SessionLocal() as db:
+            report = reconcile_storage(
+                db, upload_dir, tmp_grace_seconds=3600, batch_size=1, max_files_per_second=1, fix_missing=True,
+                sleep=sleeps.append,
+            )
+        assert report.orphan_files == 1 and report.orphan_bytes == len(b"orphan") and not orphan.exists()
+        assert fresh.exists()
+        assert report.stale_tmp_files == 1 and not stale_tmp.exists()
+        assert report.rows_relocated == 1 and report.rows_missing == 1 and report.files_tombstoned == 1
+        assert sleeps
+
+        # Drop the cached metadata so the download reads the repaired row.
+        from app import cache
+
+        cache.download_cache.files.clear()
+        assert client.get(f"/download/{moved}").content == b"moved"
+        assert client.get(f"/download/{lost}").status_code == 404
+        assert [item["filename"] for item in client.get("/files", headers=headers).json()] == ["moved.txt"]
+
+
+def test_audits_buffered_for_a_purged_file_are_dropped(tmp_path: Path, monkeypatch):
+    from app import audit, database
+    from app.models import LinkAudit
+
+    monkeypatch.setenv("AUDIT_BUFFER_ENABLED", "true")
+    monkeypatch.setenv("AUDIT_FLUSH_INTERVAL_MS", "60000")
+    monkeypatch.setenv("AUDIT_SPOOL_DIR", str(tmp_path / "spool"))
+    headers = {"X-User-Id": "143"}
+    with build_client(tmp_path) as client:
+        upload_and_sign(client, "143", "gone.txt", b"gone")
+        file_id = client.get("/files", headers=headers).json()[0]["file_id"]
+        assert client.delete(f"/files/{file_id}", headers=headers).status_code == 204
+        # As if the audit sat in a sibling worker's buffer while this one purged.
+        assert purge_deleted(client) == 1
+
+        client.portal.call(audit.flush_link_audits)
+        assert audit.audit_buffer.records_dropped == 1
+
+    with database.SessionLocal() as session:
+        assert session.query(LinkAudit).count() == 0
@@ -0,0 +1,135 @@
+import base64
+from datetime import datetime, timedelta, timezone
+import hashlib
+import hmac
+from pathlib import Path
+import time
+
+from test_api import build_client, sign_file, token_of, upload_file
+
+
+HEADERS = {"X-User-Id": "111"}
+
+
+def test_revoking_one_link_leaves_other_links_working(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        file_id = upload_file(client, "111", "a.txt", b"a.txt", "text/plain")
+        revoked = sign_file(client, "111", file_id)
+        revoked_id, revoked_token = revoked["link_id"], token_of(revoked)
+        assert len(revoked_id) == 20
+        kept_token = token_of(sign_file(client, "111", file_id))
+        # Warm the token cache so the check cannot rely on a fresh decode.
+        assert client.get(f"/download/{revoked_token}").status_code == 200
+
+        assert client.delete(f"/files/links/{revoked_id}", headers={"X-User-Id": "222"}).status_code == 404
+        assert client.delete("/files/links/not-a-link-id", headers=HEADERS).status_code == 404
+        assert client.delete(f"/files/links/{revoked_id}", headers=HEADERS).status_code == 204
+
+        response = client.get(f"/download/{revoked_token}")
+        assert response.status_code == 403
+        assert response.json()["detail"] == "Download link has been revoked"
+        assert client.get(f"/download/{kept_token}").status_code == 200
+
+        audits = client.get("/files/users/111/link-audits", headers=HEADERS).json()
+        assert revoked_id in {audit["link_id"] for audit in audits}
+
+
+def test_file_and_user_watermarks_only_cover_earlier_links(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        first = upload_file(client, "111", "a.txt", b"a.txt", "text/plain")
+        second = upload_file(client, "111", "b.txt", b"b.txt", "text/plain")
+        first_token = token_of(sign_file(client, "111", first))
+        second_token = token_of(sign_file(client, "111", second))
+        time.sleep(0.002)
+
+        assert client.post(f"/files/{first}/links/revoke", headers={"X-User-Id": "222"}).status_code == 404
+        revoked = client.post(f"/files/{first}/links/revoke", headers=HEADERS)
+        assert revoked.status_code == 200
+        assert revoked.json()["file_id"] == first
+        assert client.get(f"/download/{first_token}").status_code == 403
+        assert client.get(f"/download/{second_token}").status_code == 200
+
+        time.sleep(0.002)
+        reissued = token_of(sign_file(client, "111", first))
+        assert client.get(f"/download/{reissued}").status_code == 200
+
+        time.sleep(0.002)
+        assert client.post("/files/links/revoke", headers=HEADERS).status_code == 200
+        assert client.get(f"/download/{second_token}").status_code == 403
+        assert client.get(f"/download/{reissued}").status_code == 403
+
+        time.sleep(0.002)
+        fresh = token_of(sign_file(client, "111", second))
+        assert client.get(f"/download/{fresh}").status_code == 200
+
+
+def test_revoked_bundles_and_bundle_members(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        first = upload_file(client, "111", "a.txt", b"a.txt", "text/plain")
+        second = upload_file(client, "111", "b.txt", b"b.txt", "text/plain")
+
+        def bundle() -> tuple[str, str]:
+            response = client.post(
+                "/files/bundle-link", headers=HEADERS, json={"file_ids": [first, second], "ttl_seconds": 600}
+            )
+            body = response.json()
+            return body["link_id"], body["download_url"].rsplit("/", 1)[1]
+
+        link_id, token = bundle()
+        _, other = bundle()
+        time.sleep(0.002)
+        assert client.post(f"/files/{first}/links/revoke", headers=HEADERS).status_code == 200
+        response = client.get(f"/download/bundle/{other}")
+        assert response.status_code == 200
+        assert "b.txt" in response.content.decode("latin-1")
+        assert "a.txt" not in response.content.decode("latin-1")
+
+        assert client.delete(f"/files/links/{link_id}", headers=HEADERS).status_code == 204
+        assert client.get(f"/download/bundle/{token}").status_code == 403
+
+
+def test_tokens_without_link_ids_fall_under_watermarks(tmp_path: Path):
+    from app.config import get_settings
+    from app.utils import COMPACT_TOKEN_LAYOUT_V1, COMPACT_TOKEN_MAC_BYTES
+
+    with build_client(tmp_path) as client:
+        file_id = upload_file(client, "111", "a.txt", b"a.txt", "text/plain")
+        settings = get_settings()
+        key_id = settings.signing_key_id
+        body = COMPACT_TOKEN_LAYOUT_V1.pack(1, key_id, file_id, 111, int(time.time()) + 600)
+        mac = hmac.new(settings.signing_keys[key_id].encode(), body, hashlib.sha256).digest()
+        legacy = base64.urlsafe_b64encode(body + mac[:COMPACT_TOKEN_MAC_BYTES]).rstrip(b"=").decode()
+
+        assert client.get(f"/download/{legacy}").status_code == 200
+        earlier = datetime.now(timezone.utc) - timedelta(days=1)
+        response = client.post(
+            f"/files/{file_id}/links/revoke", headers=HEADERS, json={"issued_before": earlier.isoformat()}
+        )
+        assert response.status_code == 200
+        assert client.get(f"/download/{legacy}").status_code == 403
+
+
+def test_index_forgets_revocations_once_covered_tokens_expire():
+    from app.models import LinkRevocation
+    from app.revocation import RevocationIndex
+    from app.utils import new_link_id
+
+    now = [time.time()]
+    index = RevocationIndex(refresh_seconds=5, clock=lambda: now[0])
+    link_id = new_link_id()
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=60)
+    index.apply(LinkRevocation(owner_user_id=1, link_id=link_id, expires_at=expires_at))
+    index.apply(
+        LinkRevocation(owner_user_id=1, file_id=7, issued_before=datetime.now(timezone.utc), expires_at=expires_at)
+    )
+
+    assert index.is_revoked(8, 1, link_id)
+    assert index.is_revoked(7, 1, None)
+    assert not index.is_revoked(8, 1, None)
+    time.sleep(0.002)
+    assert not index.is_revoked(7, 1, new_link_id())
+
+    now[0] += 61
+    index.prune()
+    assert index.stats()["links"] == index.stats()["files"] == 0
+    assert not index.is_revoked(8, 1, link_id)
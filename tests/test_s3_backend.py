@@ -0,0 +1,78 @@
+import io
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+import zipfile
+
+import pytest
+
+from test_api import build_client, purge_deleted, upload_and_sign
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+BUCKET = "private-files"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("STORAGE_BACKEND", "s3")
+    monkeypatch.setenv("S3_BUCKET", BUCKET)
+    monkeypatch.setenv("S3_REGION", "us-east-1")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def _keys(s3) -> list[str]:
+    return [item["Key"] for item in s3.list_objects_v2(Bucket=BUCKET).get("Contents", [])]
+
+
+def test_download_redirects_to_presigned_object_url(tmp_path: Path, s3):
+    with build_client(tmp_path) as client:
+        token = upload_and_sign(client, "130", "report final.pdf", b"pdf-bytes")
+        duplicate = upload_and_sign(client, "130", "copy.pdf", b"pdf-bytes")
+        [key] = _keys(s3)
+        assert key.startswith("blobs/") and s3.get_object(Bucket=BUCKET, Key=key)["Body"].read() == b"pdf-bytes"
+        assert list((tmp_path / "uploads" / ".tmp").iterdir()) == []
+
+        response = client.get(f"/download/{token}", follow_redirects=False)
+        assert response.status_code == 307
+        assert response.headers["cache-control"] == "no-store"
+        location = urlparse(response.headers["location"])
+        query = parse_qs(location.query)
+        assert location.path.endswith(key)
+        assert query["response-content-disposition"] == ["attachment; filename*=utf-8''report%20final.pdf"]
+        assert "X-Amz-Signature" in query
+
+        etag = client.get(f"/download/{duplicate}", follow_redirects=False).headers["etag"]
+        assert client.get(f"/download/{duplicate}", headers={"If-None-Match": etag}).status_code == 304
+
+        files = client.get("/files", headers={"X-User-Id": "130"}).json()
+        for item in files:
+            assert client.delete(f"/files/{item['file_id']}", headers={"X-User-Id": "130"}).status_code == 204
+        purge_deleted(client)
+        assert _keys(s3) == []
+
+
+def test_bundle_streams_from_object_storage(tmp_path: Path, s3):
+    with build_client(tmp_path) as client:
+        upload_and_sign(client, "131", "a.txt", b"alpha")
+        upload_and_sign(client, "131", "b.txt", b"bravo")
+        file_ids = [item["file_id"] for item in client.get("/files", headers={"X-User-Id": "131"}).json()]
+        link = client.post(
+            "/files/bundle-link", headers={"X-User-Id": "131"}, json={"file_ids": file_ids, "ttl_seconds": 60}
+        ).json()["download_url"]
+        archive = zipfile.ZipFile(io.BytesIO(client.get(link).content))
+        assert {name: archive.read(name) for name in archive.namelist()} == {"a.txt": b"alpha", "b.txt": b"bravo"}
+
+
+def test_large_uploads_use_multipart_transfer(tmp_path: Path, s3, monkeypatch):
+    monkeypatch.setenv("S3_MULTIPART_CHUNK_BYTES", str(5 * 1024 * 1024))
+    with build_client(tmp_path) as client:
+        upload_and_sign(client, "132", "big.bin", b"x" * (6 * 1024 * 1024))
+        [key] = _keys(s3)
+        # Multipart objects get an ETag of the form "<md5 of part md5s>-<part count>".
+        assert s3.head_object(Bucket=BUCKET, Key=key)["ETag"].strip('"').endswith("-2")
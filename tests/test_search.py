@@ -0,0 +1,109 @@
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from test_api import build_client, purge_deleted, upload_file
+
+
+HEADERS = {"X-User-Id": "111"}
+
+
+def search(client: TestClient, **params) -> list[str]:
+    response = client.get("/files/search", headers=HEADERS, params=params)
+    assert response.status_code == 200
+    return [item["filename"] for item in response.json()]
+
+
+def fts_rowids() -> list[int]:
+    from app import database
+
+    with database.engine.connect() as connection:
+        return list(connection.scalars(text("SELECT rowid FROM stored_files_fts ORDER BY rowid")))
+
+
+def test_substring_and_prefix_search(tmp_path: Path):
+    from app import search as search_module
+
+    with build_client(tmp_path) as client:
+        assert search_module.search_backend == "fts5"
+        upload_file(client, "111", "Quarterly-Report-2024.pdf", b"Quarterly-Report-2024.pdf", "application/pdf")
+        upload_file(client, "111", "report_draft.docx", b"report_draft.docx")
+        upload_file(client, "111", "holiday.jpg", b"holiday.jpg", "image/jpeg")
+        upload_file(client, "111", "100%_done.txt", b"100%_done.txt")
+        upload_file(client, "222", "someone-elses-report.pdf", b"someone-elses-report.pdf")
+
+        assert search(client, q="report") == ["report_draft.docx", "Quarterly-Report-2024.pdf"]
+        assert search(client, q="REPORT", match="prefix") == ["report_draft.docx"]
+        assert search(client, q="pdf") == ["Quarterly-Report-2024.pdf"]
+        assert search(client, q="image/", match="prefix") == ["holiday.jpg"]
+        # Too short for the trigram index, still answered.
+        assert search(client, q="jp") == ["holiday.jpg"]
+        # LIKE wildcards in the query are literal.
+        assert search(client, q="0%_") == ["100%_done.txt"]
+        assert search(client, q="r_p") == []
+        assert search(client, q="report", min_size=len("report_draft.docx") + 1) == ["Quarterly-Report-2024.pdf"]
+        assert search(client, q="report", content_type="application/pdf") == ["Quarterly-Report-2024.pdf"]
+
+        first_page = client.get("/files/search", headers=HEADERS, params={"q": "report", "limit": 1})
+        assert [item["filename"] for item in first_page.json()] == ["report_draft.docx"]
+        cursor = first_page.headers["x-next-cursor"]
+        assert search(client, q="report", limit=1, cursor=cursor) == ["Quarterly-Report-2024.pdf"]
+
+        assert client.get("/files/search", headers=HEADERS, params={"q": ""}).status_code == 422
+
+
+def test_index_follows_uploads_deletes_and_existing_rows(tmp_path: Path):
+    from app import database, search as search_module
+
+    with build_client(tmp_path) as client:
+        kept = upload_file(client, "111", "keep-me.txt", b"keep-me.txt")
+        gone = upload_file(client, "111", "remove-me.txt", b"remove-me.txt")
+        assert fts_rowids() == [kept, gone]
+
+        assert client.delete(f"/files/{gone}", headers=HEADERS).status_code == 204
+        assert search(client, q="me.txt") == ["keep-me.txt"]
+        purge_deleted(client)
+        assert fts_rowids() == [kept]
+
+        # A database that predates the index is backfilled when the index is created.
+        with database.engine.begin() as connection:
+            connection.execute(text("DROP TABLE stored_files_fts"))
+        search_module.init_search_index(database.engine)
+        assert search_module.search_backend is None
+        with database.engine.begin() as connection:
+            assert search_module.create_search_index(connection)
+        search_module.init_search_index(database.engine)
+        assert fts_rowids() == [kept]
+        assert search(client, q="keep") == ["keep-me.txt"]
+
+
+def test_common_terms_fall_back_to_scanning_the_owners_files(tmp_path: Path, monkeypatch):
+    from app import search as search_module
+
+    monkeypatch.setattr(search_module, "INDEX_CANDIDATE_LIMIT", 1)
+    with build_client(tmp_path) as client:
+        for name in ("invoice-1.pdf", "invoice-2.pdf", "notes.txt"):
+            upload_file(client, "111", name, name.encode())
+        upload_file(client, "222", "invoice-3.pdf", b"invoice-3.pdf")
+        assert search(client, q="invoice") == ["invoice-2.pdf", "invoice-1.pdf"]
+        assert search(client, q="notes") == ["notes.txt"]
+
+
+def test_index_candidates_are_limited_per_owner(tmp_path: Path, monkeypatch):
+    from app import database, search as search_module
+
+    monkeypatch.setattr(search_module, "INDEX_CANDIDATE_LIMIT", 2)
+
+    async def candidates(query: str, owner_user_id: int):
+        async with database.AsyncSessionLocal() as db:
+            return await search_module.indexed_candidates(db, query, owner_user_id)
+
+    with build_client(tmp_path) as client:
+        mine = [upload_file(client, "111", name, name.encode()) for name in ("invoice-1.pdf", "invoice-2.pdf")]
+        for index in range(3):
+            upload_file(client, "1111", f"invoice-{index}.pdf", f"invoice-{index}.pdf".encode())
+        # Another owner's many matches neither crowd out nor leak into this owner's candidates.
+        assert sorted(client.portal.call(candidates, "invoice", 111)) == mine
+        assert client.portal.call(candidates, "invoice", 1111) is None
+        assert client.portal.call(candidates, "invoice", 11) == []
@@ -0,0 +1,165 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import inspect, select, text
+
+from test_api import build_client
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+HEADERS = {"X-User-Id": "111"}
+
+# The two tables as create_all built them before any later column existed.
+LEGACY_SCHEMA = (
+    """CREATE TABLE stored_files (
+        id INTEGER PRIMARY KEY, owner_user_id INTEGER NOT NULL, original_filename VARCHAR(255) NOT NULL,
+        stored_filename VARCHAR(255) NOT NULL UNIQUE, content_type VARCHAR(255) NOT NULL,
+        size_bytes INTEGER NOT NULL, upload_path VARCHAR(1024) NOT NULL, created_at DATETIME NOT NULL)""",
+    """CREATE TABLE link_audits (
+        id INTEGER PRIMARY KEY, file_id INTEGER NOT NULL REFERENCES stored_files (id),
+        requester_user_id INTEGER NOT NULL, ttl_seconds INTEGER NOT NULL, created_at DATETIME NOT NULL)""",
+    """INSERT INTO stored_files VALUES
+        (1, 111, 'legacy-report.pdf', 'a', 'application/pdf', 40, 'a', '2024-01-01 00:00:00'),
+        (2, 111, 'legacy-notes.txt', 'b', 'text/plain', 2, 'b', '2024-01-02 00:00:00')""",
+)
+
+
+def init_database(tmp_path: Path):
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp_path / 'test.db'}"
+    os.environ["UPLOAD_DIR"] = str(tmp_path / "uploads")
+    os.environ["SIGNING_SECRET"] = "test-secret"
+    from app import database
+    from app.config import get_settings
+
+    database.init_database(get_settings())
+    return database.engine
+
+
+def test_importing_main_does_not_build_the_app(tmp_path: Path):
+    upload_dir = tmp_path / "uploads"
+    script = (
+        "import app.main\n"
+        "assert 'app' not in vars(app.main)\n"
+        f"assert not __import__('os').path.exists({str(upload_dir)!r})\n"
+        "print(type(app.main.app).__name__)\n"
+    )
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{tmp_path / 'test.db'}",
+        "UPLOAD_DIR": str(upload_dir),
+        "SIGNING_SECRET": "test-secret",
+    }
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "FastAPI"
+    assert upload_dir.is_dir()
+
+
+def test_migrations_run_once_even_when_workers_race(tmp_path: Path):
+    from app import migrations
+
+    engine = init_database(tmp_path)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        reports = list(pool.map(lambda _: migrations.migrate(engine), range(4)))
+
+    # Exactly one caller applied every step; the others found them done.
+    applied = [report.applied for report in reports if report.applied]
+    assert len(applied) == 1 and len(applied[0]) == migrations.HEAD
+    assert all(report.to_version == migrations.HEAD for report in reports)
+    assert migrations.current_version(engine) == migrations.HEAD
+    with engine.connect() as connection:
+        versions = list(connection.scalars(select(migrations.schema_migrations.c.version)))
+    assert versions == list(range(1, migrations.HEAD + 1))
+    assert migrations.migrate(engine).applied == []
+
+
+def test_migrations_upgrade_a_database_created_before_them(tmp_path: Path):
+    from app import migrations
+
+    engine = init_database(tmp_path)
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.execute(text(statement))
+
+    assert migrations.migrate(engine, dry_run=True).pending
+    assert migrations.current_version(engine) == 0
+    migrations.migrate(engine)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("stored_files")}
+    assert {"content_encoding", "stored_size_bytes", "blob_id", "deleted_at"} <= columns
+    assert "link_id" in {column["name"] for column in inspect(engine).get_columns("link_audits")}
+    indexes = {index["name"] for index in inspect(engine).get_indexes("stored_files")}
+    assert "ix_stored_files_owner_created_id" in indexes
+
+    with build_client(tmp_path) as client:
+        assert client.get("/files/usage", headers=HEADERS).json()["bytes_used"] == 42
+        response = client.get("/files/search", headers=HEADERS, params={"q": "report"})
+        assert [item["filename"] for item in response.json()] == ["legacy-report.pdf"]
+
+
+def test_ready_reports_startup_and_first_request(tmp_path: Path):
+    from app import metrics
+
+    def request_counts() -> list[str]:
+        return [line for line in metrics.render().splitlines() if line.startswith("http_requests_total")]
+
+    client = build_client(tmp_path)
+    before = request_counts()
+    with client:
+        # The warm-up requests are neither counted nor taken for the first request.
+        assert request_counts() == before
+        ready = client.get("/ready")
+        assert ready.status_code == 200
+        body = ready.json()
+        assert body["status"] == "ready"
+        assert body["seconds_to_first_request"] is None
+        assert {"import", "create_app", "migrate", "warm_up"} <= set(body["phases"])
+        assert body["seconds_to_ready"] is not None
+
+        assert client.get("/files", headers=HEADERS).status_code == 200
+        assert client.get("/ready").json()["seconds_to_first_request"] is not None
+        assert 'app_startup_seconds{milestone="ready"}' in client.get("/metrics").text
+
+
+def test_startup_refuses_an_outdated_schema_without_migrating(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("DB_MIGRATE_ON_STARTUP", "false")
+    with pytest.raises(RuntimeError, match="app.cli migrate"):
+        with build_client(tmp_path):
+            pass
+
+    from app import database, migrations
+
+    migrations.migrate(database.engine)
+    with build_client(tmp_path) as client:
+        assert client.get("/ready").status_code == 200
+
+
+def test_migrations_build_the_schema_the_models_describe(tmp_path: Path):
+    from app import migrations, models
+
+    engine = init_database(tmp_path)
+    migrations.migrate(engine)
+    inspector = inspect(engine)
+    for table in models.Base.metadata.sorted_tables:
+        migrated = {
+            column["name"]: (column["type"].compile(engine.dialect), column["nullable"])
+            for column in inspector.get_columns(table.name)
+        }
+        described = {column.name: (column.type.compile(engine.dialect), column.nullable) for column in table.columns}
+        assert migrated == described, table.name
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        assert {index.name for index in table.indexes} <= indexes, table.name
+
+
+def test_file_sizes_are_64_bit_on_postgres():
+    from sqlalchemy.dialects import postgresql
+
+    from app import models
+
+    for column in (models.StoredFile.size_bytes, models.Blob.size_bytes, models.Blob.stored_size_bytes):
+        assert column.type.compile(postgresql.dialect()) == "BIGINT"
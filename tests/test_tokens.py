@@ -0,0 +1,78 @@
+from fastapi import HTTPException
+import pytest
+
+from app.config import get_settings
+from app.utils import create_compact_token, decode_compact_token, issue_download_token, verify_download_token
+
+
+def test_compact_token_round_trip_and_is_shorter_than_jwt(monkeypatch):
+    monkeypatch.setenv("SIGNING_SECRET", "test-secret")
+    settings = get_settings()
+    compact = issue_download_token(settings, 12, 34, 600)
+
+    monkeypatch.setenv("TOKEN_FORMAT", "jwt")
+    jwt_token = issue_download_token(get_settings(), 12, 34, 600)
+
+    for token in (compact, jwt_token):
+        payload = verify_download_token(token, settings)
+        assert (payload["file_id"], payload["owner_user_id"], payload["sub"]) == (12, 34, "file-download")
+    assert "." not in compact
+    assert len(compact) < len(jwt_token) / 3
+
+
+def test_compact_token_rejects_tampering_and_expiry():
+    keys = {1: "key-one"}
+    token = create_compact_token(5, 6, 600, 1, keys[1])
+    raw = bytearray(token.encode())
+    raw[4] = ord("A") if raw[4] != ord("A") else ord("B")
+
+    for bad in (bytes(raw).decode(), token[:-2], "!!not-base64!!", create_compact_token(5, 6, -1, 1, keys[1])):
+        with pytest.raises(HTTPException) as exc_info:
+            decode_compact_token(bad, keys)
+        assert exc_info.value.status_code == 403
+
+
+def test_compact_token_carries_64_bit_ids():
+    keys = {1: "key-one"}
+    short = create_compact_token(5, 2**32 - 1, 600, 1, keys[1])
+    wide = create_compact_token(5, 2**63 - 1, 600, 1, keys[1])
+    assert len(wide) == len(short) + 10
+    assert decode_compact_token(short, keys)["owner_user_id"] == 2**32 - 1
+    payload = decode_compact_token(wide, keys)
+    assert (payload["file_id"], payload["owner_user_id"]) == (5, 2**63 - 1)
+
+
+def test_signed_links_for_users_past_32_bits(tmp_path):
+    from test_api import build_client, upload_and_sign
+
+    user_id = str(2**40)
+    with build_client(tmp_path) as client:
+        token = upload_and_sign(client, user_id, "wide.txt", b"wide")
+        assert client.get(f"/download/{token}").content == b"wide"
+        too_large = client.get("/files", headers={"X-User-Id": str(2**63)})
+        assert too_large.status_code == 400
+
+
+def test_compact_token_key_rotation(monkeypatch):
+    monkeypatch.setenv("SIGNING_KEYS", "1:old-secret")
+    old_token = issue_download_token(get_settings(), 1, 2, 600)
+
+    monkeypatch.setenv("SIGNING_KEYS", "1:old-secret,2:new-secret")
+    rotated = get_settings()
+    assert rotated.signing_key_id == 2
+    assert verify_download_token(old_token, rotated)["file_id"] == 1
+    assert verify_download_token(issue_download_token(rotated, 3, 2, 600), rotated)["file_id"] == 3
+
+    monkeypatch.setenv("SIGNING_KEYS", "2:new-secret")
+    with pytest.raises(HTTPException):
+        verify_download_token(old_token, get_settings())
+
+
+def test_invalid_signing_keys_raise(monkeypatch):
+    monkeypatch.setenv("SIGNING_KEYS", "abc")
+    with pytest.raises(ValueError, match="SIGNING_KEYS"):
+        get_settings()
+    monkeypatch.setenv("SIGNING_KEYS", "1:a")
+    monkeypatch.setenv("SIGNING_KEY_ID", "9")
+    with pytest.raises(ValueError, match="SIGNING_KEY_ID"):
+        get_settings()
@@ -0,0 +1,104 @@
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from test_api import build_client
+
+
+HEADERS = {"X-User-Id": "111"}
+
+
+def upload(client: TestClient, content: bytes, name: str = "data.bin"):
+    return client.post(
+        "/files/upload", headers=HEADERS, files={"file": (name, content, "application/octet-stream")}
+    )
+
+
+def usage(client: TestClient, user_id: str = "111") -> dict:
+    response = client.get("/files/usage", headers={"X-User-Id": user_id})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_usage_follows_uploads_and_deletes(tmp_path: Path):
+    with build_client(tmp_path) as client:
+        assert usage(client) == {
+            "user_id": 111, "bytes_used": 0, "file_count": 0, "last_upload_at": None, "quota_bytes": None
+        }
+
+        first = upload(client, b"a" * 100).json()["file_id"]
+        # Identical content is stored once but still counts against its uploader.
+        upload(client, b"a" * 100)
+        upload(client, b"b" * 50)
+        current = usage(client)
+        assert (current["bytes_used"], current["file_count"]) == (250, 3)
+        assert current["last_upload_at"] is not None
+        assert usage(client, "222")["file_count"] == 0
+
+        assert client.delete(f"/files/{first}", headers=HEADERS).status_code == 204
+        assert client.delete(f"/files/{first}", headers=HEADERS).status_code == 404
+        current = usage(client)
+        assert (current["bytes_used"], current["file_count"]) == (150, 2)
+
+
+def test_quota_stops_uploads_while_they_stream(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("USER_QUOTA_BYTES", "1000")
+    monkeypatch.setenv("UPLOAD_CHUNK_SIZE_BYTES", "100")
+    with build_client(tmp_path) as client:
+        assert upload(client, b"x" * 600).status_code == 201
+
+        refused = upload(client, b"y" * 600)
+        assert refused.status_code == 413
+        assert refused.json()["detail"] == "Storage quota exceeded (1000 bytes)"
+        assert not list((tmp_path / "uploads" / ".tmp").iterdir())
+        assert client.get("/files", headers=HEADERS).json()[0]["size_bytes"] == 600
+
+        assert upload(client, b"z" * 400).status_code == 201
+        current = usage(client)
+        assert (current["bytes_used"], current["quota_bytes"]) == (1000, 1000)
+
+
+def test_quota_applies_to_resumable_uploads(tmp_path: Path, monkeypatch):
+    kib = 1024
+    monkeypatch.setenv("USER_QUOTA_BYTES", str(300 * kib))
+    with build_client(tmp_path) as client:
+        assert upload(client, b"x" * 100 * kib).status_code == 201
+        created = client.post("/files/uploads", headers=HEADERS, json={"filename": "big.bin", "part_size": 64 * kib})
+        parts = f"/files/uploads/{created.json()['upload_id']}/parts"
+        for part_number in (1, 2, 3):
+            response = client.put(f"{parts}/{part_number}", headers=HEADERS, content=b"p" * 64 * kib)
+            assert response.status_code == 200
+        assert client.put(f"{parts}/4", headers=HEADERS, content=b"q" * 64 * kib).status_code == 413
+
+        # A retried part replaces its earlier attempt rather than adding to it.
+        assert client.put(f"{parts}/3", headers=HEADERS, content=b"r" * 64 * kib).status_code == 200
+        assert client.put(f"{parts}/4", headers=HEADERS, content=b"s" * 8 * kib).status_code == 200
+        completed = client.post(parts.rsplit("/", 1)[0] + "/complete", headers=HEADERS)
+        assert completed.status_code == 201
+        assert usage(client)["bytes_used"] == 300 * kib
+
+
+def test_rebuild_usage_repairs_drifted_counters(tmp_path: Path):
+    from app import database
+    from app.models import UserUsage
+    from app.usage import rebuild_usage
+
+    with build_client(tmp_path) as client:
+        upload(client, b"a" * 100)
+        upload(client, b"b" * 200)
+
+        with database.SessionLocal() as db:
+            db.get(UserUsage, 111).bytes_used = 7
+            db.add(UserUsage(user_id=333, bytes_used=50, file_count=1))
+            db.commit()
+
+            report = rebuild_usage(db, batch_size=1, dry_run=True)
+            assert (report.users_checked, report.corrected_user_ids) == (2, [111, 333])
+            assert usage(client)["bytes_used"] == 7
+
+            report = rebuild_usage(db, batch_size=1)
+            assert report.corrected_user_ids == [111, 333]
+            assert rebuild_usage(db).users_corrected == 0
+
+        assert (usage(client)["bytes_used"], usage(client)["file_count"]) == (300, 2)
+        assert usage(client, "333")["bytes_used"] == 0
@@ -0,0 +1,97 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from sqlalchemy import select, text
+
+from app import database
+from app.config import get_settings
+from app.models import LinkAudit
+
+
+@pytest.fixture
+def sqlite_database(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'writer.db'}")
+    database.init_database(get_settings())
+    database.Base.metadata.create_all(bind=database.engine)
+    return database
+
+
+def test_sqlite_connections_use_wal(sqlite_database):
+    with sqlite_database.engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1
+
+
+def test_write_queue_group_commits_and_isolates_failures(sqlite_database):
+    async def scenario():
+        queue = sqlite_database.write_queue
+        queue.start()
+
+        def insert_audit(index: int):
+            async def op(session):
+                session.add(LinkAudit(file_id=1, requester_user_id=index, ttl_seconds=60))
+                if index == 5:
+                    raise ValueError("boom")
+                return index
+
+            return op
+
+        results = await asyncio.gather(
+            *(queue.submit(insert_audit(index)) for index in range(20)), return_exceptions=True
+        )
+        await queue.stop()
+
+        async with sqlite_database.AsyncSessionLocal() as session:
+            requesters = set(await session.scalars(select(LinkAudit.requester_user_id)))
+        await sqlite_database.async_engine.dispose()
+        return queue, results, requesters
+
+    queue, results, requesters = asyncio.run(scenario())
+
+    assert isinstance(results[5], ValueError)
+    assert [result for index, result in enumerate(results) if index != 5] == [i for i in range(20) if i != 5]
+    assert requesters == set(range(20)) - {5}
+    assert queue.ops_committed == 19
+    assert queue.batches_committed < 20
+
+
+def test_write_queue_takes_the_write_lock_before_reading(sqlite_database):
+    import threading
+    import time
+
+    locked = threading.Event()
+
+    def hold_write_lock():
+        with sqlite_database.engine.connect().execution_options(sqlite_immediate=True) as connection:
+            with connection.begin():
+                connection.execute(
+                    text(
+                        "INSERT INTO link_audits (file_id, requester_user_id, ttl_seconds, created_at) "
+                        "VALUES (1, 1, 60, '2026-01-01')"
+                    )
+                )
+                locked.set()
+                time.sleep(0.3)
+
+    async def read_then_write(session):
+        count = len((await session.scalars(select(LinkAudit.id))).all())
+        session.add(LinkAudit(file_id=1, requester_user_id=2, ttl_seconds=60))
+        return count
+
+    async def scenario():
+        queue = sqlite_database.write_queue
+        queue.start()
+        holder = threading.Thread(target=hold_write_lock)
+        holder.start()
+        locked.wait()
+        try:
+            # With a deferred BEGIN the op reads before the holder commits and
+            # then writes based on a stale snapshot.
+            return await queue.submit(read_then_write)
+        finally:
+            await queue.stop()
+            holder.join()
+            await sqlite_database.async_engine.dispose()
+
+    assert asyncio.run(scenario()) == 1
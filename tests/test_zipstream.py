@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+import io
+from pathlib import Path
+import zipfile
+
+from app.zipstream import ZipEntry, iter_zip, unique_archive_names
+
+
+def _entries(tmp_path: Path, contents: dict[str, bytes]) -> list[ZipEntry]:
+    entries = []
+    for name, data in contents.items():
+        path = tmp_path / name
+        path.write_bytes(data)
+        entries.append(ZipEntry(name=name, path=path, size_bytes=len(data), modified_at=datetime.now(timezone.utc)))
+    return entries
+
+
+def test_iter_zip_streams_stored_members(tmp_path: Path):
+    contents = {"a.txt": b"alpha", "b.bin": bytes(range(256)) * 10}
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(iter_zip(_entries(tmp_path, contents)))))
+
+    assert archive.testzip() is None
+    for info in archive.infolist():
+        assert info.compress_type == zipfile.ZIP_STORED
+        assert archive.read(info.filename) == contents[info.filename]
+
+
+def test_iter_zip_emits_zip64_records(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(zipfile, "ZIP64_LIMIT", 16)
+    data = b"x" * 64
+    raw = b"".join(iter_zip(_entries(tmp_path, {"large.bin": data})))
+
+    assert b"PK\x06\x06" in raw
+    monkeypatch.undo()
+    assert zipfile.ZipFile(io.BytesIO(raw)).read("large.bin") == data
+
+
+def test_unique_archive_names():
+    assert unique_archive_names(["a.txt", "a.txt", "dir/a.txt", "b"]) == ["a.txt", "a (2).txt", "a (3).txt", "b"]